@@ -1,11 +1,12 @@
 #!/bin/bash
 
 if [ -z "$1" ]; then
-  echo "Usage: $0 <input_file>"
+  echo "Usage: $0 <input_file> [concurrency]"
   exit 1
 fi
 
 input_file="$1"
+concurrency="${2:-4}"
 collection="gaunal_collection"
 values=("quimica" "control" "electronica" "mecanica" "electrica" "robotica")
 
@@ -14,10 +15,18 @@ if [ ! -f "$input_file" ]; then
   exit 1
 fi
 
+# Build a single manifest and submit it as one ingestion job
+documents=""
 while IFS= read -r path; do
-  curl -X POST 'http://localhost:5000/chroma/embed_document' \
-    -H 'Content-Type: application/json' \
-    -d "{\"collection_name\": \"$collection\", \"categories\": [\"${values[$RANDOM % ${#values[@]}]}\"], \"file_path\": \"$path\"}"
-
-  echo
+  [ -z "$path" ] && continue
+  escaped_path=$(printf '%s' "$path" | sed 's/\\/\\\\/g; s/"/\\"/g')
+  category="${values[$RANDOM % ${#values[@]}]}"
+  documents+="${documents:+,}{\"file_path\": \"$escaped_path\", \"categories\": [\"$category\"]}"
 done < "$input_file"
+
+curl -X POST 'http://localhost:5000/chroma/bulk_embed' \
+  -H 'Content-Type: application/json' \
+  -d "{\"collection_name\": \"$collection\", \"concurrency\": $concurrency, \"documents\": [$documents]}"
+echo
+
+echo "Follow the job with: curl http://localhost:5000/chroma/bulk_embed/<JOB_ID>"
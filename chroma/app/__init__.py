@@ -1,8 +1,17 @@
 import redis
 from chroma_ms_config import Configuration
+from chroma.app.domain.category_cache import (CategoryCache,
+                                              CategoryPresenceCache)
+from chroma.app.domain.category_versions import CategoryVersions
+from utils.task_results import TaskResultStore
 
 redis_client = redis.StrictRedis.from_url(Configuration.CELERY_RESULT_BACKEND)
-loaded_collections = {}
+loaded_collections = CategoryCache.from_configuration()
+category_presence = CategoryPresenceCache(Configuration.CATEGORY_PRESENCE_TTL)
+category_versions = CategoryVersions(redis_client)
+task_results = TaskResultStore.from_configuration(redis_client,
+                                                  Configuration,
+                                                  Configuration.CHROMA_QUEUE)
 
 
 def test_redis_connection():
@@ -16,5 +25,9 @@ def test_redis_connection():
 
 
 test_redis_connection()
-__all__ = ["redis_client", "loaded_collections"]
+__all__ = ["redis_client",
+           "loaded_collections",
+           "category_presence",
+           "category_versions",
+           "task_results"]
 
@@ -1,5 +1,12 @@
+from chroma.app import redis_client
+from chroma.app.domain.chroma_collections import RETRIEVAL_MODES
+from chroma.app.domain.ingestion_jobs import (IngestionJobs,
+                                              merge_documents,
+                                              parse_manifest)
 from chroma.app.task_executor import (chroma_search_query_task,
                                       chroma_embed_task,
+                                      retry_ingestion_job,
+                                      start_ingestion_job,
                                       sse_stream)
 from utils.request_validator import (validate_params, get_request_data)
 from flask import Blueprint, request, jsonify, Response
@@ -29,16 +36,25 @@ def execute_basic_chroma_query():
     (user_query,
      category,
      collection_name,
-     callback_url) = get_request_data(request_data,
-                                      'user_query',
-                                      'category',
-                                      'collection_name',
-                                      'callback_url')
+     callback_url,
+     retrieval_mode) = get_request_data(request_data,
+                                        'user_query',
+                                        'category',
+                                        'collection_name',
+                                        'callback_url',
+                                        'retrieval_mode')
+
+    retrieval_mode = retrieval_mode or Configuration.RETRIEVAL_MODE
+    if retrieval_mode not in RETRIEVAL_MODES:
+        return jsonify({
+            'STATE': 'Query failed',
+            'DESCRIPTION': f'Unknown retrieval mode {retrieval_mode}, '
+                           f'expected one of {", ".join(RETRIEVAL_MODES)}.'})
 
     if validate_params(
             collection_name, category, user_query):
         task = chroma_search_query_task.apply_async(
-            args=[collection_name, category, user_query],
+            args=[collection_name, category, user_query, retrieval_mode],
             queue=Configuration.CHROMA_QUEUE)
         return Response(sse_stream(task.id), content_type='text/event-stream')
 
@@ -61,7 +77,7 @@ def process_pdf_file():
     if validate_params(file_path, categories, collection_name):
         task = chroma_embed_task.apply_async(
             args=[collection_name, file_path, categories],
-            queue=Configuration.CHROMA_QUEUE)
+            queue=Configuration.CHROMA_INGESTION_QUEUE)
         return Response(sse_stream(task.id), content_type='text/event-stream')
 
 @chroma_router.post("/form_embed_document")
@@ -76,5 +92,90 @@ def form_process_pdf_file():
     if validate_params(uploaded_file, categories, collection_name):
         task = chroma_embed_task.apply_async(
             args=[collection_name, file_path, [categories], True],
-            queue=Configuration.CHROMA_QUEUE)
+            queue=Configuration.CHROMA_INGESTION_QUEUE)
         return Response(sse_stream(task.id), content_type='text/event-stream')
+
+
+@chroma_router.post("/bulk_embed")
+def bulk_process_pdf_files():
+    """
+    Start an ingestion job for many files. Files are given either as a
+    `documents` list of {file_path, categories} or as a server side
+    `manifest_path` with `categories` applied to lines that have none.
+    """
+    request_data = json.loads(request.data.decode('utf-8'))
+    (documents,
+     manifest_path,
+     categories,
+     collection_name,
+     concurrency) = get_request_data(request_data,
+                                     'documents',
+                                     'manifest_path',
+                                     'categories',
+                                     'collection_name',
+                                     'concurrency')
+
+    if categories and not isinstance(categories, list):
+        return _bulk_request_error('categories must be a list.')
+
+    try:
+        concurrency = int(concurrency or Configuration.BULK_INGESTION_CONCURRENCY)
+    except (TypeError, ValueError):
+        return _bulk_request_error('concurrency must be a whole number.')
+    if concurrency < 1:
+        return _bulk_request_error('concurrency must be at least 1.')
+
+    if manifest_path:
+        try:
+            documents = parse_manifest(manifest_path, categories or [])
+        except (OSError, UnicodeDecodeError) as e:
+            return _bulk_request_error(f'Could not read manifest {manifest_path}: {e}')
+    elif documents:
+        if (not isinstance(documents, list)
+                or not all(isinstance(document, dict) for document in documents)):
+            return _bulk_request_error('documents must be a list of '
+                                       '{file_path, categories} objects.')
+        documents = [(document.get('file_path'), document.get('categories'))
+                     for document in documents]
+
+    if (not validate_params(documents, collection_name)
+            or not all(file_path and isinstance(categories, list) and categories
+                       for file_path, categories in documents)):
+        return _bulk_request_error('Please provide a collection and files with '
+                                   'their categories to start the ingestion.')
+
+    documents = merge_documents(documents)
+    job_id = start_ingestion_job(collection_name, documents, concurrency)
+    return jsonify({'STATE': 'OK',
+                    'DESCRIPTION': f'Started ingestion of {len(documents)} files',
+                    'JOB_ID': job_id}), 202
+
+
+def _bulk_request_error(description: str):
+    return jsonify({'STATE': 'ERROR', 'DESCRIPTION': description}), 400
+
+
+@chroma_router.get("/bulk_embed/<job_id>")
+def bulk_ingestion_progress(job_id):
+    progress = IngestionJobs(redis_client).progress(job_id)
+    if not progress:
+        return jsonify({'STATE': 'ERROR',
+                        'DESCRIPTION': f'Unknown ingestion job {job_id}'}), 404
+    return jsonify(progress)
+
+
+@chroma_router.post("/bulk_embed/<job_id>/retry")
+def retry_bulk_ingestion(job_id):
+    if not IngestionJobs(redis_client).get(job_id):
+        return jsonify({'STATE': 'ERROR',
+                        'DESCRIPTION': f'Unknown ingestion job {job_id}'}), 404
+    retried = retry_ingestion_job(job_id)
+    return jsonify({'STATE': 'OK',
+                    'DESCRIPTION': f'Retrying {retried} failed files',
+                    'JOB_ID': job_id})
+
+
+@chroma_router.get("/stream/<task_id>")
+def follow_task_stream(task_id):
+    """Reopen the result stream of a task, for clients that lost theirs."""
+    return Response(sse_stream(task_id), content_type='text/event-stream')
@@ -0,0 +1,281 @@
+import asyncio
+import os
+import threading
+
+import chromadb
+
+from chromadb.errors import InvalidCollectionException
+
+from chroma.app import category_presence
+from chroma.app.domain.chroma_collections import ChromaCollections, LEXICAL_MODES
+from chroma_ms_config import Configuration
+from utils.outputs import (print_error,
+                           print_header_message,
+                           print_successful_message,
+                           print_warning_message)
+
+
+class WorkerEventLoop:
+    """
+    One asyncio event loop per worker process, running on a daemon thread.
+    Celery tasks hand their coroutines to it and wait for the result, so
+    every task of the process shares the same async client and connections
+    and several in-flight searches overlap their Chroma calls.
+    """
+    _loop = None
+    _pid = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls) -> asyncio.AbstractEventLoop:
+        if cls._loop is not None and cls._pid == os.getpid():
+            return cls._loop
+
+        with cls._lock:
+            if cls._loop is None or cls._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever,
+                                 name="worker-event-loop",
+                                 daemon=True).start()
+                cls._loop = loop
+                cls._pid = os.getpid()
+                AsyncChromaSearch.reset()
+            return cls._loop
+
+    @classmethod
+    def run(cls, coroutine, timeout: float = None):
+        return asyncio.run_coroutine_threadsafe(coroutine, cls.get()).result(timeout)
+
+
+class AsyncChromaSearch:
+    """
+    asyncio version of ChromaCollections.execute_search_query. Calls that do
+    not depend on each other run concurrently: the query embedding and the
+    cached category lookup, then the category check and the query itself.
+    Work without an async client runs on the default executor: the query
+    embedding, the BM25 lookup of the lexical modes, the category version
+    read from Redis and the Celery hand-off to the langchain service.
+    At most CHROMA_MAX_CONCURRENT_CALLS Chroma requests are in flight per
+    process and each one is bounded by CHROMA_CALL_TIMEOUT.
+    """
+    _instance = None
+
+    def __init__(self):
+        self._client = None
+        self._collections: dict = {}
+        self._semaphore = asyncio.Semaphore(Configuration.CHROMA_MAX_CONCURRENT_CALLS)
+
+    @classmethod
+    def instance(cls) -> "AsyncChromaSearch":
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def reset(cls) -> None:
+        cls._instance = None
+
+    async def _call(self, coroutine_factory):
+        async with self._semaphore:
+            return await asyncio.wait_for(coroutine_factory(),
+                                          timeout=Configuration.CHROMA_CALL_TIMEOUT)
+
+    @staticmethod
+    async def _in_executor(function, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def client(self):
+        if self._client is None:
+            self._client = await self._call(
+                lambda: chromadb.AsyncHttpClient(host=Configuration.CHROMA_URL,
+                                                 port=8000))
+        return self._client
+
+    async def collection(self, collection_name: str):
+        handle = self._collections.get(collection_name)
+        if handle is not None:
+            return handle
+
+        client = await self.client()
+        try:
+            handle = await self._call(
+                lambda: client.get_collection(name=collection_name))
+        except (ValueError, InvalidCollectionException):
+            print_warning_message(message="Collection does not exist.",
+                                  app=Configuration.CHROMA_QUEUE)
+            print_header_message(message="Creating collection...",
+                                 app=Configuration.CHROMA_QUEUE)
+            handle = await self._call(
+                lambda: client.create_collection(
+                    name=collection_name,
+                    metadata={"hnsw:space": "cosine"}))
+        self._collections[collection_name] = handle
+        return handle
+
+    async def category_has_documents(self, collection, category: str,
+                                     refresh: bool = False) -> bool:
+        key = (collection.name, category)
+        if not refresh and key in category_presence:
+            return True
+
+        result = await self._call(lambda: collection.get(where={category: 1},
+                                                         limit=1,
+                                                         include=[]))
+        found = bool(result['ids'])
+        if found:
+            category_presence.add(key)
+        else:
+            category_presence.discard(key)
+        return found
+
+    @staticmethod
+    def _cached_category_data(collection_name: str, category: str):
+        # Only the category version is read from Redis, a miss loads the
+        # category with the sync client on a background thread
+        return ChromaCollections.cached_category_data(collection_name, category)
+
+    @staticmethod
+    def _embed_texts(query_texts: list[str]):
+        return ChromaCollections.EmbedderFunction()(query_texts)
+
+    async def lexical_query(self, collection, category: str, user_query: str,
+                            query_embeddings, category_data: dict = None,
+                            max_results: int = 5, mode: str = "lexical"):
+        chunk_ids = await self._in_executor(ChromaCollections.lexical_candidates,
+                                            collection.name,
+                                            category,
+                                            user_query,
+                                            mode,
+                                            max_results)
+        if not chunk_ids:
+            return None
+
+        rows = ChromaCollections.cached_rows(category_data, chunk_ids)
+        if rows is None:
+            rows = await self._call(lambda: collection.get(
+                ids=chunk_ids,
+                include=ChromaCollections.lexical_include(mode)))
+        return ChromaCollections.rank_lexical_candidates(
+            chunk_ids, rows, max_results,
+            query_embeddings if mode == "hybrid" else None)
+
+    async def query(self, collection, category: str, query_embeddings,
+                    category_data: dict = None, max_results: int = 5,
+                    mode: str = "terms", user_query: str = None):
+        if mode in LEXICAL_MODES and user_query is not None:
+            results = await self.lexical_query(collection, category, user_query,
+                                               query_embeddings, category_data,
+                                               max_results, mode)
+            if results is not None:
+                return results
+            # The query embedding is the one used by the query mode
+            mode = "query"
+
+        results = None
+        if category_data is not None:
+            results = ChromaCollections.local_query(category_data,
+                                                    query_embeddings,
+                                                    max_results)
+        if results is None:
+            try:
+                results = await self._call(lambda: collection.query(
+                    query_embeddings=query_embeddings,
+                    where={category: {"$eq": 1}},
+                    n_results=max_results,
+                    include=ChromaCollections.query_include(mode)))
+            except InvalidCollectionException:
+                raise
+            except Exception as e:
+                print_error(f"Error querying ChromaDB: {e!r}",
+                            app=Configuration.CHROMA_QUEUE)
+                results = {"documents": [], "metadatas": [], "ids": []}
+        return ChromaCollections.rank_results(results, max_results, mode)
+
+    async def execute_search_query(self,
+                                   collection_name,
+                                   category,
+                                   user_query,
+                                   task_id,
+                                   max_tries: int = 2,
+                                   retrieval_mode: str = None):
+        retrieval_mode = retrieval_mode or Configuration.RETRIEVAL_MODE
+        print_header_message(
+            message=("Received request: " + ChromaCollections._parse_request(
+                "query", collection_name, category, user_query)),
+            app=Configuration.CHROMA_QUEUE)
+        try:
+            try:
+                return await self._search(collection_name, category,
+                                          user_query, task_id, max_tries,
+                                          retrieval_mode)
+            except InvalidCollectionException:
+                print_warning_message(
+                    f"Collection {collection_name} is gone, refreshing its handle...",
+                    Configuration.CHROMA_QUEUE)
+                self._collections.pop(collection_name, None)
+                return await self._search(collection_name, category,
+                                          user_query, task_id, max_tries,
+                                          retrieval_mode)
+        except asyncio.TimeoutError:
+            err_message = "Chroma did not answer in time."
+            print_error(err_message, Configuration.CHROMA_QUEUE)
+            return {"STATE": "ERROR", "DESCRIPTION": err_message}
+
+    async def _search(self, collection_name, category, user_query,
+                      task_id, max_tries, retrieval_mode):
+        query_texts = ChromaCollections.query_texts(user_query, retrieval_mode)
+        collection, query_embeddings, category_data = await asyncio.gather(
+            self.collection(collection_name),
+            self._in_executor(self._embed_texts, query_texts),
+            self._in_executor(self._cached_category_data,
+                              collection_name,
+                              category))
+
+        counter = 0
+        refresh = False
+        while True:
+            found_category, query_result = await asyncio.gather(
+                self.category_has_documents(collection, category, refresh),
+                self.query(collection, category, query_embeddings, category_data,
+                           mode=retrieval_mode, user_query=user_query))
+
+            if not found_category:
+                err_message = ("No information found at present for this "
+                               f"category: {category}")
+                print_error(err_message, Configuration.CHROMA_QUEUE)
+                return {"STATE": "ERROR", "DESCRIPTION": err_message}
+            if query_result is not False:
+                break
+            if counter == max_tries:
+                err_message = "Your search yielded no results."
+                print_error(err_message, Configuration.CHROMA_QUEUE)
+                return {"STATE": "ERROR", "DESCRIPTION": err_message}
+
+            print_warning_message("Retrying query...",
+                                  Configuration.CHROMA_QUEUE)
+            counter += 1
+            refresh = True
+            # The cached matrix gave nothing, ask Chroma itself next time
+            category_data = None
+
+        print_successful_message(
+            f"Successfully retrieved db data: {query_result}",
+            Configuration.CHROMA_QUEUE)
+
+        response = await self._in_executor(ChromaCollections._invoke_llm,
+                                           query_result,
+                                           user_query,
+                                           task_id,
+                                           {"RETRIEVAL_MODE": retrieval_mode})
+        return {**response, "RETRIEVAL_MODE": retrieval_mode}
+
+
+def run_search_query(*args, **kwargs):
+    """
+    Run AsyncChromaSearch.execute_search_query on the worker event loop
+    from synchronous code, such as a Celery task.
+    """
+    # Make sure the loop, and with it the search state, belongs to this process
+    WorkerEventLoop.get()
+    return WorkerEventLoop.run(
+        AsyncChromaSearch.instance().execute_search_query(*args, **kwargs))
@@ -0,0 +1,121 @@
+import queue
+import threading
+import time
+
+from chromadb.api.models.Collection import Collection
+
+from chroma_ms_config import Configuration
+from utils.outputs import print_warning_message
+
+_CLOSE = object()
+
+
+class UploadFailedError(Exception):
+    pass
+
+
+class PipelinedUploader:
+    """
+    Upload embedded chunks to a collection on a background thread, so the
+    next batch is embedded while the previous one is sent. Batches are split
+    into UPLOAD_BATCH_CHUNKS sized requests, each retried on its own as an
+    upsert. At most max_pending requests wait for the uploader, which bounds
+    the memory held by embeddings when the upload is slower than the
+    embedding.
+    """
+
+    def __init__(self,
+                 collection: Collection,
+                 batch_size: int = None,
+                 max_retries: int = None,
+                 retry_backoff: float = None,
+                 max_pending: int = 2):
+        self.collection = collection
+        self.batch_size = batch_size or Configuration.UPLOAD_BATCH_CHUNKS
+        self.max_retries = (Configuration.UPLOAD_MAX_RETRIES
+                            if max_retries is None else max_retries)
+        self.retry_backoff = (Configuration.UPLOAD_RETRY_BACKOFF
+                              if retry_backoff is None else retry_backoff)
+        self.uploaded_ids = []
+        self.attempted_ids = []
+        self.stats = {'upload_s': 0.0, 'upload_wait_s': 0.0,
+                      'batches': 0, 'retries': 0}
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def submit(self, documents: list, metadatas: list, embeddings, ids: list) -> None:
+        """
+        Queue embedded chunks for upload, blocking while the uploader is
+        max_pending requests behind. Raises once an upload has failed.
+        """
+        for start in range(0, len(ids), self.batch_size):
+            end = start + self.batch_size
+            self._raise_if_failed()
+            wait_start = time.perf_counter()
+            self._pending.put((documents[start:end],
+                               metadatas[start:end],
+                               embeddings[start:end],
+                               ids[start:end]))
+            self.stats['upload_wait_s'] += time.perf_counter() - wait_start
+
+    def close(self) -> None:
+        """
+        Wait for the queued uploads and raise if any of them failed.
+        """
+        if self._thread.is_alive():
+            wait_start = time.perf_counter()
+            self._pending.put(_CLOSE)
+            self._thread.join()
+            self.stats['upload_wait_s'] += time.perf_counter() - wait_start
+        self._raise_if_failed()
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise UploadFailedError(str(self._error)) from self._error
+
+    def _run(self) -> None:
+        while (batch := self._pending.get()) is not _CLOSE:
+            if self._error is not None:
+                # Drain the queue so producers never block on a dead uploader
+                continue
+            try:
+                self._upload(*batch)
+            except Exception as e:
+                self._error = e
+
+    def _upload(self, documents, metadatas, embeddings, ids) -> None:
+        self.attempted_ids.extend(ids)
+        start_time = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                # A failed request may have been applied on the server, so
+                # retries upsert instead of adding the same ids again
+                send = self.collection.add if attempt == 0 else self.collection.upsert
+                try:
+                    send(documents=documents,
+                         metadatas=metadatas,
+                         embeddings=embeddings,
+                         ids=ids)
+                    break
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        raise
+                    self.stats['retries'] += 1
+                    print_warning_message(
+                        f"Upload of {len(ids)} chunks failed ({e}), "
+                        f"retrying ({attempt + 1}/{self.max_retries})...",
+                        Configuration.CHROMA_QUEUE)
+                    time.sleep(self.retry_backoff * 2 ** attempt)
+        finally:
+            self.stats['upload_s'] += time.perf_counter() - start_time
+        self.uploaded_ids.extend(ids)
+        self.stats['batches'] += 1
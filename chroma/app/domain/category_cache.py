@@ -0,0 +1,186 @@
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+
+import numpy as np
+
+from chroma.app.domain.vector_search import normalize_rows
+from chroma_ms_config import Configuration
+
+
+def compact_category_data(get_result: dict) -> dict:
+    """
+    Keep only the fields used by searches, with the embeddings as a single
+    row-normalized float32 matrix instead of one list of Python floats per
+    chunk, ready for cosine scoring.
+    """
+    ids = list(get_result.get('ids') or [])
+    embeddings = get_result.get('embeddings')
+    if embeddings is None or len(embeddings) == 0:
+        matrix = np.empty((len(ids), 0), dtype=np.float32)
+    else:
+        matrix = normalize_rows(embeddings)
+    return {
+        'ids': ids,
+        'positions': {chunk_id: position for position, chunk_id in enumerate(ids)},
+        'documents': list(get_result.get('documents') or []),
+        'metadatas': list(get_result.get('metadatas') or []),
+        'embeddings': matrix,
+    }
+
+
+def category_data_nbytes(data: dict) -> int:
+    """
+    Approximate memory held by compacted category data.
+    """
+    size = data['embeddings'].nbytes
+    size += sum(sys.getsizeof(value) for value in data['ids'])
+    size += sys.getsizeof(data['positions'])
+    size += sum(sys.getsizeof(value) for value in data['documents'])
+    size += sum(sys.getsizeof(metadata)
+                + sum(sys.getsizeof(key) for key in metadata)
+                for metadata in data['metadatas'] if metadata)
+    return size
+
+
+class CategoryCache:
+    """
+    Per-process cache of the chunks loaded for each category. Entries are
+    tagged with the category version they were loaded at and stay valid
+    until that version changes. Entries stored or looked up without a
+    version expire after ttl seconds instead. The least recently used
+    entries are evicted once the cached data exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._rejected: dict = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'expirations': 0,
+                          'stale': 0, 'evictions': 0, 'rejected': 0}
+
+    @classmethod
+    def from_configuration(cls) -> "CategoryCache":
+        return cls(Configuration.CATEGORY_CACHE_MAX_MB * 1024 * 1024,
+                   Configuration.CATEGORY_CACHE_TTL)
+
+    def get(self, key, version: int = None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            data, expires_at, _, entry_version = entry
+            if version is not None and entry_version is not None:
+                expired = version != entry_version
+                reason = 'stale'
+            else:
+                expired = time.time() >= expires_at
+                reason = 'expirations'
+            if expired:
+                self._drop(key)
+                self._counters[reason] += 1
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return data
+
+    def put(self, key, data: dict, version: int = None) -> None:
+        nbytes = category_data_nbytes(data)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if nbytes > self.max_bytes:
+                # Caching it would evict everything else and still not fit
+                self._counters['rejected'] += 1
+                self._rejected[key] = (version, time.time() + self.ttl)
+                return
+            self._rejected.pop(key, None)
+            self._entries[key] = (data, time.time() + self.ttl, nbytes, version)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+
+    def too_large(self, key, version: int = None) -> bool:
+        """
+        Whether the category was last rejected for not fitting the budget
+        and has not been written since, so loading it again is pointless.
+        """
+        with self._lock:
+            rejected = self._rejected.get(key)
+            if rejected is None:
+                return False
+            rejected_version, expires_at = rejected
+            if version is not None and rejected_version is not None:
+                return version == rejected_version
+            return time.time() < expires_at
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._rejected.clear()
+            self._bytes = 0
+
+    def _drop(self, key) -> None:
+        _, _, nbytes, _ = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters['hits'] + self._counters['misses']
+            return dict(self._counters,
+                        entries=len(self._entries),
+                        bytes=self._bytes,
+                        max_bytes=self.max_bytes,
+                        hit_rate=round(self._counters['hits'] / lookups, 3)
+                        if lookups else 0.0)
+
+
+class CategoryPresenceCache:
+    """
+    Short-lived record of the categories known to hold documents, so
+    searches do not ask Chroma again on every request. Only positive
+    answers are kept: a category that was empty may be filled at any time.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._expires_at: dict = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            expires_at = self._expires_at.get(key)
+            if expires_at is None:
+                return False
+            if time.time() >= expires_at:
+                del self._expires_at[key]
+                return False
+            return True
+
+    def add(self, key) -> None:
+        with self._lock:
+            self._expires_at[key] = time.time() + self.ttl
+
+    def discard(self, key) -> None:
+        with self._lock:
+            self._expires_at.pop(key, None)
@@ -0,0 +1,42 @@
+import redis
+
+from chroma_ms_config import Configuration
+from utils.outputs import print_warning_message
+
+VERSION_KEY = "category_version:{collection_name}:{category}"
+
+
+class CategoryVersions:
+    """
+    Per-category write counters shared through Redis. Ingestion bumps the
+    version of every category it touches and search workers compare it with
+    the version their cached category data was loaded at.
+    """
+
+    def __init__(self, redis_client):
+        self._redis = redis_client
+
+    def bump(self, collection_name: str, categories) -> None:
+        try:
+            pipeline = self._redis.pipeline(transaction=False)
+            for category in categories:
+                pipeline.incr(VERSION_KEY.format(collection_name=collection_name,
+                                                 category=category))
+            pipeline.execute()
+        except redis.RedisError as e:
+            print_warning_message(f"Could not bump category versions: {e}",
+                                  Configuration.CHROMA_QUEUE)
+
+    def get(self, collection_name: str, category: str):
+        """
+        Current version of the category, 0 if it was never written, or None
+        when Redis cannot be reached and cached data should expire by TTL.
+        """
+        try:
+            version = self._redis.get(VERSION_KEY.format(
+                collection_name=collection_name, category=category))
+        except redis.RedisError as e:
+            print_warning_message(f"Could not read category version: {e}",
+                                  Configuration.CHROMA_QUEUE)
+            return None
+        return int(version) if version is not None else 0
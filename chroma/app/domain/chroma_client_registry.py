@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+
+import chromadb
+
+from chromadb.api.models.Collection import Collection
+
+from chroma_ms_config import Configuration
+from utils.outputs import (print_bold_message,
+                           print_header_message,
+                           print_warning_message)
+
+
+class ChromaClientRegistry:
+    """
+    Per-process Chroma HTTP client and collection handles. The client keeps
+    its pool of keep-alive connections for the life of the worker process,
+    and collection handles are looked up once per name and reused until
+    Chroma reports the collection is missing.
+    """
+    _client = None
+    _pid = None
+    _collections: dict = {}
+    _stats: dict = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def client(cls):
+        # A client inherited through fork would share its sockets with the
+        # parent, so every process builds its own
+        if cls._client is not None and cls._pid == os.getpid():
+            return cls._client
+
+        with cls._lock:
+            if cls._client is None or cls._pid != os.getpid():
+                start_time = time.perf_counter()
+                cls._client = chromadb.HttpClient(host=Configuration.CHROMA_URL,
+                                                  port=8000)
+                cls._pid = os.getpid()
+                cls._collections = {}
+                cls._stats = {'client_init_s': round(time.perf_counter() - start_time, 4),
+                              'clients_created': cls._stats.get('clients_created', 0) + 1,
+                              'collection_hits': 0,
+                              'collection_misses': 0,
+                              'collections_created': 0,
+                              'collection_refreshes': 0,
+                              'lookup_s': 0.0}
+            return cls._client
+
+    @classmethod
+    def collection(cls, name: str, embedding_function_factory) -> Collection:
+        client = cls.client()
+        handle = cls._collections.get(name)
+        if handle is not None:
+            cls._stats['collection_hits'] += 1
+            return handle
+
+        with cls._lock:
+            if name in cls._collections:
+                cls._stats['collection_hits'] += 1
+                return cls._collections[name]
+
+            cls._stats['collection_misses'] += 1
+            start_time = time.perf_counter()
+            embedding_function = embedding_function_factory()
+            try:
+                handle = client.get_collection(
+                    name=name,
+                    embedding_function=embedding_function)
+            # Depending on the client version a missing collection raises
+            # ValueError or InvalidCollectionException
+            except Exception:
+                print_warning_message(message="Collection does not exist.",
+                                      app=Configuration.CHROMA_QUEUE)
+                print_header_message(message="Creating collection...",
+                                     app=Configuration.CHROMA_QUEUE)
+                handle = client.create_collection(
+                    name=name,
+                    embedding_function=embedding_function,
+                    metadata={"hnsw:space": "cosine"})
+                cls._stats['collections_created'] += 1
+            lookup_time = time.perf_counter() - start_time
+            cls._stats['lookup_s'] += lookup_time
+            cls._collections[name] = handle
+            print_bold_message(
+                f"Collection {name} looked up in {lookup_time * 1000:.1f}ms, "
+                f"client stats: {cls.stats()}",
+                Configuration.CHROMA_QUEUE)
+            return handle
+
+    @classmethod
+    def invalidate(cls, name: str) -> None:
+        with cls._lock:
+            if cls._collections.pop(name, None) is not None:
+                cls._stats['collection_refreshes'] += 1
+
+    @classmethod
+    def stats(cls) -> dict:
+        stats = dict(cls._stats)
+        if 'lookup_s' in stats:
+            stats['lookup_s'] = round(stats['lookup_s'], 4)
+        return dict(stats, cached_collections=len(cls._collections))
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._client = None
+            cls._pid = None
+            cls._collections = {}
+            cls._stats = {}
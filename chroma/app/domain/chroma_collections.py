@@ -1,19 +1,37 @@
-import chromadb
+import functools
+import inspect
+import numpy as np
 import time
 import torch
-import requests
 import json
 import gc
+import hashlib
+import re
+import threading
 import traceback
 
+from itertools import islice
+
 from gensim.parsing import remove_stopwords
-from transformers import AutoTokenizer, AutoModel
 from chromadb import Documents, EmbeddingFunction, Embeddings
 from chromadb.api.models.Collection import Collection
-from documents.utils import pdf_to_bytes
+from chromadb.errors import InvalidCollectionException
+from documents.utils import (iter_pdf_pages,
+                             document_fingerprint,
+                             ParallelPdfExtractor)
 
-from chroma.app import loaded_collections
+from chroma.app import (loaded_collections,
+                        category_presence,
+                        category_versions)
+from chroma.app.domain.batch_uploader import PipelinedUploader
+from chroma.app.domain.category_cache import compact_category_data
+from chroma.app.domain.chroma_client_registry import ChromaClientRegistry
+from chroma.app.domain.vector_search import normalize_rows, top_k_cosine
+from chroma.app.domain.embedder_registry import EmbedderRegistry
+from chroma.app.domain.embedding_cache import EmbeddingCache
+from chroma.app.domain.lexical_index import LexicalIndex, chunk_categories
 from chroma.category.types import FileCategories
+from chroma.celery_conf import celery
 from chroma_ms_config import Configuration
 from utils.outputs import (print_warning_message,
                            print_successful_message,
@@ -22,57 +40,264 @@ from utils.outputs import (print_warning_message,
                            print_error)
 
 
-def chunk_text(text: str, max_chunk_length=1024) -> tuple:
+def chunk_id(document_id: str, chunk_index: int) -> str:
+    return f"{document_id}-{chunk_index}"
+
+
+def _chunk_boundaries(text: str, offsets: list) -> tuple[set, set]:
+    """
+    Token positions where a chunk may end: after a paragraph break, after a
+    sentence, and the start of every whole word.
+    """
+    paragraph_ends = set()
+    sentence_ends = set()
+    for index in range(1, len(offsets)):
+        gap = text[offsets[index - 1][1]:offsets[index][0]]
+        if not gap:
+            continue
+        if "\n\n" in gap or "\x0c" in gap:
+            paragraph_ends.add(index)
+        elif text[offsets[index - 1][1] - 1] in ".!?;:":
+            sentence_ends.add(index)
+    return paragraph_ends, sentence_ends
+
+
+def _token_windows(text: str,
+                   tokenizer,
+                   max_tokens: int,
+                   overlap: int) -> list[tuple[int, int]]:
+    """
+    Character spans of the chunks of a text. The text is tokenized once and
+    split into windows of at most max_tokens tokens, ending on a paragraph
+    or sentence boundary when one is available in the second half of the
+    window. Consecutive windows share up to overlap tokens.
+    """
+    offsets = tokenizer(text,
+                        add_special_tokens=False,
+                        return_offsets_mapping=True,
+                        verbose=False)['offset_mapping']
+    # A word starts wherever a token is preceded by a gap in the text
+    word_starts = {0} | {index for index in range(1, len(offsets))
+                         if offsets[index][0] > offsets[index - 1][1]}
+    paragraph_ends, sentence_ends = _chunk_boundaries(text, offsets)
+
+    spans = []
+    start = 0
+    while start < len(offsets):
+        end = min(start + max_tokens, len(offsets))
+        if end < len(offsets):
+            window = range(end, start + max(max_tokens // 2, 1), -1)
+            end = (next((i for i in window if i in paragraph_ends), None)
+                   or next((i for i in window if i in sentence_ends), None)
+                   or next((i for i in window if i in word_starts), None)
+                   or end)
+
+        spans.append((offsets[start][0], offsets[end - 1][1]))
+        if end >= len(offsets):
+            break
+
+        next_start = max(end - overlap, start + 1)
+        # Never start a chunk in the middle of a word
+        while next_start < end and next_start not in word_starts:
+            next_start += 1
+        start = next_start
+    return spans
+
+
+def chunk_text_by_tokens(text: str,
+                         tokenizer,
+                         max_tokens: int = None,
+                         overlap: int = None,
+                         document_id: str = None) -> tuple:
     """
-    Chunk the text into smaller parts that fit within the model's max token
-    limit.
+    Chunk the text so that every chunk fits the embedding model without
+    truncation. Chunks are slices of the original text, so the stored
+    document is exactly what was embedded.
     """
-    words = text.split()
-    chunks = []
-    ids = []
-    for i in range(0, len(words), max_chunk_length):
-        chunk = " ".join(words[i:i + max_chunk_length])
-        chunks.append(chunk)
-        ids.append(str(time.time()))
+    max_tokens = max_tokens or Configuration.CHUNK_MAX_TOKENS
+    overlap = Configuration.CHUNK_OVERLAP_TOKENS if overlap is None else overlap
+    if document_id is None:
+        document_id = hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    chunks = [text[char_start:char_end] for char_start, char_end
+              in _token_windows(text, tokenizer, max_tokens, overlap)]
+    ids = [chunk_id(document_id, index) for index in range(len(chunks))]
     return chunks, ids
 
 
+def _word_offsets(text: str, **kwargs) -> dict:
+    """Tokenizer stand-in that makes every word a token."""
+    return {'offset_mapping': [match.span() for match in re.finditer(r"\S+", text)]}
+
+
+def chunk_text(text: str, max_chunk_length=1024, document_id: str = None) -> tuple:
+    """
+    Chunk the text into parts of at most max_chunk_length words, without
+    overlap. Same chunking and chunk IDs as chunk_text_by_tokens, counting
+    words instead of model tokens.
+    """
+    return chunk_text_by_tokens(text, _word_offsets, max_chunk_length,
+                                overlap=0, document_id=document_id)
+
+
+def iter_token_chunks(segments,
+                      tokenizer,
+                      document_id: str,
+                      max_tokens: int = None,
+                      overlap: int = None):
+    """
+    Streaming version of chunk_text_by_tokens. Consumes text segments (for
+    example batches of PDF pages) and yields (chunk, chunk_id) pairs as soon
+    as they are complete. Only the last, still growing window is carried
+    over to the next segment.
+    """
+    max_tokens = max_tokens or Configuration.CHUNK_MAX_TOKENS
+    overlap = Configuration.CHUNK_OVERLAP_TOKENS if overlap is None else overlap
+
+    pending = ""
+    chunk_index = 0
+    for segment in segments:
+        pending += segment
+        spans = _token_windows(pending, tokenizer, max_tokens, overlap)
+        for char_start, char_end in spans[:-1]:
+            yield pending[char_start:char_end], chunk_id(document_id, chunk_index)
+            chunk_index += 1
+        pending = pending[spans[-1][0]:] if spans else ""
+
+    for char_start, char_end in _token_windows(pending, tokenizer,
+                                               max_tokens, overlap):
+        yield pending[char_start:char_end], chunk_id(document_id, chunk_index)
+        chunk_index += 1
+
+
+def length_bucketed_batches(lengths: list[int],
+                            token_budget: int,
+                            max_batch_size: int = 128) -> list[list[int]]:
+    """
+    Group input indexes into batches of similar token length. Inputs are
+    sorted longest first so every batch pads to roughly the same size, and
+    a batch grows only while its padded size stays within the token budget.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches = []
+    batch = []
+    for index in order:
+        # The first member of a batch is its longest one
+        padded_length = lengths[batch[0]] if batch else lengths[index]
+        if batch and ((len(batch) + 1) * padded_length > token_budget
+                      or len(batch) == max_batch_size):
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def masked_mean_pool(last_hidden_state: torch.Tensor,
+                     attention_mask: torch.Tensor) -> torch.Tensor:
+    """
+    Average the token embeddings of each input, ignoring padding positions.
+    """
+    mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+    summed = (last_hidden_state * mask).sum(dim=1)
+    counts = mask.sum(dim=1).clamp(min=1e-9)
+    return summed / counts
+
+
+RETRIEVAL_MODES = ("terms", "query", "fusion", "hybrid", "lexical")
+# Task of the langchain service that answers a query from its documents
+LANGCHAIN_SEARCH_TASK = "user_langchain.app.task_executor.langchain_agent_invocation_task"
+# State of a search whose answer is produced by the langchain task
+HANDED_OFF = "HANDED_OFF"
+# Modes that start from the BM25 index
+LEXICAL_MODES = ("hybrid", "lexical")
+
+
+def refresh_missing_collection(method):
+    """
+    Retry the method once with a fresh collection handle when Chroma reports
+    that the cached one no longer exists, e.g. after the collection was
+    deleted and created again.
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except InvalidCollectionException:
+            collection_name = signature.bind(*args, **kwargs).arguments['collection_name']
+            print_warning_message(
+                f"Collection {collection_name} is gone, refreshing its handle...",
+                Configuration.CHROMA_QUEUE)
+            ChromaClientRegistry.invalidate(collection_name)
+            return method(*args, **kwargs)
+
+    return wrapper
+
+
 class ChromaCollections:
+    # Categories being loaded into the cache by a background thread
+    _warming = set()
+    _warming_lock = threading.Lock()
+
     def __init__(self):
-        self._chroma_client = chromadb.HttpClient(host=Configuration.CHROMA_URL,
-                                                  port=8000)
+        self._chroma_client = ChromaClientRegistry.client()
         
     class EmbedderFunction(EmbeddingFunction):
-        def __init__(self):
-            self.tokenizer = (
-                AutoTokenizer.from_pretrained("bert-base-multilingual-cased"))
-            self.embedding_model = (
-                AutoModel.from_pretrained("bert-base-multilingual-cased"))
+        def __init__(self, inference_mode: str = None):
+            inference_mode = (inference_mode or
+                              Configuration.EMBEDDING_INFERENCE_MODE)
+            (self.tokenizer,
+             self.embedding_model) = EmbedderRegistry.get(
+                inference_mode=inference_mode)
+            self.cache = EmbeddingCache.for_model(
+                f"{Configuration.EMBEDDING_MODEL}:{inference_mode}")
 
         def __call__(self, doc_input: Documents) -> Embeddings:
-            embedding_results = []
-            batch_size = 128
-            for i in range(0, len(doc_input), batch_size):
-                batch_docs = doc_input[i:i + batch_size]
-                inputs = self.tokenizer(batch_docs,
-                                        return_tensors="pt",
-                                        padding=True,
-                                        truncation=True,
-                                        max_length=512)
+            if not doc_input:
+                print_error("Embeddings are invalid or empty.", app=Configuration.CHROMA_QUEUE)
+                return []
+
+            cached = self.cache.get_many(doc_input)
+            missing = [index for index, vector in enumerate(cached)
+                       if vector is None]
+            if missing:
+                missing_docs = [doc_input[index] for index in missing]
+                computed = self.embed_uncached(missing_docs)
+                self.cache.put_many(missing_docs, computed)
+                for index, embedding in zip(missing, computed):
+                    cached[index] = embedding
+
+            return [vector if isinstance(vector, list) else vector.tolist()
+                    for vector in cached]
+
+        def embed_uncached(self, doc_input: Documents) -> Embeddings:
+            embedding_results = [None] * len(doc_input)
+            encoded = self.tokenizer(list(doc_input),
+                                     truncation=True,
+                                     max_length=Configuration.EMBEDDING_MAX_TOKENS)
+            lengths = [len(input_ids) for input_ids in encoded['input_ids']]
+
+            for batch_indexes in length_bucketed_batches(
+                    lengths, Configuration.EMBEDDING_TOKEN_BUDGET):
+                features = [{key: encoded[key][index] for key in encoded.keys()}
+                            for index in batch_indexes]
+                inputs = self.tokenizer.pad(features,
+                                            padding=True,
+                                            return_tensors="pt")
 
                 with torch.no_grad():
                     outputs = self.embedding_model(**inputs)
 
-                last_hidden_state = outputs.last_hidden_state
-                embeddings = torch.mean(last_hidden_state, dim=1).squeeze()
+                embeddings = masked_mean_pool(outputs.last_hidden_state,
+                                              inputs['attention_mask']).float()
 
-                if len(embeddings.shape) == 1:
-                    embeddings = [embeddings]
+                # Convert embeddings to lists of floats in the input order
+                for index, embedding in zip(batch_indexes, embeddings):
+                    embedding_results[index] = embedding.cpu().numpy().tolist()
 
-                # Convert embeddings to lists of floats
-                for embedding in embeddings:
-                    embedding_results.append(embedding.cpu().numpy().tolist())
-            
             # Check if embeddings are valid
             if not embedding_results or any(not isinstance(e, list) for e in embedding_results):
                 print_error("Embeddings are invalid or empty.", app=Configuration.CHROMA_QUEUE)
@@ -92,62 +317,336 @@ class ChromaCollections:
     @staticmethod
     def update_loaded_data(collection: Collection,
                         category: str,
-                        re_query: bool = False) -> dict:
+                        re_query: bool = False,
+                        version: int = None) -> dict:
         if re_query:
             print_warning_message("Nothing found, updating loaded data...", Configuration.CHROMA_QUEUE)
         else:
             print_warning_message("Updating loaded data...", Configuration.CHROMA_QUEUE)
 
         # Include embeddings in the get method
-        aux = dict(collection.get(where={category: 1}, include=["embeddings", "metadatas", "documents"]).items())
-        
-        print_successful_message(f"Loaded data: {aux}", Configuration.CHROMA_QUEUE)
-        
-        response_dict = {
-            'data': aux,
-            'expiration_time': time.time() + (60 * 10)
-        }
+        data = compact_category_data(collection.get(
+            where={category: 1},
+            include=["embeddings", "metadatas", "documents"]))
+        loaded_collections.put((collection.name, category), data, version)
 
-        loaded_collections[category] = response_dict
-        return response_dict['data']
+        print_successful_message(
+            f"Loaded {len(data['ids'])} chunks for category {category}",
+            Configuration.CHROMA_QUEUE)
+        print_bold_message(f"Category cache: {loaded_collections.stats()}",
+                           Configuration.CHROMA_QUEUE)
+        return data
+
+    @staticmethod
+    def category_has_documents(collection: Collection,
+                               category: str,
+                               refresh: bool = False) -> bool:
+        """
+        Whether any chunk is tagged with the category, fetching at most one
+        id instead of the category's documents and embeddings.
+        """
+        key = (collection.name, category)
+        if not refresh and key in category_presence:
+            return True
+
+        found = bool(collection.get(where={category: 1},
+                                    limit=1,
+                                    include=[])['ids'])
+        if found:
+            category_presence.add(key)
+        else:
+            category_presence.discard(key)
+        return found
+
+    @staticmethod
+    def local_query(category_data: dict, query_embeddings, max_results: int):
+        """
+        Top max_results chunks of a cached category for every query vector,
+        shaped like Chroma's QueryResult. Returns None when the cached data
+        cannot answer the query.
+        """
+        matrix = category_data['embeddings']
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        if matrix.shape[0] == 0 or matrix.shape[1] != query_embeddings.shape[-1]:
+            return None
+
+        indices, similarities = top_k_cosine(matrix, query_embeddings, max_results)
+        return {
+            'ids': [[category_data['ids'][index] for index in row]
+                    for row in indices],
+            'documents': [[category_data['documents'][index] for index in row]
+                          for row in indices],
+            'metadatas': [[category_data['metadatas'][index] for index in row]
+                          for row in indices],
+            'distances': (1.0 - similarities).tolist(),
+        }
 
     @staticmethod
     def basic_chroma_query(collection: Collection,
                         category: str,
                         user_query: str,
-                        max_results: int = 5) -> dict:
+                        max_results: int = 5,
+                        category_data: dict = None,
+                        mode: str = None) -> dict:
+        mode = mode or Configuration.RETRIEVAL_MODE
+        if mode in LEXICAL_MODES:
+            lexical_results = ChromaCollections.lexical_query(collection,
+                                                              category,
+                                                              user_query,
+                                                              max_results,
+                                                              category_data,
+                                                              mode)
+            if lexical_results is not None:
+                return lexical_results
+            # No chunk shares a term with the query, search densely instead
+            mode = "query"
 
-        query_no_stopwords = remove_stopwords(user_query)
-        query_terms = query_no_stopwords.split()
+        query_texts = ChromaCollections.query_texts(user_query, mode)
 
-        query_embeddings = [
-            ChromaCollections.EmbedderFunction()([term])[0]
-            for term in query_terms
-        ]
+        # One forward pass for every text and a single multi-vector query
+        query_embeddings = ChromaCollections.EmbedderFunction()(query_texts)
 
-        document_scores = {}
-        metadata_scores = {}
-        id_scores = {}
+        results = None
+        if category_data is not None:
+            start_time = time.perf_counter()
+            results = ChromaCollections.local_query(category_data,
+                                                    query_embeddings,
+                                                    max_results)
+            if results is not None:
+                print_bold_message(
+                    f"Searched {len(category_data['ids'])} cached chunks in "
+                    f"{(time.perf_counter() - start_time) * 1000:.1f}ms",
+                    Configuration.CHROMA_QUEUE)
 
-        for query_embedding in query_embeddings:
+        if results is None:
             try:
                 where_clause = {category: {"$eq": 1}}
 
                 results = collection.query(
-                    query_embeddings=query_embedding,
+                    query_embeddings=query_embeddings,
                     where=where_clause,  # Use the dynamically constructed where clause
                     n_results=max_results,
-                    include=["embeddings", "metadatas", "documents", "distances"]
+                    include=ChromaCollections.query_include(mode)
                 )
+            except InvalidCollectionException:
+                # Let the caller refresh its collection handle
+                raise
             except Exception as e:
                 print_error(f"Error querying ChromaDB: {traceback.format_exc()}",
                             app=Configuration.CHROMA_QUEUE)
                 results = {"documents": [], "metadatas": [], "ids": []}
 
-            for i, doc in enumerate(results['documents']):
-                doc_id = results['ids'][0][i]
-                metadata = results['metadatas'][0][i]
+        top_results = ChromaCollections.rank_results(results, max_results, mode)
+        gc.collect()
+
+        return top_results
+
+    @staticmethod
+    def query_terms(user_query: str) -> list[str]:
+        query_no_stopwords = remove_stopwords(user_query)
+        return query_no_stopwords.split() or [user_query]
+
+    @staticmethod
+    def query_texts(user_query: str, mode: str) -> list[str]:
+        """
+        Texts embedded for a retrieval mode: every term, the whole query, or
+        the whole query followed by the terms for fusion.
+        """
+        if mode == "query" or mode in LEXICAL_MODES:
+            return [user_query]
+        terms = ChromaCollections.query_terms(user_query)
+        if mode == "fusion":
+            return [user_query] + [term for term in terms if term != user_query]
+        return terms
+
+    @staticmethod
+    def query_include(mode: str) -> list[str]:
+        # Only the term mode ranks without looking at distances
+        if mode == "terms":
+            return ["metadatas", "documents"]
+        return ["metadatas", "documents", "distances"]
+
+    @staticmethod
+    def lexical_candidates(collection_name: str,
+                           category: str,
+                           user_query: str,
+                           mode: str,
+                           max_results: int) -> list[str]:
+        """
+        Chunk ids of the category ranked by BM25: the final results in
+        lexical mode, or LEXICAL_CANDIDATES candidates to rescore densely in
+        hybrid mode. Empty when the index is disabled or nothing matches.
+        """
+        index = LexicalIndex.for_collection(collection_name)
+        if index is None:
+            return []
+        limit = (max_results if mode == "lexical"
+                 else max(Configuration.LEXICAL_CANDIDATES, max_results))
+        return [chunk_id for chunk_id, _ in index.search(user_query, category, limit)]
+
+    @staticmethod
+    def lexical_include(mode: str) -> list[str]:
+        if mode == "hybrid":
+            return ["embeddings", "metadatas", "documents"]
+        return ["metadatas", "documents"]
+
+    @staticmethod
+    def cached_rows(category_data: dict, chunk_ids: list[str]):
+        """
+        Rows of the cached category for the given ids, shaped like a Chroma
+        get result, or None when any of them is not cached.
+        """
+        if category_data is None:
+            return None
+        positions = [category_data['positions'].get(chunk_id)
+                     for chunk_id in chunk_ids]
+        if any(position is None for position in positions):
+            return None
+        return {
+            'ids': list(chunk_ids),
+            'documents': [category_data['documents'][position] for position in positions],
+            'metadatas': [category_data['metadatas'][position] for position in positions],
+            'embeddings': category_data['embeddings'][positions],
+        }
+
+    @staticmethod
+    def rank_lexical_candidates(chunk_ids: list[str],
+                                rows: dict,
+                                max_results: int,
+                                query_embedding=None):
+        """
+        Order fetched candidate rows by BM25 rank, or by cosine similarity
+        to the query embedding in hybrid mode.
+        """
+        positions = {chunk_id: position for position, chunk_id in enumerate(rows['ids'])}
+        order = [positions[chunk_id] for chunk_id in chunk_ids if chunk_id in positions]
+        if not order:
+            return False
+
+        embeddings = rows.get('embeddings')
+        if query_embedding is not None and embeddings is not None and len(embeddings):
+            matrix = normalize_rows(np.asarray(embeddings)[order])
+            if matrix.shape[1] == np.asarray(query_embedding).shape[-1]:
+                best, _ = top_k_cosine(matrix, query_embedding, max_results)
+                order = [order[index] for index in best[0]]
+
+        order = order[:max_results]
+        return {
+            'documents': [rows['documents'][position] for position in order],
+            'metadatas': [rows['metadatas'][position] for position in order],
+            'ids': [rows['ids'][position] for position in order],
+        }
+
+    @staticmethod
+    def lexical_query(collection: Collection,
+                      category: str,
+                      user_query: str,
+                      max_results: int,
+                      category_data: dict = None,
+                      mode: str = "lexical"):
+        """
+        Search through the BM25 index. Lexical mode returns the best BM25
+        chunks without any vector search, hybrid mode rescores the BM25
+        candidates against the whole query embedding. Returns None when no
+        chunk matches the query terms.
+        """
+        chunk_ids = ChromaCollections.lexical_candidates(collection.name,
+                                                         category,
+                                                         user_query,
+                                                         mode,
+                                                         max_results)
+        if not chunk_ids:
+            return None
+
+        rows = ChromaCollections.cached_rows(category_data, chunk_ids)
+        if rows is None:
+            rows = collection.get(ids=chunk_ids,
+                                  include=ChromaCollections.lexical_include(mode))
+        query_embedding = (ChromaCollections.EmbedderFunction()([user_query])
+                           if mode == "hybrid" else None)
+        return ChromaCollections.rank_lexical_candidates(chunk_ids,
+                                                         rows,
+                                                         max_results,
+                                                         query_embedding)
+
+    @staticmethod
+    def rank_results(results: dict, max_results: int, mode: str):
+        if mode == "query":
+            return ChromaCollections.rank_by_distance(results, max_results)
+        if mode == "fusion":
+            return ChromaCollections.reciprocal_rank_fusion(results, max_results)
+        return ChromaCollections.rank_term_results(results, max_results)
+
+    @staticmethod
+    def rank_by_distance(results: dict, max_results: int):
+        """
+        Results of a single query vector, nearest first. Returns False when
+        nothing was found.
+        """
+        if not results['ids'] or not results['ids'][0]:
+            return False
+        order = sorted(range(len(results['ids'][0])),
+                       key=lambda index: results['distances'][0][index])[:max_results]
+        return {
+            'documents': [results['documents'][0][index] for index in order],
+            'metadatas': [results['metadatas'][0][index] for index in order],
+            'ids': [results['ids'][0][index] for index in order],
+        }
+
+    @staticmethod
+    def reciprocal_rank_fusion(results: dict, max_results: int, k: int = None):
+        """
+        Fuse the ranked lists of several query vectors: every chunk scores
+        1 / (k + rank) for each list it appears in, with lists ordered by
+        distance. Ties go to the chunk with the smallest distance.
+        """
+        k = k or Configuration.RRF_K
+        scores = {}
+        best_distance = {}
+        documents = {}
+        metadatas = {}
+        for ids, docs, metas, distances in zip(results['ids'],
+                                               results['documents'],
+                                               results['metadatas'],
+                                               results['distances']):
+            ranked = sorted(zip(ids, docs, metas, distances),
+                            key=lambda result: result[3])
+            for rank, (doc_id, doc, metadata, distance) in enumerate(ranked, start=1):
+                scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+                best_distance[doc_id] = min(distance,
+                                            best_distance.get(doc_id, distance))
+                documents[doc_id] = doc
+                metadatas[doc_id] = metadata
+
+        if not scores:
+            return False
+        fused = sorted(scores,
+                       key=lambda doc_id: (-scores[doc_id], best_distance[doc_id]))
+        fused = fused[:max_results]
+        return {
+            'documents': [documents[doc_id] for doc_id in fused],
+            'metadatas': [metadatas[doc_id] for doc_id in fused],
+            'ids': fused,
+        }
+
+    @staticmethod
+    def rank_term_results(results: dict, max_results: int):
+        """
+        Merge the per-term results of a multi-vector query, ranking chunks by
+        the number of terms that retrieved them. Returns False when nothing
+        was found.
+        """
+        document_scores = {}
+        metadata_scores = {}
+        id_scores = {}
 
+        # Results come back as one list per query term
+        for term_ids, term_docs, term_metadatas in zip(results['ids'],
+                                                       results['documents'],
+                                                       results['metadatas']):
+            for doc_id, doc, metadata in zip(term_ids,
+                                             term_docs,
+                                             term_metadatas):
                 if doc_id in document_scores:
                     document_scores[doc_id].append(doc)
                     metadata_scores[doc_id].append(metadata)
@@ -169,76 +668,152 @@ class ChromaCollections:
                 for doc_id in sorted_docs[:max_results]],
             'ids': [id_scores[doc_id] for doc_id in sorted_docs[:max_results]],
         }
-        
-        gc.collect()
 
         return top_results if top_results['documents'] else False
 
 
     @staticmethod
     def add_document_embeds(collection: Collection,
-                            document: str,
-                            metadata_filter: dict[str, str]):
+                            document,
+                            metadata_filter: dict[str, str],
+                            document_id: str = None):
+        """
+        Chunk, embed and store a document. The document is either a string or
+        an iterable of text segments, such as batches of PDF pages, which are
+        chunked and embedded as they arrive, EMBED_BATCH_CHUNKS at a time.
+        Embedded batches are uploaded on a background thread while the next
+        one is embedded. Returns the number of pages and chunks stored with
+        the time spent in each stage, or False on failure.
+        """
+        if isinstance(document, str):
+            document_id = document_id or hashlib.sha256(
+                document.encode('utf-8')).hexdigest()
+            document = [document]
+
+        report = {"PAGES": 0, "CHUNKS": 0}
+        timings = {"chunking_s": 0.0, "embedding_s": 0.0}
+
+        def counted_pages(segments):
+            for segment in segments:
+                # pdfminer ends every page with a form feed
+                report["PAGES"] += segment.count("\x0c")
+                yield segment
+
+        uploader = None
+        lexical_index = LexicalIndex.for_collection(str(collection.name))
+        lexical_entries = []
+        start_time = time.perf_counter()
         try:
-            document_chunks, ids = chunk_text(document)
-            embeddings = ChromaCollections.EmbedderFunction()(document_chunks)
-            collection.add(
-                documents=document_chunks,
-                metadatas=[metadata_filter] * len(document_chunks),
-                embeddings=embeddings,
-                ids=ids
-            )
+            tokenizer, _ = EmbedderRegistry.get()
+            embedder = ChromaCollections.EmbedderFunction()
+            chunks_stream = iter_token_chunks(counted_pages(document),
+                                              tokenizer,
+                                              document_id)
+            with PipelinedUploader(collection) as uploader:
+                while True:
+                    stage_start = time.perf_counter()
+                    batch = list(islice(chunks_stream,
+                                        Configuration.EMBED_BATCH_CHUNKS))
+                    timings["chunking_s"] += time.perf_counter() - stage_start
+                    if not batch:
+                        break
+
+                    document_chunks = [chunk for chunk, _ in batch]
+                    stage_start = time.perf_counter()
+                    embeddings = embedder(document_chunks)
+                    timings["embedding_s"] += time.perf_counter() - stage_start
+
+                    uploader.submit(documents=document_chunks,
+                                    metadatas=[metadata_filter] * len(document_chunks),
+                                    embeddings=embeddings,
+                                    ids=[chunk_id for _, chunk_id in batch])
+                    if lexical_index is not None:
+                        lexical_entries.extend(
+                            LexicalIndex.chunk_entry(chunk_id, chunk)
+                            for chunk, chunk_id in batch)
+            if lexical_index is not None:
+                ChromaCollections._index_lexically(lexical_index,
+                                                   lexical_entries,
+                                                   metadata_filter)
             gc.collect()
-            return True
+            report["CHUNKS"] = len(uploader.uploaded_ids)
+            report["TIMINGS"] = {
+                **{stage: round(seconds, 3) for stage, seconds in timings.items()},
+                "upload_s": round(uploader.stats['upload_s'], 3),
+                "upload_wait_s": round(uploader.stats['upload_wait_s'], 3),
+                "upload_retries": uploader.stats['retries'],
+                "total_s": round(time.perf_counter() - start_time, 3),
+            }
+            return report
         except Exception as e:
             print_error(message=str(e), app=Configuration.CHROMA_QUEUE)
+            if uploader is not None:
+                # A failed request may still have been applied on the server
+                ChromaCollections._remove_partial_document(
+                    collection, uploader.attempted_ids, metadata_filter)
             return False
 
     @staticmethod
-    def _invoke_llm(query_result, user_query, task_id):
+    def _index_lexically(lexical_index: LexicalIndex,
+                         entries: list[dict],
+                         metadata: dict) -> None:
+        # The document is already stored, a lexical index failure only
+        # leaves it out of lexical searches
         try:
-            response = requests.post(
-                url="http://localhost:5001/langchain/search",
-                json={
-                    "categories": query_result.get("metadatas", []),
-                    "documents": query_result.get("documents", []),
-                    "user_query": user_query,
-                    "task_id": task_id
-                },
-                headers={
-                    "Content-Type": "application/json"
-                }
-            )
-            response_content = response.content.decode('utf-8').strip()
-            response_content = response_content.replace('data:', '').strip()
-            response_data = json.loads(response_content)
-
-            if response_data["STATE"] == "ERROR":
-                print_error(response_data["DESCRIPTION"],
-                            Configuration.LANGCHAIN_QUEUE)
-            else:
-                print_successful_message(response_data["DESCRIPTION"],
-                                         Configuration.LANGCHAIN_QUEUE)
-                gc.collect()
-            return {
-                "STATE": "SUCCESS",
-                "RESPONSE_DATA": response_data
-            }
-        except requests.exceptions.ConnectionError as e:
-            print_error(f"Something went wrong: {str(e)}",
+            lexical_index.add_many(entries, chunk_categories(metadata))
+        except Exception as e:
+            print_error(f"Could not update the lexical index: {e}",
                         Configuration.CHROMA_QUEUE)
-            return {
-                "STATE": "ERROR",
-                "DESCRIPTION": str(e)
-            }
-        except requests.exceptions.JSONDecodeError as e:
-            print_error(f"Failed to decode JSON: {e}",
+
+    @staticmethod
+    def _remove_partial_document(collection: Collection, stored_ids: list,
+                                 metadata: dict):
+        # A half stored document would be reported as unchanged next time
+        if not stored_ids:
+            return
+        try:
+            collection.delete(ids=stored_ids)
+        except Exception as e:
+            print_error(message=f"Could not remove partial document: {e}",
+                        app=Configuration.CHROMA_QUEUE)
+            return
+        # Categories cached while the upload ran would keep serving the
+        # removed chunks
+        category_versions.bump(str(collection.name), chunk_categories(metadata))
+
+    @staticmethod
+    def _invoke_llm(query_result, user_query, task_id, reply_fields: dict = None):
+        """
+        Hand the retrieved documents to the langchain service through its
+        Celery queue and return without waiting for the answer. The langchain
+        task runs under the same task id and stores the final answer, with
+        reply_fields, as the result of this service's task.
+        """
+        reply_fields = reply_fields or {}
+        try:
+            celery.send_task(
+                LANGCHAIN_SEARCH_TASK,
+                args=[query_result.get("metadatas", []),
+                      query_result.get("documents", []),
+                      user_query],
+                kwargs={"reply_to": {"namespace": Configuration.CHROMA_QUEUE,
+                                     "fields": reply_fields}},
+                task_id=task_id,
+                queue=Configuration.LANGCHAIN_QUEUE)
+        except Exception as e:
+            print_error(f"Could not hand the query to the LLM: {e}",
                         Configuration.CHROMA_QUEUE)
             return {
                 "STATE": "ERROR",
-                "DESCRIPTION": "Could not process response JSON"
+                "DESCRIPTION": str(e)
             }
 
+        print_successful_message(
+            f"Handed task {task_id} to {Configuration.LANGCHAIN_QUEUE}",
+            Configuration.CHROMA_QUEUE)
+        gc.collect()
+        return {"STATE": HANDED_OFF, "LLM_TASK_ID": task_id, **reply_fields}
+
     @staticmethod
     def _validate_loaded_response(loaded_db_data: dict, category) -> tuple:
         if loaded_db_data.get('data', None):
@@ -270,32 +845,61 @@ class ChromaCollections:
         )
 
     def _validate_existing_collection(self, collection_name: str) -> Collection:
-        try:
-            result = self._chroma_client.get_collection(
-                name=collection_name,
-                embedding_function=ChromaCollections.EmbedderFunction())
-        except (ValueError, chromadb.errors.InvalidCollectionException, Exception):
-            print_warning_message(message="Collection does not exist.",
-                                  app=Configuration.CHROMA_QUEUE)
-            print_header_message(message="Creating collection...",
-                                 app=Configuration.CHROMA_QUEUE)
-            return (
-                self._chroma_client.create_collection(
-                    name=collection_name,
-                    embedding_function=ChromaCollections.EmbedderFunction(),
-                    metadata={"hnsw:space": "cosine"}
-                ))
-        return result
+        return ChromaClientRegistry.collection(
+            collection_name,
+            ChromaCollections.EmbedderFunction)
 
-    def load_category_data(self, category: str, collection: Collection):
-        if category in loaded_collections.keys():
-            if time.time() < loaded_collections[category]['expiration_time']:
-                return loaded_collections[category]
+    @staticmethod
+    def cached_category_data(collection_name: str, category: str):
+        """
+        Category data already cached in this process, or None. On a miss the
+        category is loaded on a background thread for the next searches, so
+        the current one goes to Chroma instead of waiting for the download.
+        """
+        if not Configuration.LOCAL_SEARCH:
+            return None
+        key = (collection_name, category)
+        version = category_versions.get(collection_name, category)
+        data = loaded_collections.get(key, version)
+        if data is None and not loaded_collections.too_large(key, version):
+            ChromaCollections._warm_category_data(collection_name, category, version)
+        return data
 
-            return self.update_loaded_data(collection, category)
-        else:
-            return self.update_loaded_data(collection, category)
+    @staticmethod
+    def _warm_category_data(collection_name: str, category: str, version):
+        key = (collection_name, category)
+        with ChromaCollections._warming_lock:
+            if key in ChromaCollections._warming:
+                return
+            ChromaCollections._warming.add(key)
+
+        def load():
+            try:
+                collection = ChromaClientRegistry.collection(
+                    collection_name,
+                    ChromaCollections.EmbedderFunction)
+                ChromaCollections.update_loaded_data(collection,
+                                                     category,
+                                                     version=version)
+            except Exception as e:
+                print_error(f"Could not load category {category}: {e}",
+                            Configuration.CHROMA_QUEUE)
+            finally:
+                with ChromaCollections._warming_lock:
+                    ChromaCollections._warming.discard(key)
+
+        threading.Thread(target=load, daemon=True).start()
 
+    def load_category_data(self, category: str, collection: Collection):
+        # Read the version before loading, so a write that lands while the
+        # category is downloaded makes the next query load it again
+        version = category_versions.get(collection.name, category)
+        data = loaded_collections.get((collection.name, category), version)
+        if data is not None:
+            return data
+        return self.update_loaded_data(collection, category, version=version)
+
+    @refresh_missing_collection
     def process_pdf_file(self, file_path, categories, collection_name):
         request_register = self._parse_request("embed",
                                                collection_name,
@@ -305,19 +909,40 @@ class ChromaCollections:
                              app=Configuration.CHROMA_QUEUE)
         
         collection = self._validate_existing_collection(collection_name)
+        fingerprint = document_fingerprint(file_path)
+        metadata = self.create_metadata_object(categories)
 
-        pdf_text = pdf_to_bytes(file_path)
-        sample_doc = pdf_text.decode('utf-8')
+        ingestion_status = self._update_existing_document(collection,
+                                                          fingerprint,
+                                                          metadata)
+        if ingestion_status:
+            if ingestion_status == "updated":
+                category_versions.bump(collection_name, metadata.keys())
+            print_successful_message(
+                f"Document already stored ({ingestion_status}): {file_path}",
+                Configuration.CHROMA_QUEUE)
+            return {"STATE": "OK",
+                    "DESCRIPTION": "Successfully processed file",
+                    "INGESTION_STATUS": ingestion_status}
 
         start_time = time.time()
         result = self.add_document_embeds(
             collection,
-            sample_doc,
-            self.create_metadata_object(categories))
+            iter_pdf_pages(file_path, Configuration.PDF_PAGES_PER_BATCH),
+            {**metadata, "fingerprint": fingerprint},
+            document_id=fingerprint)
 
         end_time = time.time()
 
+        if result and not result["CHUNKS"]:
+            err_message = f"No text could be extracted from {file_path}"
+            print_error(err_message, Configuration.CHROMA_QUEUE)
+            return {"STATE": "ERROR",
+                    "DESCRIPTION": err_message,
+                    "INGESTION_STATUS": "empty"}
+
         if result:
+            category_versions.bump(collection_name, metadata.keys())
             print_successful_message(
                 f"Successfully processed: {file_path}",
                 Configuration.CHROMA_QUEUE)
@@ -325,16 +950,195 @@ class ChromaCollections:
                 f"Document took {end_time - start_time}s to embedded",
                 Configuration.CHROMA_QUEUE)
 
-            return {"STATE": "OK", "DESCRIPTION": "Successfully processed file"}
+            return {"STATE": "OK",
+                    "DESCRIPTION": "Successfully processed file",
+                    "INGESTION_STATUS": "new",
+                    **result,
+                    "SECONDS": round(end_time - start_time, 3)}
 
         return {"STATE": "ERROR", "DESCRIPTION": "Something went wrong"}
 
+    @refresh_missing_collection
+    def process_pdf_files(self,
+                          documents: list[tuple[str, list[str]]],
+                          collection_name: str,
+                          max_workers: int = None) -> dict:
+        """
+        Bulk version of process_pdf_file for (file_path, categories) pairs.
+        Already stored documents are skipped before parsing. The rest are
+        parsed on a ParallelPdfExtractor process pool while this process
+        embeds whichever documents are ready. Copies of a document under
+        other paths take the outcome of the first copy once it is stored.
+        """
+        collection = self._validate_existing_collection(collection_name)
+        statuses = {}
+        pending = {}
+        # Outcome of documents that could not be stored, by fingerprint
+        failed_fingerprints = {}
+        # Copies of a document being parsed, by fingerprint, resolved on
+        # this thread once the outcome of the first copy is known
+        duplicates = {}
+        # The paths are read on the extractor's producer thread
+        lock = threading.Lock()
+
+        def documents_to_extract():
+            for file_path, categories in documents:
+                try:
+                    fingerprint = document_fingerprint(file_path)
+                    metadata = self.create_metadata_object(categories)
+                except Exception as e:
+                    print_error(f"Could not read {file_path}: {e}",
+                                Configuration.CHROMA_QUEUE)
+                    with lock:
+                        statuses.setdefault(file_path, "error")
+                    continue
+
+                with lock:
+                    if file_path in statuses or file_path in pending:
+                        continue
+                    if fingerprint in failed_fingerprints:
+                        statuses[file_path] = failed_fingerprints[fingerprint]
+                        continue
+                    if fingerprint in duplicates:
+                        # Same content under another path, still being
+                        # stored, so Chroma only holds part of it
+                        duplicates[fingerprint].append((file_path, metadata))
+                        pending[file_path] = (fingerprint, metadata)
+                        continue
+
+                try:
+                    status = self._update_existing_document(collection,
+                                                            fingerprint,
+                                                            metadata)
+                except Exception as e:
+                    print_error(f"Could not read {file_path}: {e}",
+                                Configuration.CHROMA_QUEUE)
+                    status = "error"
+
+                with lock:
+                    if status:
+                        statuses[file_path] = status
+                    else:
+                        pending[file_path] = (fingerprint, metadata)
+                        duplicates[fingerprint] = []
+                if status == "updated":
+                    category_versions.bump(collection_name, metadata.keys())
+                if not status:
+                    yield file_path
+
+        extractor = ParallelPdfExtractor(
+            max_workers=max_workers or Configuration.PDF_EXTRACTION_WORKERS,
+            pages_per_batch=Configuration.PDF_PAGES_PER_BATCH)
+
+        start_time = time.time()
+        for file_path, pages, error in extractor.extract(documents_to_extract()):
+            with lock:
+                fingerprint, metadata = pending[file_path]
+            report = error is None and self.add_document_embeds(
+                collection,
+                pages,
+                {**metadata, "fingerprint": fingerprint},
+                document_id=fingerprint)
+            if report and report["CHUNKS"]:
+                outcome = "new"
+                category_versions.bump(collection_name, metadata.keys())
+                print_successful_message(f"Successfully processed: {file_path}",
+                                         Configuration.CHROMA_QUEUE)
+            elif report:
+                # Nothing was stored, the file is parsed again next time
+                outcome = "empty"
+                print_error(f"No text could be extracted from {file_path}",
+                            Configuration.CHROMA_QUEUE)
+            else:
+                outcome = "error"
+                print_error(f"Could not process {file_path}: {error}",
+                            Configuration.CHROMA_QUEUE)
+            stored = outcome == "new"
+
+            with lock:
+                statuses[file_path] = outcome
+                del pending[file_path]
+                if not stored:
+                    failed_fingerprints[fingerprint] = outcome
+                # Later copies find the stored document in Chroma
+                waiting = duplicates.pop(fingerprint)
+
+            for duplicate_path, duplicate_metadata in waiting:
+                status = (self._resolve_duplicate(collection, collection_name,
+                                                  fingerprint, duplicate_metadata)
+                          if stored else outcome)
+                with lock:
+                    statuses[duplicate_path] = status
+                    del pending[duplicate_path]
+
+        summary = {status: list(statuses.values()).count(status)
+                   for status in ("new", "updated", "unchanged", "empty", "error")}
+        print_bold_message(
+            f"Processed {len(statuses)} documents in "
+            f"{time.time() - start_time:.1f}s: {summary}",
+            Configuration.CHROMA_QUEUE)
+
+        return {"STATE": "ERROR" if summary["error"] or summary["empty"] else "OK",
+                "DESCRIPTION": f"Processed {len(statuses)} files",
+                "SUMMARY": summary,
+                "INGESTION_STATUS": statuses}
+
+    def _resolve_duplicate(self, collection: Collection, collection_name: str,
+                           fingerprint: str, metadata: dict) -> str:
+        """
+        Status of a copy of a document stored during the same bulk run,
+        merging its categories into the stored chunks.
+        """
+        try:
+            status = self._update_existing_document(collection, fingerprint,
+                                                    metadata)
+        except Exception as e:
+            print_error(f"Could not update duplicate of {fingerprint}: {e}",
+                        Configuration.CHROMA_QUEUE)
+            return "error"
+        if status == "updated":
+            category_versions.bump(collection_name, metadata.keys())
+        return status or "error"
+
+    @staticmethod
+    def _update_existing_document(collection: Collection,
+                                  fingerprint: str,
+                                  metadata: dict) -> str:
+        """
+        Look the document up by fingerprint. Returns "unchanged" or "updated"
+        when its chunks are already stored, merging any new categories into
+        their metadata, and an empty string when the document is new.
+        """
+        # Every chunk of a document shares its metadata, one is enough
+        existing = collection.get(where={"fingerprint": fingerprint},
+                                  limit=1,
+                                  include=["metadatas"])
+        if not existing['ids']:
+            return ""
+
+        stored_metadata = existing['metadatas'][0] or {}
+        merged_metadata = {**stored_metadata, **metadata}
+        if merged_metadata == stored_metadata:
+            return "unchanged"
+
+        chunk_ids = collection.get(where={"fingerprint": fingerprint},
+                                   include=[])['ids']
+        collection.update(ids=chunk_ids,
+                          metadatas=[merged_metadata] * len(chunk_ids))
+        lexical_index = LexicalIndex.for_collection(str(collection.name))
+        if lexical_index is not None:
+            lexical_index.set_categories(chunk_ids, chunk_categories(merged_metadata))
+        return "updated"
+
+    @refresh_missing_collection
     def execute_search_query(self,
                              collection_name,
                              category,
                              user_query,
                              task_id: int,
-                             max_tries: int = 2):
+                             max_tries: int = 2,
+                             retrieval_mode: str = None):
+        retrieval_mode = retrieval_mode or Configuration.RETRIEVAL_MODE
         request_register = self._parse_request("query",
                                                collection_name,
                                                category,
@@ -344,15 +1148,9 @@ class ChromaCollections:
 
         collection = self._validate_existing_collection(collection_name)
 
-        
-        loaded_db_data: dict = self.load_category_data(
-            category=category,
-            collection=collection)
-        
-        (found_data,
-         loaded_db_data,
-         response_message) = self._validate_loaded_response(loaded_db_data, category)
-        if not found_data:
+        if not self.category_has_documents(collection, category):
+            response_message = ("No information found at present for this "
+                                f"category: {category}")
             print_error(response_message, Configuration.CHROMA_QUEUE)
             return {
                 "STATE": "ERROR",
@@ -364,7 +1162,10 @@ class ChromaCollections:
                 query_result := ChromaCollections.basic_chroma_query(
                     collection,
                     category,
-                    user_query)
+                    user_query,
+                    category_data=self.cached_category_data(collection.name,
+                                                            category),
+                    mode=retrieval_mode)
         ) is False:
             if counter == max_tries:
                 err_message = "Your search yielded no results."
@@ -374,10 +1175,16 @@ class ChromaCollections:
                     "DESCRIPTION": err_message
                 }
 
-            ChromaCollections.update_loaded_data(
-                collection=collection,
-                category=category,
-                re_query=True)
+            if not ChromaCollections.category_has_documents(collection,
+                                                            category,
+                                                            refresh=True):
+                err_message = ("No information found at present for this "
+                               f"category: {category}")
+                print_error(err_message, Configuration.CHROMA_QUEUE)
+                return {
+                    "STATE": "ERROR",
+                    "DESCRIPTION": err_message
+                }
 
             print_warning_message("Retrying query...",
                                   Configuration.CHROMA_QUEUE)
@@ -386,4 +1193,6 @@ class ChromaCollections:
             f"Successfully retrieved db data: {query_result}",
             Configuration.CHROMA_QUEUE)
 
-        return self._invoke_llm(query_result, user_query, task_id)
+        return {**self._invoke_llm(query_result, user_query, task_id,
+                                   {"RETRIEVAL_MODE": retrieval_mode}),
+                "RETRIEVAL_MODE": retrieval_mode}
@@ -0,0 +1,124 @@
+import resource
+import threading
+import time
+import torch
+
+from transformers import AutoTokenizer, AutoModel
+
+from chroma_ms_config import Configuration
+from utils.outputs import (print_bold_message,
+                           print_header_message,
+                           print_warning_message)
+
+INFERENCE_MODES = ("fp32", "int8", "bf16")
+
+
+class EmbedderRegistry:
+    """
+    Process-wide registry of loaded embedding models. Every Celery task
+    running in the same worker process shares the tokenizer and model
+    weights loaded here instead of reading them from disk on each call.
+    Models are keyed by name and inference mode.
+    """
+    _models: dict = {}
+    _stats: dict = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, model_name: str = None, inference_mode: str = None) -> tuple:
+        model_name = model_name or Configuration.EMBEDDING_MODEL
+        inference_mode = inference_mode or Configuration.EMBEDDING_INFERENCE_MODE
+        key = (model_name, inference_mode)
+        loaded = cls._models.get(key)
+        if loaded is not None:
+            return loaded
+
+        with cls._lock:
+            if key not in cls._models:
+                cls._models[key] = cls._load(model_name, inference_mode)
+            return cls._models[key]
+
+    @classmethod
+    def _load(cls, model_name: str, inference_mode: str) -> tuple:
+        print_header_message(
+            f"Loading embedding model {model_name} ({inference_mode})...",
+            Configuration.CHROMA_QUEUE)
+        rss_before = _max_rss_mb()
+        start_time = time.time()
+
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+        model.eval()
+        model, effective_mode = apply_inference_mode(model, inference_mode)
+
+        load_time = time.time() - start_time
+        rss_after = _max_rss_mb()
+        cls._stats[f"{model_name}:{inference_mode}"] = {
+            'inference_mode': effective_mode,
+            'load_time_s': round(load_time, 3),
+            'parameters_mb': _parameters_mb(model),
+            'rss_before_mb': rss_before,
+            'rss_after_mb': rss_after,
+            'rss_delta_mb': round(rss_after - rss_before, 1),
+        }
+        print_bold_message(
+            f"Embedding model {model_name} ({effective_mode}) loaded in "
+            f"{load_time:.2f}s (max RSS {rss_before:.1f}MB -> "
+            f"{rss_after:.1f}MB)",
+            Configuration.CHROMA_QUEUE)
+
+        return tokenizer, model
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {name: dict(values) for name, values in cls._stats.items()}
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._models.clear()
+            cls._stats.clear()
+
+
+def apply_inference_mode(model, inference_mode: str) -> tuple:
+    """
+    Convert a loaded fp32 model to the requested CPU inference mode.
+    Returns the model to use and the mode actually applied.
+    """
+    if inference_mode not in INFERENCE_MODES:
+        raise ValueError(f"Unknown inference mode '{inference_mode}', "
+                         f"expected one of {INFERENCE_MODES}")
+
+    if inference_mode == "int8":
+        return (torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8), "int8")
+
+    if inference_mode == "bf16":
+        if cpu_supports_bf16():
+            return model.to(torch.bfloat16), "bf16"
+        print_warning_message(
+            "bf16 is not supported on this CPU, falling back to fp32.",
+            Configuration.CHROMA_QUEUE)
+
+    return model, "fp32"
+
+
+def cpu_supports_bf16() -> bool:
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def _parameters_mb(model) -> float:
+    try:
+        tensors = list(model.parameters()) + list(model.buffers())
+        return round(sum(tensor.numel() * tensor.element_size()
+                         for tensor in tensors) / (1024 ** 2), 1)
+    except (AttributeError, TypeError):
+        return 0.0
+
+
+def _max_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
@@ -0,0 +1,188 @@
+import fcntl
+import hashlib
+import os
+import threading
+
+from collections import OrderedDict
+
+import numpy as np
+
+from chroma_ms_config import Configuration
+
+
+def normalize_text(text: str) -> str:
+    # The tokenizer splits on whitespace, so runs of spaces and line breaks
+    # do not change the embedding and should not change the cache key
+    return " ".join(text.split())
+
+
+class DiskEmbeddingStore:
+    """
+    Append-only on-disk tier. Vectors are stored as consecutive float32 rows
+    in a memory-mapped file and an index file maps each key to its row.
+    Several worker processes can share the same directory: appends are
+    serialized with a file lock and readers pick up new index lines lazily.
+    """
+
+    def __init__(self, directory: str, dimension: int):
+        os.makedirs(directory, exist_ok=True)
+        self.dimension = dimension
+        self.vectors_path = os.path.join(directory, f"vectors_{dimension}.f32")
+        self.index_path = os.path.join(directory, f"index_{dimension}.tsv")
+        self._index: dict[str, int] = {}
+        self._index_offset = 0
+        self._vectors = None
+        self._lock = threading.Lock()
+        open(self.vectors_path, 'ab').close()
+        open(self.index_path, 'ab').close()
+        self._refresh_index()
+
+    def _refresh_index(self) -> None:
+        with open(self.index_path, 'rb') as index_file:
+            index_file.seek(self._index_offset)
+            for line in index_file:
+                if not line.endswith(b"\n"):
+                    # Partially written line, read it again next time
+                    break
+                key, row = line.decode('utf-8').rstrip("\n").split("\t")
+                self._index[key] = int(row)
+                self._index_offset += len(line)
+
+    def _row(self, row: int) -> np.ndarray:
+        if self._vectors is None or row >= self._vectors.shape[0]:
+            self._vectors = np.memmap(self.vectors_path,
+                                      dtype=np.float32,
+                                      mode='r').reshape(-1, self.dimension)
+        return np.array(self._vectors[row])
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @classmethod
+    def open_existing(cls, directory: str):
+        if not os.path.isdir(directory):
+            return None
+        for file_name in os.listdir(directory):
+            if file_name.startswith("index_") and file_name.endswith(".tsv"):
+                return cls(directory, int(file_name[len("index_"):-len(".tsv")]))
+        return None
+
+    def get(self, key: str):
+        with self._lock:
+            if key not in self._index:
+                self._refresh_index()
+            row = self._index.get(key)
+            return None if row is None else self._row(row)
+
+    def put_many(self, items: list[tuple[str, np.ndarray]]) -> None:
+        with self._lock, open(self.index_path, 'ab') as index_file:
+            fcntl.flock(index_file, fcntl.LOCK_EX)
+            try:
+                self._refresh_index()
+                with open(self.vectors_path, 'ab') as vectors_file:
+                    row = vectors_file.tell() // (self.dimension * 4)
+                    lines = []
+                    for key, vector in items:
+                        if key in self._index:
+                            continue
+                        vectors_file.write(
+                            np.asarray(vector, dtype=np.float32).tobytes())
+                        lines.append(f"{key}\t{row}\n")
+                        self._index[key] = row
+                        row += 1
+                # Index lines are written after their vectors are on disk
+                index_file.write("".join(lines).encode('utf-8'))
+                index_file.flush()
+                self._index_offset = index_file.tell()
+            finally:
+                fcntl.flock(index_file, fcntl.LOCK_UN)
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache keyed by (model id, normalized text hash):
+    a bounded in-memory LRU in front of an optional on-disk store.
+    """
+    _caches: dict = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, model_id: str, max_entries: int, directory: str = None):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.directory = directory
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._disk: DiskEmbeddingStore | None = (
+            DiskEmbeddingStore.open_existing(directory) if directory else None)
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'disk_hits': 0, 'misses': 0,
+                          'evictions': 0}
+
+    @classmethod
+    def for_model(cls, model_id: str) -> "EmbeddingCache":
+        with cls._instances_lock:
+            if model_id not in cls._caches:
+                directory = None
+                if Configuration.EMBEDDING_CACHE_DIR:
+                    safe_name = hashlib.sha1(model_id.encode('utf-8')).hexdigest()
+                    directory = os.path.join(Configuration.EMBEDDING_CACHE_DIR,
+                                             safe_name)
+                cls._caches[model_id] = cls(
+                    model_id,
+                    Configuration.EMBEDDING_CACHE_ENTRIES,
+                    directory)
+            return cls._caches[model_id]
+
+    @classmethod
+    def clear_all(cls) -> None:
+        with cls._instances_lock:
+            cls._caches.clear()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(
+            f"{self.model_id}\0{normalize_text(text)}".encode('utf-8')
+        ).hexdigest()
+
+    def get_many(self, texts: list[str]) -> list:
+        results = []
+        with self._lock:
+            for text in texts:
+                key = self.key(text)
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self._counters['hits'] += 1
+                elif self._disk is not None and (vector := self._disk.get(key)) is not None:
+                    self._counters['disk_hits'] += 1
+                    self._remember(key, vector)
+                else:
+                    self._counters['misses'] += 1
+                results.append(vector)
+        return results
+
+    def put_many(self, texts: list[str], embeddings: list) -> None:
+        items = [(self.key(text), np.asarray(embedding, dtype=np.float32))
+                 for text, embedding in zip(texts, embeddings)]
+        if not items:
+            return
+        with self._lock:
+            for key, vector in items:
+                self._remember(key, vector)
+            if self.directory is not None:
+                if self._disk is None:
+                    self._disk = DiskEmbeddingStore(self.directory,
+                                                    items[0][1].shape[0])
+                self._disk.put_many(items)
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counters,
+                        entries=len(self._memory),
+                        max_entries=self.max_entries,
+                        disk_entries=len(self._disk) if self._disk else 0)
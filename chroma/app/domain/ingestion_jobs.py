@@ -0,0 +1,180 @@
+import json
+import time
+import uuid
+
+JOB_KEY = "ingestion_job:{job_id}"
+FILES_KEY = "ingestion_job:{job_id}:files"
+DONE_STATUSES = ("new", "updated", "unchanged")
+
+
+def parse_manifest(manifest_path: str,
+                   default_categories: list[str] = None) -> list[tuple]:
+    """
+    Read a manifest where each line holds a file path, optionally followed by
+    a tab and a comma separated list of categories. Lines without categories
+    use default_categories.
+    """
+    documents = []
+    with open(manifest_path, 'r', encoding='utf-8') as manifest:
+        for line in manifest:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            file_path, _, categories = line.partition("\t")
+            categories = ([category.strip() for category in categories.split(",")
+                           if category.strip()]
+                          or list(default_categories or []))
+            documents.append((file_path, categories))
+    return merge_documents(documents)
+
+
+def merge_documents(documents: list[tuple]) -> list[tuple]:
+    """
+    One (file_path, categories) entry per path, in first seen order, with
+    the categories of every entry of the path. A job tracks its files by
+    path, so a repeated path would never finish and could be ingested by
+    two lanes at once.
+    """
+    merged = {}
+    for file_path, categories in documents:
+        merged_categories = merged.setdefault(file_path, [])
+        merged_categories.extend(category for category in categories or []
+                                 if category not in merged_categories)
+    return list(merged.items())
+
+
+def split_into_lanes(documents: list, concurrency: int) -> list[list]:
+    """
+    Spread documents round-robin over at most `concurrency` lanes. Each lane
+    is processed sequentially, so lanes bound how many files run at once.
+    """
+    lanes = [[] for _ in range(max(min(concurrency, len(documents)), 1))]
+    for index, document in enumerate(documents):
+        lanes[index % len(lanes)].append(document)
+    return [lane for lane in lanes if lane]
+
+
+def summarize_job(job: dict, files: dict, now: float = None) -> dict:
+    """
+    Aggregate progress and throughput of a job from its per-file records.
+    """
+    now = now or time.time()
+    status_counts = {}
+    pages = chunks = 0
+    finished_at = []
+    for record in files.values():
+        status_counts[record['status']] = status_counts.get(record['status'], 0) + 1
+        pages += record.get('pages', 0)
+        chunks += record.get('chunks', 0)
+        if record.get('finished_at'):
+            finished_at.append(record['finished_at'])
+
+    completed = sum(status_counts.get(status, 0) for status in DONE_STATUSES)
+    failed = status_counts.get('failed', 0)
+    total = int(job.get('total', len(files)))
+    # The clock stops once every file has finished
+    end_time = (max(finished_at) if finished_at and completed + failed == total
+                else now)
+    elapsed = max(end_time - float(job.get('created_at', now)), 1e-9)
+
+    return {
+        "JOB_ID": job.get('job_id'),
+        "COLLECTION": job.get('collection_name'),
+        "STATE": "FINISHED" if completed + failed == total else "RUNNING",
+        "TOTAL": total,
+        "COMPLETED": completed,
+        "FAILED": failed,
+        "STATUS_COUNTS": status_counts,
+        "PAGES": pages,
+        "CHUNKS": chunks,
+        "ELAPSED_S": round(elapsed, 3),
+        "PAGES_PER_S": round(pages / elapsed, 3),
+        "CHUNKS_PER_S": round(chunks / elapsed, 3),
+        "FILES": files,
+    }
+
+
+class IngestionJobs:
+    """
+    Redis-backed state of bulk ingestion jobs: one hash with the job
+    settings and one hash with a JSON record per file. Both expire ttl
+    seconds after the last change to the job.
+    """
+
+    def __init__(self, redis_client, ttl: int = 7 * 24 * 3600):
+        self._redis = redis_client
+        self.ttl = ttl
+
+    def _expire(self, pipeline, job_id: str) -> None:
+        pipeline.expire(JOB_KEY.format(job_id=job_id), self.ttl)
+        pipeline.expire(FILES_KEY.format(job_id=job_id), self.ttl)
+
+    def create(self,
+               collection_name: str,
+               documents: list[tuple[str, list[str]]],
+               concurrency: int) -> str:
+        job_id = str(uuid.uuid4())
+        files = dict(merge_documents(documents))
+        pipeline = self._redis.pipeline()
+        pipeline.hset(JOB_KEY.format(job_id=job_id), mapping={
+            'job_id': job_id,
+            'collection_name': collection_name,
+            'total': len(files),
+            'concurrency': concurrency,
+            'created_at': time.time(),
+        })
+        pipeline.hset(FILES_KEY.format(job_id=job_id), mapping={
+            file_path: json.dumps({'status': 'queued',
+                                   'categories': categories,
+                                   'attempts': 0})
+            for file_path, categories in files.items()
+        })
+        self._expire(pipeline, job_id)
+        pipeline.execute()
+        return job_id
+
+    def get(self, job_id: str) -> dict:
+        job = self._redis.hgetall(JOB_KEY.format(job_id=job_id))
+        if not job:
+            return {}
+        return {key.decode('utf-8'): value.decode('utf-8')
+                for key, value in job.items()}
+
+    def files(self, job_id: str) -> dict:
+        return {file_path.decode('utf-8'): json.loads(record)
+                for file_path, record
+                in self._redis.hgetall(FILES_KEY.format(job_id=job_id)).items()}
+
+    def start_file(self, job_id: str, file_path: str) -> None:
+        record = self.files(job_id).get(file_path, {})
+        self.update_file(job_id, file_path,
+                         status='running',
+                         attempts=record.get('attempts', 0) + 1,
+                         started_at=time.time())
+
+    def requeue_failed(self, job_id: str) -> list[tuple[str, list[str]]]:
+        documents = self.failed_documents(job_id)
+        for file_path, _ in documents:
+            self.update_file(job_id, file_path, status='queued', error=None)
+        return documents
+
+    def update_file(self, job_id: str, file_path: str, **fields) -> None:
+        key = FILES_KEY.format(job_id=job_id)
+        record = json.loads(self._redis.hget(key, file_path) or b'{}')
+        record.update(fields)
+        pipeline = self._redis.pipeline()
+        pipeline.hset(key, file_path, json.dumps(record))
+        # Long running jobs stay around while files keep finishing
+        self._expire(pipeline, job_id)
+        pipeline.execute()
+
+    def failed_documents(self, job_id: str) -> list[tuple[str, list[str]]]:
+        return [(file_path, record['categories'])
+                for file_path, record in self.files(job_id).items()
+                if record['status'] == 'failed']
+
+    def progress(self, job_id: str) -> dict:
+        job = self.get(job_id)
+        if not job:
+            return {}
+        return summarize_job(job, self.files(job_id))
@@ -0,0 +1,187 @@
+import fcntl
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
+import threading
+
+from collections import Counter
+
+from gensim.parsing.preprocessing import STOPWORDS
+
+from chroma_ms_config import Configuration
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> list[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower())
+            if len(token) > 1 and token not in STOPWORDS]
+
+
+def chunk_categories(metadata: dict) -> list[str]:
+    # Categories are stored as metadata keys set to 1, next to the fingerprint
+    return [key for key, value in metadata.items() if value == 1]
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the chunks of a collection. Postings remember
+    the categories of each chunk, so searches are restricted to one
+    category without keeping a separate index per category.
+
+    The index is persisted as an append-only log of JSON lines, one per
+    added chunk or category change. Worker processes sharing the directory
+    append under a file lock and replay lines written by the others before
+    searching.
+    """
+    _indexes: dict = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path: str = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._postings: dict[str, dict[int, int]] = {}
+        self._ids: list[str] = []
+        self._positions: dict[str, int] = {}
+        self._lengths: list[int] = []
+        self._categories: list[frozenset] = []
+        self._total_length = 0
+        self._offset = 0
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'ab').close()
+            self.refresh()
+
+    @classmethod
+    def for_collection(cls, collection_name: str):
+        """
+        Shared index of a collection, or None when LEXICAL_INDEX_DIR is empty.
+        """
+        if not Configuration.LEXICAL_INDEX_DIR:
+            return None
+        with cls._instances_lock:
+            if collection_name not in cls._indexes:
+                safe_name = hashlib.sha1(collection_name.encode('utf-8')).hexdigest()
+                cls._indexes[collection_name] = cls(
+                    os.path.join(Configuration.LEXICAL_INDEX_DIR, f"{safe_name}.jsonl"))
+            return cls._indexes[collection_name]
+
+    @classmethod
+    def clear_all(cls) -> None:
+        with cls._instances_lock:
+            cls._indexes.clear()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @staticmethod
+    def chunk_entry(chunk_id: str, text: str) -> dict:
+        """
+        Index record of a chunk, small enough to keep until its document
+        has been stored.
+        """
+        tokens = tokenize(text)
+        return {'id': chunk_id, 'tf': dict(Counter(tokens)), 'len': len(tokens)}
+
+    def add_many(self, entries: list[dict], categories: list[str]) -> None:
+        records = [{'op': 'add', **entry, 'cats': list(categories)}
+                   for entry in entries]
+        self._write(records)
+
+    def set_categories(self, chunk_ids: list[str], categories: list[str]) -> None:
+        self._write([{'op': 'cats', 'ids': list(chunk_ids),
+                      'cats': list(categories)}])
+
+    def _write(self, records: list[dict]) -> None:
+        if not records:
+            return
+        with self._lock:
+            if not self.path:
+                for record in records:
+                    self._apply(record)
+                return
+            with open(self.path, 'ab') as log_file:
+                fcntl.flock(log_file, fcntl.LOCK_EX)
+                try:
+                    # Lines appended by other processes come first
+                    self._replay()
+                    log_file.write("".join(json.dumps(record) + "\n"
+                                           for record in records).encode('utf-8'))
+                    log_file.flush()
+                    for record in records:
+                        self._apply(record)
+                    self._offset = log_file.tell()
+                finally:
+                    fcntl.flock(log_file, fcntl.LOCK_UN)
+
+    def refresh(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            self._replay()
+
+    def _replay(self) -> None:
+        if os.path.getsize(self.path) == self._offset:
+            return
+        with open(self.path, 'rb') as log_file:
+            log_file.seek(self._offset)
+            for line in log_file:
+                if not line.endswith(b"\n"):
+                    # Partially written line, read it again next time
+                    break
+                self._apply(json.loads(line))
+                self._offset += len(line)
+
+    def _apply(self, record: dict) -> None:
+        if record['op'] == 'cats':
+            for chunk_id in record['ids']:
+                position = self._positions.get(chunk_id)
+                if position is not None:
+                    self._categories[position] = frozenset(record['cats'])
+            return
+
+        if record['id'] in self._positions:
+            return
+        position = len(self._ids)
+        self._ids.append(record['id'])
+        self._positions[record['id']] = position
+        self._lengths.append(record['len'])
+        self._categories.append(frozenset(record['cats']))
+        self._total_length += record['len']
+        for term, frequency in record['tf'].items():
+            self._postings.setdefault(term, {})[position] = frequency
+
+    def search(self, query: str, category: str, k: int) -> list[tuple[str, float]]:
+        """
+        Best k (chunk id, BM25 score) pairs of the category for the query,
+        highest score first. Chunks sharing no term with the query are left
+        out.
+        """
+        self.refresh()
+        with self._lock:
+            if not self._ids:
+                return []
+            document_count = len(self._ids)
+            average_length = self._total_length / document_count
+            scores: dict[int, float] = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (document_count - len(postings) + 0.5)
+                               / (len(postings) + 0.5))
+                for position, frequency in postings.items():
+                    if category not in self._categories[position]:
+                        continue
+                    length_norm = self.k1 * (1 - self.b + self.b
+                                             * self._lengths[position] / average_length)
+                    scores[position] = scores.get(position, 0.0) + (
+                        idf * frequency * (self.k1 + 1) / (frequency + length_norm))
+
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(self._ids[position], score) for position, score in best]
@@ -0,0 +1,40 @@
+import numpy as np
+
+
+def normalize_rows(matrix) -> np.ndarray:
+    """
+    float32 copy of the matrix with unit-length rows, so cosine similarity
+    becomes a plain dot product. All-zero rows are left as zeros.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+def top_k_cosine(matrix: np.ndarray, queries, k: int) -> tuple:
+    """
+    Score every query against every row of a row-normalized matrix with one
+    matrix multiply and select the k best rows per query with argpartition,
+    which avoids sorting the whole category.
+
+    Returns (indices, similarities), both of shape (queries, min(k, rows)),
+    ordered from the most to the least similar row.
+    """
+    queries = normalize_rows(queries)
+    k = min(k, matrix.shape[0])
+    if k == 0:
+        empty = np.empty((queries.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+
+    scores = queries @ matrix.T
+    if k < matrix.shape[0]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(matrix.shape[0]),
+                                     (queries.shape[0], matrix.shape[0]))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1)
+    return (np.take_along_axis(candidates, order, axis=1),
+            np.take_along_axis(candidate_scores, order, axis=1))
@@ -3,33 +3,46 @@ import json
 import gc
 import os
 
+from celery import chain, group
+
 from chroma.celery_conf import celery
-from chroma.app import redis_client
-from chroma.app.domain.chroma_collections import ChromaCollections
+from chroma.app import redis_client, task_results
+from chroma.app.domain.async_search import run_search_query
+from chroma.app.domain.chroma_collections import ChromaCollections, HANDED_OFF
+from chroma.app.domain.ingestion_jobs import (IngestionJobs,
+                                              merge_documents,
+                                              split_into_lanes)
 from utils.outputs import print_successful_message, print_error
+from utils.token_streams import sse_token_event
 from chroma_ms_config import Configuration
-from billiard.exceptions import TimeLimitExceeded
+from billiard.exceptions import SoftTimeLimitExceeded, TimeLimitExceeded
 
 
 def sse_stream(task_id):
     """Stream events to the client."""
     try:
-        while True:
-            # Poll Redis for task result
-            result = redis_client.get(task_id)
-            if result:
-                decoded_result = json.loads(result.decode('utf-8'))
+        # Flush the response headers so the client knows the stream is open
+        yield ": waiting\n\n"
+        # Blocks until the task publishes generated text or its result
+        for event in task_results.follow(task_id,
+                                         Configuration.SSE_HEARTBEAT_SECONDS,
+                                         Configuration.TOKEN_STREAMING):
+            if event['event'] == 'heartbeat':
+                # Comment line, ignored by clients, that surfaces disconnections
+                yield ": waiting\n\n"
+            elif event['event'] != 'result':
+                yield sse_token_event(event)
+            else:
+                decoded_result = event['result']
                 state = decoded_result.get('state')
-                inner_result = json.loads(decoded_result['result'])
+                inner_result = decoded_result['result']
                 if state == 'ERROR':
                     yield f"data: {json.dumps({'state': 'ERROR', 'message': inner_result})}\n\n"
                 else:
                     yield f"data: {json.dumps({'state': 'SUCCESS', 'result': inner_result})}\n\n"
-                    
+
                 gc.collect()
                 break
-
-            time.sleep(2)
     except GeneratorExit:
         print_error(f"Client disconnected while waiting for task {task_id}",
                     app=Configuration.CHROMA_QUEUE)
@@ -42,25 +55,35 @@ def sse_stream(task_id):
 def error_handler(task_id, exc):
     print_error(message=f'{task_id} - Something went wrong: {exc}',
                 app=Configuration.CHROMA_QUEUE)
-    redis_client.set(task_id,
-                     json.dumps({'state': 'ERROR', 'result': exc}))
+    task_results.store(task_id, 'ERROR', exc)
 
 
 @celery.task()
-def chroma_search_query_task(collection_name, category, user_query):
+def chroma_search_query_task(collection_name, category, user_query,
+                             retrieval_mode=None):
 
     task_id = chroma_search_query_task.request.id
     
     try:
-        result = ChromaCollections().execute_search_query(collection_name,
-                                                        category,
-                                                        user_query,
-                                                        task_id)
+        if Configuration.ASYNC_SEARCH:
+            result = run_search_query(collection_name,
+                                      category,
+                                      user_query,
+                                      task_id,
+                                      retrieval_mode=retrieval_mode)
+        else:
+            result = ChromaCollections().execute_search_query(
+                collection_name,
+                category,
+                user_query,
+                task_id,
+                retrieval_mode=retrieval_mode)
 
-        _store_task_results(task_id, result)
         print_successful_message(app=Configuration.CHROMA_QUEUE,
                                  message=f"Task result: {result}")
-        _store_task_results(task_id, result)
+        if result.get("STATE") != HANDED_OFF:
+            # Otherwise the langchain task stores the answer under this id
+            _store_task_results(task_id, result)
     except Exception as exc:
         error_handler(task_id, str(exc))
         return None
@@ -84,7 +107,7 @@ def chroma_embed_task(collection_name, file_path, categories, isForm=False):
             categories=categories)
         
         _store_task_results(task_id, result)
-    except TimeLimitExceeded:
+    except SoftTimeLimitExceeded:
         error_handler(task_id, "Task exceeded the time alloted to be used.")
         return None
     except Exception as exc:
@@ -98,9 +121,93 @@ def chroma_embed_task(collection_name, file_path, categories, isForm=False):
     return result
 
 
-def _store_task_results(task_id, result) -> None:
+@celery.task(soft_time_limit=500)
+def chroma_bulk_file_task(job_id, collection_name, file_path, categories):
+    """
+    Ingest one file of a bulk ingestion job and record its outcome on the
+    job. Errors are recorded instead of raised so the rest of the lane keeps
+    running.
+    """
+    jobs = IngestionJobs(redis_client, Configuration.INGESTION_JOB_TTL)
+
+    try:
+        jobs.start_file(job_id, file_path)
+        result = ChromaCollections().process_pdf_file(
+            file_path=file_path,
+            collection_name=collection_name,
+            categories=categories)
+    except SoftTimeLimitExceeded:
+        result = {"STATE": "ERROR",
+                  "DESCRIPTION": "Task exceeded the time alloted to be used."}
+    except Exception as exc:
+        result = {"STATE": "ERROR", "DESCRIPTION": str(exc)}
+
+    try:
+        if result["STATE"] == "OK":
+            jobs.update_file(job_id, file_path,
+                             status=result["INGESTION_STATUS"],
+                             pages=result.get("PAGES", 0),
+                             chunks=result.get("CHUNKS", 0),
+                             seconds=result.get("SECONDS", 0),
+                             timings=result.get("TIMINGS"),
+                             error=None,
+                             finished_at=time.time())
+        else:
+            print_error(f"{job_id} - Failed to ingest {file_path}: "
+                        f"{result['DESCRIPTION']}",
+                        app=Configuration.CHROMA_QUEUE)
+            jobs.update_file(job_id, file_path,
+                             status='failed',
+                             error=result["DESCRIPTION"],
+                             finished_at=time.time())
+    except Exception as exc:
+        # Raising would stop the files after this one in the lane
+        print_error(f"{job_id} - Could not record the outcome of {file_path}: {exc}",
+                    app=Configuration.CHROMA_QUEUE)
+
+    return result
+
+
+def dispatch_ingestion_job(job_id, collection_name, documents, concurrency):
+    """
+    Fan the documents out over `concurrency` chains of chroma_bulk_file_task.
+    Files within a chain run one after another, chains run in parallel.
+    """
+    lanes = split_into_lanes(documents, concurrency)
+    group(
+        chain(*[chroma_bulk_file_task.si(job_id,
+                                         collection_name,
+                                         file_path,
+                                         categories).set(
+                    queue=Configuration.CHROMA_INGESTION_QUEUE)
+                for file_path, categories in lane])
+        for lane in lanes
+    ).apply_async()
+
+
+def start_ingestion_job(collection_name, documents, concurrency) -> str:
+    # A path listed twice would otherwise be ingested by two lanes at once
+    documents = merge_documents(documents)
+    jobs = IngestionJobs(redis_client, Configuration.INGESTION_JOB_TTL)
+    job_id = jobs.create(collection_name, documents, concurrency)
+    dispatch_ingestion_job(job_id, collection_name, documents, concurrency)
     print_successful_message(
-        message=f"Storing result of task: {task_id} on redis...",
-        app=Configuration.LANGCHAIN_QUEUE)
-    redis_client.set(task_id,
-                     json.dumps({'state': 'SUCCESS', 'result':json.dumps(result)}))
+        message=f"Started ingestion job {job_id} with {len(documents)} files",
+        app=Configuration.CHROMA_QUEUE)
+    return job_id
+
+
+def retry_ingestion_job(job_id) -> int:
+    jobs = IngestionJobs(redis_client, Configuration.INGESTION_JOB_TTL)
+    job = jobs.get(job_id)
+    documents = jobs.requeue_failed(job_id)
+    if documents:
+        dispatch_ingestion_job(job_id,
+                               job['collection_name'],
+                               documents,
+                               int(job['concurrency']))
+    return len(documents)
+
+
+def _store_task_results(task_id, result) -> None:
+    task_results.store(task_id, 'SUCCESS', result)
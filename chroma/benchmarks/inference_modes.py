@@ -0,0 +1,107 @@
+"""
+Compare the embedder inference modes on the sample documents.
+
+Reports throughput for every mode and the cosine drift of its embeddings
+against the fp32 ones, so a mode can be picked knowing both its speed and
+its quality cost.
+
+Usage:
+    python -m chroma.benchmarks.inference_modes [--modes fp32 int8 bf16]
+                                                [--repeat 3]
+"""
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+
+from chroma.app.domain.chroma_collections import (ChromaCollections,
+                                                  chunk_text_by_tokens)
+from chroma.app.domain.embedder_registry import (EmbedderRegistry,
+                                                 INFERENCE_MODES)
+from documents.utils import pdf_to_bytes
+
+SAMPLE_DOCUMENTS = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                "sample_documents")
+
+
+def load_sample_chunks(documents_path: str = SAMPLE_DOCUMENTS) -> list[str]:
+    tokenizer, _ = EmbedderRegistry.get(inference_mode="fp32")
+    chunks = []
+    for pdf_path in sorted(glob.glob(os.path.join(documents_path, "*.pdf"))):
+        document_chunks, _ = chunk_text_by_tokens(
+            pdf_to_bytes(pdf_path).decode('utf-8'), tokenizer)
+        chunks.extend(document_chunks)
+    return chunks
+
+
+def embed_with_mode(chunks: list[str], mode: str, repeat: int) -> tuple:
+    embedder = ChromaCollections.EmbedderFunction(inference_mode=mode)
+    # Warm-up run so one-off allocations are not measured
+    embedder.embed_uncached(chunks[:1])
+
+    timings = []
+    embeddings = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        embeddings = embedder.embed_uncached(chunks)
+        timings.append(time.perf_counter() - start_time)
+    return np.asarray(embeddings, dtype=np.float32), min(timings)
+
+
+def cosine_drift(reference: np.ndarray, candidate: np.ndarray) -> np.ndarray:
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    return 1.0 - np.sum(reference * candidate, axis=1)
+
+
+def run_benchmark(modes: list[str], repeat: int) -> list[dict]:
+    chunks = load_sample_chunks()
+    if not chunks:
+        raise SystemExit(f"No PDF text found in {SAMPLE_DOCUMENTS}")
+
+    tokenizer, _ = EmbedderRegistry.get(inference_mode="fp32")
+    total_tokens = sum(len(ids) for ids in tokenizer(chunks, truncation=True)['input_ids'])
+
+    reference, _ = embed_with_mode(chunks, "fp32", 1)
+    results = []
+    for mode in modes:
+        embeddings, elapsed = embed_with_mode(chunks, mode, repeat)
+        drift = cosine_drift(reference, embeddings)
+        results.append({
+            'mode': mode,
+            'chunks': len(chunks),
+            'seconds': elapsed,
+            'chunks_per_s': len(chunks) / elapsed,
+            'tokens_per_s': total_tokens / elapsed,
+            'mean_drift': float(drift.mean()),
+            'max_drift': float(drift.max()),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=list(INFERENCE_MODES),
+                        choices=INFERENCE_MODES)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.modes, args.repeat)
+
+    print(f"{'mode':<6} {'chunks':>7} {'seconds':>9} {'chunks/s':>9} "
+          f"{'tokens/s':>10} {'mean drift':>11} {'max drift':>10}")
+    for result in results:
+        print(f"{result['mode']:<6} {result['chunks']:>7} "
+              f"{result['seconds']:>9.3f} {result['chunks_per_s']:>9.2f} "
+              f"{result['tokens_per_s']:>10.1f} {result['mean_drift']:>11.2e} "
+              f"{result['max_drift']:>10.2e}")
+
+    for name, stats in EmbedderRegistry.stats().items():
+        print(f"{name}: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Measure how many result streams a server keeps open at once.
+
+Opens --clients concurrent result streams and records how long each one
+waits before the server starts streaming. Streams are held open for --hold
+seconds, as they would be while a long answer is generated, so a server
+serving one stream per thread stops accepting new ones once its threads
+are taken.
+
+By default every client follows GET /chroma/stream/<task_id> on a task id
+whose result is never stored, so the streams stay open on heartbeats
+without any worker, broker or collection. With --payload the clients post
+that search to /chroma/documents instead, which needs the whole stack
+running.
+
+Run it against both worker classes to compare them:
+
+    GUNICORN_WORKER_CLASS=sync gunicorn -c chroma/gunicorn.conf.py 'chroma:create_app()'
+    GUNICORN_WORKER_CLASS=gevent gunicorn -c chroma/gunicorn.conf.py 'chroma:create_app()'
+
+Usage:
+    python -m chroma.benchmarks.sse_concurrency [--server URL] [--task-id ID]
+                                                [--payload JSON]
+                                                [--clients 200] [--hold 30]
+                                                [--accept-timeout 5]
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import httpx
+
+DEFAULT_SERVER = "http://localhost:5000"
+
+
+def stream_request(client: httpx.AsyncClient, server: str, task_id: str,
+                   payload: dict | None) -> httpx.Request:
+    if payload is None:
+        return client.build_request("GET", f"{server}/chroma/stream/{task_id}")
+    return client.build_request("POST", f"{server}/chroma/documents", json=payload)
+
+
+async def hold_stream(client: httpx.AsyncClient, request: httpx.Request,
+                      hold: float, accept_timeout: float) -> dict:
+    start_time = time.perf_counter()
+    response = None
+    try:
+        # Headers and the first bytes arrive once a worker serves the stream
+        response = await asyncio.wait_for(
+            client.send(request, stream=True),
+            timeout=accept_timeout)
+        stream = response.aiter_raw()
+        await asyncio.wait_for(stream.__anext__(),
+                               timeout=max(0.0, accept_timeout
+                                           - (time.perf_counter() - start_time)))
+        accepted_s = time.perf_counter() - start_time
+        try:
+            await asyncio.wait_for(_drain(stream),
+                                   timeout=max(0.0, hold - accepted_s))
+        except asyncio.TimeoutError:
+            pass
+        return {"accepted": True, "accepted_s": accepted_s}
+    except (asyncio.TimeoutError, httpx.TimeoutException, StopAsyncIteration):
+        # Nobody picked the connection up in time
+        return {"accepted": False, "accepted_s": None}
+    except httpx.HTTPError as e:
+        return {"accepted": False, "accepted_s": None, "error": str(e)}
+    finally:
+        if response is not None:
+            await response.aclose()
+
+
+async def _drain(stream) -> None:
+    async for _ in stream:
+        pass
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(results: list[dict], elapsed: float) -> dict:
+    accepted = [result["accepted_s"] for result in results if result["accepted"]]
+    errors = [result["error"] for result in results if "error" in result]
+    return {
+        "clients": len(results),
+        "accepted": len(accepted),
+        "rejected": len(results) - len(accepted),
+        "errors": len(errors),
+        "accept_p50_s": round(percentile(accepted, 0.5), 3) if accepted else None,
+        "accept_p95_s": round(percentile(accepted, 0.95), 3) if accepted else None,
+        "elapsed_s": round(elapsed, 3),
+    }
+
+
+async def run(server: str, task_id: str, payload: dict | None, clients: int,
+              hold: float, accept_timeout: float) -> dict:
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=0)
+    timeout = httpx.Timeout(hold + accept_timeout, connect=accept_timeout)
+    start_time = time.perf_counter()
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        results = await asyncio.gather(*[
+            hold_stream(client, stream_request(client, server, task_id, payload),
+                        hold, accept_timeout)
+            for _ in range(clients)])
+    return summarize(results, time.perf_counter() - start_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--server", default=DEFAULT_SERVER)
+    parser.add_argument("--task-id", default=None,
+                        help="Task followed by every stream, a new one by default")
+    parser.add_argument("--payload", type=json.loads, default=None,
+                        help="Post this search body instead of following a task")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--hold", type=float, default=30,
+                        help="Seconds every stream is kept open")
+    parser.add_argument("--accept-timeout", type=float, default=5,
+                        help="Seconds a stream may wait before it counts as rejected")
+    args = parser.parse_args()
+
+    task_id = args.task_id or f"sse-benchmark-{uuid.uuid4()}"
+    report = asyncio.run(run(args.server, task_id, args.payload, args.clients,
+                             args.hold, args.accept_timeout))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
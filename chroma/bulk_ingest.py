@@ -0,0 +1,63 @@
+"""
+Bulk ingestion of a manifest of PDF files.
+
+Each manifest line holds a file path, optionally followed by a tab and a
+comma separated list of categories. Lines without categories use the ones
+given with --categories.
+
+By default the files are parsed on a local process pool and embedded in
+this process. With --fan-out the manifest is submitted as an ingestion job
+to the chroma Celery workers instead and the job id is printed; its
+progress is available at GET /chroma/bulk_embed/<job_id>.
+
+Usage:
+    python -m chroma.bulk_ingest bash_files/requests_paths.txt \
+        --collection gaunal_collection --categories control [--workers 8]
+    python -m chroma.bulk_ingest bash_files/requests_paths.txt \
+        --categories control --fan-out [--concurrency 4]
+"""
+import argparse
+import json
+
+from chroma.app.domain.chroma_collections import ChromaCollections
+from chroma.app.domain.ingestion_jobs import parse_manifest
+from chroma_ms_config import Configuration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("manifest")
+    parser.add_argument("--collection", default="gaunal_collection")
+    parser.add_argument("--categories", nargs="*", default=[])
+    parser.add_argument("--workers", type=int, default=None,
+                        help="PDF parsing processes, one less than the cores by default")
+    parser.add_argument("--fan-out", action="store_true",
+                        help="Submit an ingestion job to the Celery workers")
+    parser.add_argument("--concurrency", type=int,
+                        default=Configuration.BULK_INGESTION_CONCURRENCY,
+                        help="Files processed at once by a fanned out job")
+    args = parser.parse_args()
+
+    documents = parse_manifest(args.manifest, args.categories)
+    missing = [file_path for file_path, categories in documents if not categories]
+    if missing:
+        parser.error(f"{len(missing)} files have no categories, use --categories")
+
+    if args.fan_out:
+        from chroma import create_app
+        from chroma.app.task_executor import start_ingestion_job
+
+        create_app()
+        job_id = start_ingestion_job(args.collection, documents, args.concurrency)
+        print(json.dumps({"JOB_ID": job_id}))
+        return
+
+    result = ChromaCollections().process_pdf_files(documents,
+                                                   args.collection,
+                                                   max_workers=args.workers)
+    print(json.dumps(result["SUMMARY"]))
+
+
+if __name__ == "__main__":
+    main()
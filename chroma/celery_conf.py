@@ -1,9 +1,25 @@
 from celery import Celery
+from celery.signals import worker_init, worker_process_init
 from chroma_ms_config import Configuration
 
 celery = Celery()
 
 
+@worker_process_init.connect
+def preload_embedding_model(**kwargs):
+    # Imported here so the web process never loads torch weights
+    from chroma.app.domain.embedder_registry import EmbedderRegistry
+    EmbedderRegistry.get()
+
+
+@worker_init.connect
+def preload_embedding_model_in_worker(sender=None, **kwargs):
+    # Thread pools run their tasks in the worker process itself, which
+    # never sends worker_process_init
+    if sender is not None and sender.pool_cls in ("threads", "gevent", "eventlet"):
+        preload_embedding_model()
+
+
 def celery_instantiation(app):
     celery.conf.update({
         'broker_url': Configuration.CELERY_BROKER_URL,
@@ -13,11 +29,22 @@ def celery_instantiation(app):
         'accept_content': ['json'],
         'timezone': 'UTC',
         'enable_utc': True,
+        'worker_proc_alive_timeout': Configuration.WORKER_PROC_ALIVE_TIMEOUT,
         'task_queues': {
             app.config.get('CHROMA_QUEUE', 'chroma_queue'): {
                 'exchange': 'chroma_exchange',
                 'routing_key': 'chroma.#',
             },
+            app.config.get('CHROMA_INGESTION_QUEUE', 'chroma_ingestion_queue'): {
+                'exchange': 'chroma_ingestion_exchange',
+                'routing_key': 'chroma_ingestion.#',
+            },
+            # Declared like the langchain service does, searches hand their
+            # documents to it
+            app.config.get('LANGCHAIN_QUEUE', 'langchain_queue'): {
+                'exchange': 'langchain_exchange',
+                'routing_key': 'langchain.#',
+            },
         },
     })
 
@@ -1,6 +1,12 @@
+import os
+
 bind = '0.0.0.0:5000'  # Bind to all interfaces to allow external access
+# gevent keeps every waiting result stream on a greenlet instead of a
+# thread, sync falls back to the threaded worker below
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
 workers = 2            # Number of worker processes
-threads = 4            # Number of threads per worker
+threads = 4            # Number of threads per worker, sync worker class only
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))  # Open streams per gevent worker
 timeout = 120          # Timeout for requests
 accesslog = '-'        # Log requests to stdout
 errorlog = '-'         # Log errors to stdout
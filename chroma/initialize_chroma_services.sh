@@ -1,5 +1,11 @@
 #!/bin/bash
 
-
+# Searches wait on Chroma and the broker, so their worker runs on threads
+# and one process keeps many of them in flight on its shared event loop.
+# PDF ingestion runs on a prefork worker, which enforces the task time
+# limits and parses one document per process.
 gunicorn -c chroma/gunicorn.conf.py 'chroma:create_app()' & \
-celery -A chroma worker --loglevel=info -Q chroma_queue --hostname=chroma@%h
+celery -A chroma worker --loglevel=info -Q chroma_queue --hostname=chroma@%h \
+    --pool "${CHROMA_WORKER_POOL:-threads}" --concurrency "${CHROMA_WORKER_CONCURRENCY:-16}" & \
+celery -A chroma worker --loglevel=info -Q chroma_ingestion_queue --hostname=chroma_ingestion@%h \
+    --pool prefork --concurrency "${CHROMA_INGESTION_CONCURRENCY:-2}"
@@ -0,0 +1,13 @@
+import pytest
+
+from chroma.app.domain.lexical_index import LexicalIndex
+from chroma_ms_config import Configuration
+
+
+@pytest.fixture(autouse=True)
+def lexical_index_dir(tmp_path, monkeypatch):
+    # Indexes written while ingesting documents stay out of the repository
+    LexicalIndex.clear_all()
+    monkeypatch.setattr(Configuration, "LEXICAL_INDEX_DIR", str(tmp_path / "lexical_index"))
+    yield
+    LexicalIndex.clear_all()
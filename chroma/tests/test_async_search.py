@@ -0,0 +1,99 @@
+import asyncio
+
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from chroma.app.domain.async_search import AsyncChromaSearch, WorkerEventLoop
+from chroma.app.domain.category_cache import CategoryPresenceCache
+
+
+def _collection(query_result: dict, present: bool = True) -> MagicMock:
+    collection = MagicMock()
+    collection.name = "collection"
+    collection.get = AsyncMock(return_value={'ids': ["a-0"] if present else []})
+    collection.query = AsyncMock(return_value=query_result)
+    return collection
+
+
+def _search(collection) -> AsyncChromaSearch:
+    search = AsyncChromaSearch()
+    search._collections["collection"] = collection
+    return search
+
+
+@patch("chroma.app.domain.async_search.category_presence", new=CategoryPresenceCache(ttl=0))
+@patch("chroma.app.domain.async_search.AsyncChromaSearch._cached_category_data", return_value=None)
+@patch("chroma.app.domain.async_search.AsyncChromaSearch._embed_texts",
+       side_effect=lambda terms: [[1.0, 0.0]] * len(terms))
+@patch("chroma.app.domain.async_search.ChromaCollections._invoke_llm", return_value={"STATE": "SUCCESS"})
+def test_execute_search_query_runs_on_worker_loop(invoke_llm_mock, embed_mock, cached_mock):
+    collection = _collection({'ids': [["a-0"], ["a-0", "a-1"]],
+                              'documents': [["doc a"], ["doc a", "doc b"]],
+                              'metadatas': [[{"control": 1}], [{"control": 1}] * 2]})
+
+    response = WorkerEventLoop.run(_search(collection).execute_search_query(
+        "collection", "control", "robot arm", 12345, retrieval_mode="terms"))
+
+    assert response == {"STATE": "SUCCESS", "RETRIEVAL_MODE": "terms"}
+    collection.get.assert_awaited_once_with(where={"control": 1}, limit=1, include=[])
+    collection.query.assert_awaited_once()
+    assert collection.query.call_args.kwargs['query_embeddings'] == [[1.0, 0.0]] * 2
+    query_result = invoke_llm_mock.call_args.args[0]
+    assert query_result['ids'] == ["a-0", "a-1"]
+
+
+@patch("chroma.app.domain.async_search.category_presence", new=CategoryPresenceCache(ttl=0))
+@patch("chroma.app.domain.async_search.AsyncChromaSearch._cached_category_data", return_value=None)
+@patch("chroma.app.domain.async_search.AsyncChromaSearch._embed_texts", return_value=[[1.0, 0.0]])
+def test_execute_search_query_reports_empty_category(embed_mock, cached_mock):
+    collection = _collection({'ids': [[]], 'documents': [[]], 'metadatas': [[]]}, present=False)
+
+    response = asyncio.run(_search(collection).execute_search_query(
+        "collection", "control", "robot", 12345))
+
+    assert response["STATE"] == "ERROR"
+    assert "No information found" in response["DESCRIPTION"]
+
+
+@patch("chroma.app.domain.async_search.Configuration.CHROMA_CALL_TIMEOUT", 0.05)
+@patch("chroma.app.domain.async_search.Configuration.CHROMA_MAX_CONCURRENT_CALLS", 2)
+def test_calls_are_limited_and_timed_out():
+    search = AsyncChromaSearch()
+    running = 0
+    peak = 0
+
+    async def slow_call(seconds):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(seconds)
+        running -= 1
+        return seconds
+
+    async def scenario():
+        results = await asyncio.gather(*[search._call(lambda: slow_call(0.01))
+                                         for _ in range(5)])
+        try:
+            await search._call(lambda: slow_call(1))
+        except asyncio.TimeoutError:
+            return results, True
+        return results, False
+
+    results, timed_out = asyncio.run(scenario())
+
+    assert results == [0.01] * 5
+    assert peak == 2
+    assert timed_out
+
+
+@patch("chroma.app.domain.chroma_collections.Configuration.LOCAL_SEARCH", True)
+@patch("chroma.app.domain.chroma_collections.category_versions")
+@patch("chroma.app.domain.chroma_collections.ChromaCollections._warm_category_data")
+@patch("chroma.app.domain.chroma_collections.ChromaClientRegistry")
+def test_cached_category_miss_makes_no_chroma_call(registry_mock, warm_mock, versions_mock):
+    versions_mock.get.return_value = 1
+
+    assert AsyncChromaSearch._cached_category_data("uncached", "control") is None
+
+    registry_mock.client.assert_not_called()
+    registry_mock.collection.assert_not_called()
+    warm_mock.assert_called_once_with("uncached", "control", 1)
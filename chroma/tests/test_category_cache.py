@@ -0,0 +1,69 @@
+import numpy as np
+
+from chroma.app.domain.category_cache import (CategoryCache,
+                                              category_data_nbytes,
+                                              compact_category_data)
+
+
+def _category(rows: int, dimension: int = 256) -> dict:
+    return compact_category_data({
+        'ids': [f"doc-{index}" for index in range(rows)],
+        'embeddings': np.ones((rows, dimension)).tolist(),
+        'documents': ["text"] * rows,
+        'metadatas': [{"control": 1}] * rows,
+    })
+
+
+def test_compact_category_data_uses_float32_matrix():
+    data = _category(3, dimension=4)
+
+    assert data['embeddings'].shape == (3, 4)
+    assert data['embeddings'].dtype == np.float32
+    assert compact_category_data({'ids': []})['embeddings'].shape == (0, 0)
+
+
+def test_cache_evicts_least_recently_used_under_byte_budget():
+    entry_size = category_data_nbytes(_category(10))
+    cache = CategoryCache(max_bytes=int(entry_size * 2.5), ttl=600)
+
+    cache.put("control", _category(10))
+    cache.put("quimica", _category(10))
+    cache.get("control")
+    cache.put("robotica", _category(10))
+
+    assert "control" in cache
+    assert "quimica" not in cache
+    assert "robotica" in cache
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['bytes'] <= stats['max_bytes']
+
+
+def test_cache_expires_entries_and_rejects_oversized_ones():
+    cache = CategoryCache(max_bytes=1024, ttl=0)
+    cache.put("control", _category(1, dimension=4))
+    assert cache.get("control") is None
+
+    cache.put("quimica", _category(100), version=2)
+    assert "quimica" not in cache
+    assert cache.too_large("quimica", version=2)
+    assert not cache.too_large("quimica", version=3)
+
+    stats = cache.stats()
+    assert stats['expirations'] == 1
+    assert stats['rejected'] == 1
+    assert stats['hit_rate'] == 0.0
+
+
+def test_versioned_entries_ignore_ttl_until_the_version_changes():
+    cache = CategoryCache(max_bytes=1024 * 1024, ttl=0)
+    data = _category(1, dimension=4)
+    cache.put("control", data, version=3)
+
+    assert cache.get("control", version=3) is data
+    assert cache.get("control", version=4) is None
+    assert cache.stats()['stale'] == 1
+
+    # Without a version to compare, entries fall back to the TTL
+    cache.put("control", data, version=4)
+    assert cache.get("control") is None
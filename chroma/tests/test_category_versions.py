@@ -0,0 +1,27 @@
+import redis
+
+from unittest.mock import MagicMock
+
+from chroma.app.domain.category_versions import CategoryVersions
+
+
+def test_bump_increments_only_the_given_categories(fake_redis):
+    versions = CategoryVersions(fake_redis)
+
+    versions.bump("collection", ["control", "quimica"])
+    versions.bump("collection", {"control": 1}.keys())
+
+    assert versions.get("collection", "control") == 2
+    assert versions.get("collection", "quimica") == 1
+    assert versions.get("collection", "robotica") == 0
+    assert versions.get("other", "control") == 0
+
+
+def test_unreachable_redis_disables_versioning():
+    redis_client = MagicMock()
+    redis_client.get.side_effect = redis.ConnectionError("down")
+    redis_client.pipeline.return_value.execute.side_effect = redis.ConnectionError("down")
+    versions = CategoryVersions(redis_client)
+
+    versions.bump("collection", ["control"])
+    assert versions.get("collection", "control") is None
@@ -1,9 +1,25 @@
+import numpy as np
 import pytest
+import queue
+import re
+import threading
 import time
 import torch
 from chromadb.errors import InvalidCollectionException
 from unittest.mock import patch, MagicMock, ANY
-from chroma.app.domain.chroma_collections import ChromaCollections, chunk_text
+from chroma.app.domain.chroma_collections import (ChromaCollections,
+                                                  chunk_text,
+                                                  chunk_text_by_tokens,
+                                                  iter_token_chunks,
+                                                  length_bucketed_batches,
+                                                  masked_mean_pool)
+from chroma.app.domain.category_cache import (CategoryCache,
+                                              CategoryPresenceCache,
+                                              compact_category_data)
+from chroma.app.domain.chroma_client_registry import ChromaClientRegistry
+from chroma.app.domain.embedder_registry import EmbedderRegistry
+from chroma.app.domain.embedding_cache import EmbeddingCache
+from chroma.app.domain.lexical_index import LexicalIndex
 from chromadb.api.types import GetResult, QueryResult
 from utils.outputs import OutputColors
 from langchain_ms_config import Configuration
@@ -11,43 +27,63 @@ from langchain_ms_config import Configuration
 
 @pytest.fixture(scope='session', autouse=True)
 def mock_collections():
-    with patch('chroma.app.domain.chroma_collections.chromadb') as mock_chromadb:
+    ChromaClientRegistry.clear()
+    with patch('chroma.app.domain.chroma_client_registry.chromadb') as mock_chromadb:
         # Mock HttpClient specifically to prevent connection attempts
         mock_http_client = MagicMock()
         mock_chromadb.HttpClient.return_value = mock_http_client
         collections = ChromaCollections()
 
         yield collections
+    ChromaClientRegistry.clear()
+
+
+def _fake_tokenize(docs, **kwargs):
+    if isinstance(docs, str):
+        # One token per word, with character offsets
+        return {'offset_mapping': [match.span() for match in re.finditer(r"\S+", docs)]}
+    # One token per word plus the [CLS]/[SEP] pair
+    input_ids = [[101] + [1] * len(doc.split()) + [102] for doc in docs]
+    return {'input_ids': input_ids,
+            'attention_mask': [[1] * len(ids) for ids in input_ids]}
+
+
+def _fake_pad(features, **kwargs):
+    longest = max(len(feature['input_ids']) for feature in features)
+    input_ids = [feature['input_ids'] + [0] * (longest - len(feature['input_ids']))
+                 for feature in features]
+    attention_mask = [feature['attention_mask'] + [0] * (longest - len(feature['attention_mask']))
+                      for feature in features]
+    return {'input_ids': torch.tensor(input_ids),
+            'attention_mask': torch.tensor(attention_mask)}
+
+
+def _fake_model(input_ids, attention_mask):
+    output = MagicMock()
+    output.last_hidden_state = torch.rand(input_ids.shape[0], input_ids.shape[1], 768)
+    return output
 
 
 @pytest.fixture
 def mock_embedder_function():
-    with patch('chroma.app.domain.chroma_collections.AutoTokenizer') as mock_tokenizer, \
-         patch('chroma.app.domain.chroma_collections.AutoModel') as mock_model, \
-         patch('chroma.app.domain.chroma_collections.torch') as mock_torch:
+    EmbedderRegistry.clear()
+    EmbeddingCache.clear_all()
+    with patch('chroma.app.domain.embedder_registry.AutoTokenizer') as mock_tokenizer, \
+         patch('chroma.app.domain.embedder_registry.AutoModel') as mock_model, \
+         patch('chroma.app.domain.embedding_cache.Configuration.EMBEDDING_CACHE_DIR', ''):
 
         # Mock tokenizer behavior
-        mock_tokenizer_instance = MagicMock()
-        mock_tokenizer_instance.return_value = {
-            'input_ids': MagicMock(),
-            'attention_mask': MagicMock()
-        }
-        
+        mock_tokenizer_instance = MagicMock(side_effect=_fake_tokenize)
+        mock_tokenizer_instance.pad.side_effect = _fake_pad
         mock_tokenizer.from_pretrained.return_value = mock_tokenizer_instance
-        # Mock model behavior
-        mock_model_instance = MagicMock()
-        mock_model.from_pretrained.return_value = mock_model_instance
 
-        # Create a mock tensor with the expected shape
-        mock_last_hidden_state = torch.rand(64, 512, 768)  # 64 batches, 512 tokens, 768 embedding size
-        mock_output = MagicMock()
-        mock_output.last_hidden_state = mock_last_hidden_state
-        mock_model_instance.return_value = mock_output
-
-        # Mock torch.mean to return a mock tensor
-        mock_torch.mean.return_value = torch.rand(64, 768)  # 64 documents, 768 embedding size
+        # Mock model behavior, returning (batch, tokens, 768) hidden states
+        mock_model_instance = MagicMock(side_effect=_fake_model)
+        mock_model.from_pretrained.return_value = mock_model_instance
 
-        yield mock_tokenizer, mock_model, mock_torch
+        yield mock_tokenizer, mock_model, mock_model_instance
+    EmbedderRegistry.clear()
+    EmbeddingCache.clear_all()
 
 
 def test_chunk_text():
@@ -74,11 +110,67 @@ def test_embedder_function_call(mock_embedder_function):
     assert len(embeddings) == len(doc_input)
 
     # Check if tokenizer and model were called as expected
-    mock_tokenizer, mock_model, mock_torch = mock_embedder_function
+    mock_tokenizer, mock_model, _ = mock_embedder_function
     mock_tokenizer.from_pretrained.assert_called_with("bert-base-multilingual-cased")
     mock_model.from_pretrained.assert_called_with("bert-base-multilingual-cased")
 
 
+def test_embedder_function_keeps_input_order(mock_embedder_function):
+    _, _, mock_model_instance = mock_embedder_function
+    # Make every embedding equal to the number of real tokens in its input
+    mock_model_instance.side_effect = lambda input_ids, attention_mask: MagicMock(
+        last_hidden_state=attention_mask.sum(dim=1, keepdim=True)
+        .unsqueeze(-1).expand(-1, input_ids.shape[1], 4).float())
+
+    doc_input = ["one", "one two three four five", "one two"]
+    embeddings = ChromaCollections.EmbedderFunction()(doc_input)
+
+    assert [embedding[0] for embedding in embeddings] == [3.0, 7.0, 4.0]
+
+
+def test_embedder_function_reuses_cached_embeddings(mock_embedder_function):
+    _, _, mock_model_instance = mock_embedder_function
+    embedder = ChromaCollections.EmbedderFunction()
+
+    first = embedder(["some chunk", "other chunk"])
+    calls = mock_model_instance.call_count
+    second = embedder(["other  chunk", "new chunk", "some chunk"])
+
+    assert list(second[0]) == list(first[1])
+    assert list(second[2]) == list(first[0])
+    assert mock_model_instance.call_count == calls + 1
+    assert embedder.cache.stats()['hits'] == 2
+
+
+def test_length_bucketed_batches():
+    lengths = [10, 500, 12, 480, 11]
+    batches = length_bucketed_batches(lengths, token_budget=900)
+
+    assert batches == [[1], [3], [2, 4, 0]]
+    assert sorted(index for batch in batches for index in batch) == list(range(5))
+
+
+def test_masked_mean_pool_ignores_padding():
+    hidden_state = torch.tensor([[[1.0, 1.0], [3.0, 3.0], [100.0, 100.0]]])
+    attention_mask = torch.tensor([[1, 1, 0]])
+
+    pooled = masked_mean_pool(hidden_state, attention_mask)
+
+    assert pooled.tolist() == [[2.0, 2.0]]
+
+
+def test_embedder_registry_loads_model_once(mock_embedder_function):
+    mock_tokenizer, mock_model, _ = mock_embedder_function
+
+    first = ChromaCollections.EmbedderFunction()
+    second = ChromaCollections.EmbedderFunction()
+
+    assert first.embedding_model is second.embedding_model
+    mock_tokenizer.from_pretrained.assert_called_once()
+    mock_model.from_pretrained.assert_called_once()
+    assert 'load_time_s' in EmbedderRegistry.stats()["bert-base-multilingual-cased:fp32"]
+
+
 def test_create_metadata_object(mock_collections):
     categories_list = ['CONTROL', 'QUIMICA']
     expected_result = {
@@ -95,23 +187,13 @@ def test_create_metadata_object(mock_collections):
 @patch("chroma.app.domain.chroma_collections.Collection")
 def test_update_loaded_data(collection: MagicMock, console_print_mock: MagicMock, mock_collections):
     
-    expected_response = {
-        "ids": [],
-        "embeddings":[],
-        "documents":[],
-        "uris":[""],
-        "data":"",
-        "metadatas":[""],
-        "included":"documents"
-    }
-    
     mocked_response = GetResult(
-        ids=[],
-        embeddings=[],
-        documents=[],
+        ids=["a-0", "a-1"],
+        embeddings=[[1.0, 0.0], [0.0, 1.0]],
+        documents=["first", "second"],
         uris=[""],
         data="",
-        metadatas=[""],
+        metadatas=[{"control": 1}, {"control": 1}],
         included="documents"
     )
     
@@ -119,7 +201,11 @@ def test_update_loaded_data(collection: MagicMock, console_print_mock: MagicMock
     
     result = mock_collections.update_loaded_data(collection, "control")
     
-    assert result == expected_response
+    assert result['ids'] == ["a-0", "a-1"]
+    assert result['documents'] == ["first", "second"]
+    assert result['metadatas'] == [{"control": 1}, {"control": 1}]
+    assert result['embeddings'].dtype == np.float32
+    assert result['embeddings'].shape == (2, 2)
     collection.get.assert_called()
     
     console_print_mock.assert_any_call(
@@ -133,23 +219,13 @@ def test_update_loaded_data(collection: MagicMock, console_print_mock: MagicMock
 @patch("chroma.app.domain.chroma_collections.Collection")
 def test_update_loaded_data_retry(collection: MagicMock, console_print_mock: MagicMock, mock_collections):
     
-    expected_response = {
-        "ids": [],
-        "embeddings":[],
-        "documents":[],
-        "uris":[""],
-        "data":"",
-        "metadatas":[""],
-        "included":"documents"
-    }
-    
     mocked_response = GetResult(
-        ids=[],
-        embeddings=[],
-        documents=[],
+        ids=["a-0", "a-1"],
+        embeddings=[[1.0, 0.0], [0.0, 1.0]],
+        documents=["first", "second"],
         uris=[""],
         data="",
-        metadatas=[""],
+        metadatas=[{"control": 1}, {"control": 1}],
         included="documents"
     )
     
@@ -157,7 +233,8 @@ def test_update_loaded_data_retry(collection: MagicMock, console_print_mock: Mag
     
     result = mock_collections.update_loaded_data(collection, "control", True)
     
-    assert result == expected_response
+    assert result['ids'] == ["a-0", "a-1"]
+    assert result['embeddings'].shape == (2, 2)
     collection.get.assert_called()
     
     console_print_mock.assert_any_call(
@@ -168,30 +245,31 @@ def test_update_loaded_data_retry(collection: MagicMock, console_print_mock: Mag
     
     
 @patch("chroma.app.domain.chroma_collections.Collection")
-def test_basic_chroma_query(collection: MagicMock, mock_collections, mock_embedder_function):
+def test_basic_chroma_query_single_round_trip(collection: MagicMock, mock_collections, mock_embedder_function):
     
     expected_response = {
-        "ids": ["123"],
-        "documents":["Some document"],
-        "metadatas":["123"],
+        "ids": ["123", "456"],
+        "documents":["Some document", "Other document"],
+        "metadatas":["123", "456"],
     }
     
-    mocked_response = GetResult(
-        ids=[["123"]],
-        embeddings=[],
-        documents=["Some document"],
-        uris=[""],
-        data="",
-        metadatas=[["123"]],
+    mocked_response = QueryResult(
+        ids=[["123"], ["456", "123"]],
+        embeddings=None,
+        documents=[["Some document"], ["Other document", "Some document"]],
+        uris=None,
+        data=None,
+        metadatas=[["123"], ["456", "123"]],
+        distances=[[0.1], [0.2, 0.3]],
         included="documents"
     )
     
     collection.query.return_value = mocked_response
     
-    result = mock_collections.basic_chroma_query(collection, "control", "Some query")
+    result = mock_collections.basic_chroma_query(collection, "control", "action torque")
     
     assert result == expected_response
-    collection.query.assert_called()
+    collection.query.assert_called_once()
 
 @patch("chroma.app.domain.chroma_collections.Collection")
 def test_basic_chroma_query(collection: MagicMock, mock_collections, mock_embedder_function):
@@ -213,11 +291,155 @@ def test_basic_chroma_query(collection: MagicMock, mock_collections, mock_embedd
     collection.query.assert_called()
     
 
+def test_local_query_ranks_cached_chunks_by_cosine(mock_collections):
+    category_data = compact_category_data({
+        'ids': ["a", "b", "c"],
+        'embeddings': [[1.0, 0.0], [0.0, 2.0], [1.0, 1.0]],
+        'documents': ["doc a", "doc b", "doc c"],
+        'metadatas': [{"control": 1}] * 3})
+
+    results = mock_collections.local_query(category_data, [[0.0, 1.0], [3.0, 0.1]], 2)
+
+    assert results['ids'] == [["b", "c"], ["a", "c"]]
+    assert results['documents'][0] == ["doc b", "doc c"]
+    assert results['distances'][0][0] == pytest.approx(0.0, abs=1e-6)
+    # Vectors from another model cannot be compared with the cached ones
+    assert mock_collections.local_query(category_data, [[1.0, 0.0, 0.0]], 2) is None
+
+
+def test_basic_chroma_query_uses_cached_category(mock_collections, mock_embedder_function):
+    collection = MagicMock()
+    category_data = compact_category_data({
+        'ids': [f"doc-{index}" for index in range(10)],
+        'embeddings': np.random.rand(10, 768).tolist(),
+        'documents': [f"text {index}" for index in range(10)],
+        'metadatas': [{"control": 1}] * 10})
+
+    result = mock_collections.basic_chroma_query(collection, "control", "robot arm control",
+                                                 category_data=category_data)
+
+    collection.query.assert_not_called()
+    assert 0 < len(result['ids']) <= 5
+    assert set(result['ids']) <= set(category_data['ids'])
+
+
+def test_query_texts_per_retrieval_mode(mock_collections):
+    assert mock_collections.query_texts("what is an action", "terms") == ["action"]
+    assert mock_collections.query_texts("what is an action", "query") == ["what is an action"]
+    assert mock_collections.query_texts("what is an action", "fusion") == ["what is an action", "action"]
+
+
+def test_rank_by_distance(mock_collections):
+    results = {'ids': [["a", "b", "c"]],
+               'documents': [["doc a", "doc b", "doc c"]],
+               'metadatas': [[{}, {}, {}]],
+               'distances': [[0.3, 0.1, 0.2]]}
+
+    ranked = mock_collections.rank_results(results, 2, "query")
+
+    assert ranked['ids'] == ["b", "c"]
+    assert ranked['documents'] == ["doc b", "doc c"]
+    assert mock_collections.rank_results({'ids': [[]]}, 2, "query") is False
+
+
+def test_reciprocal_rank_fusion(mock_collections):
+    results = {'ids': [["a", "b"], ["b", "c"], ["c", "b"]],
+               'documents': [["doc a", "doc b"], ["doc b", "doc c"], ["doc c", "doc b"]],
+               'metadatas': [[{}, {}], [{}, {}], [{}, {}]],
+               'distances': [[0.1, 0.2], [0.3, 0.4], [0.05, 0.5]]}
+
+    fused = mock_collections.reciprocal_rank_fusion(results, 3, k=60)
+
+    # b appears in every list, c in two with one first place, a in one
+    assert fused['ids'] == ["b", "c", "a"]
+    assert fused['documents'] == ["doc b", "doc c", "doc a"]
+
+
+@patch("chroma.app.domain.chroma_collections.Collection")
+def test_basic_chroma_query_single_vector_mode(collection: MagicMock, mock_collections, mock_embedder_function):
+    collection.query.return_value = {'ids': [["a", "b"]],
+                                     'documents': [["doc a", "doc b"]],
+                                     'metadatas': [[{}, {}]],
+                                     'distances': [[0.4, 0.2]]}
+
+    result = mock_collections.basic_chroma_query(collection, "control", "what is an action", mode="query")
+
+    assert len(collection.query.call_args.kwargs['query_embeddings']) == 1
+    assert "distances" in collection.query.call_args.kwargs['include']
+    assert result['ids'] == ["b", "a"]
+
+
+def test_basic_chroma_query_lexical_mode(mock_collections, mock_embedder_function):
+    index = LexicalIndex()
+    index.add_many([LexicalIndex.chunk_entry("a", "robot arm control loop"),
+                    LexicalIndex.chunk_entry("b", "weather report")], ["control"])
+    collection = MagicMock()
+    collection.name = "test_collection"
+    collection.get.return_value = {'ids': ["a"], 'documents': ["doc a"],
+                                   'metadatas': [{"control": 1}]}
+
+    with patch.object(LexicalIndex, 'for_collection', return_value=index):
+        result = mock_collections.basic_chroma_query(collection, "control",
+                                                     "robot control", mode="lexical")
+
+    collection.query.assert_not_called()
+    assert collection.get.call_args.kwargs['ids'] == ["a"]
+    assert result['ids'] == ["a"]
+
+
+def test_basic_chroma_query_hybrid_mode_rescores_cached_candidates(mock_collections, mock_embedder_function):
+    index = LexicalIndex()
+    index.add_many([LexicalIndex.chunk_entry(f"doc-{number}", f"robot arm number {number}")
+                    for number in range(6)], ["control"])
+    category_data = compact_category_data({
+        'ids': [f"doc-{number}" for number in range(6)],
+        'embeddings': np.random.rand(6, 768).tolist(),
+        'documents': [f"text {number}" for number in range(6)],
+        'metadatas': [{"control": 1}] * 6})
+    collection = MagicMock()
+    collection.name = "test_collection"
+
+    with patch.object(LexicalIndex, 'for_collection', return_value=index):
+        result = mock_collections.basic_chroma_query(collection, "control", "robot arm",
+                                                     max_results=3,
+                                                     category_data=category_data,
+                                                     mode="hybrid")
+
+    collection.get.assert_not_called()
+    collection.query.assert_not_called()
+    assert len(result['ids']) == 3
+    assert set(result['ids']) <= set(category_data['ids'])
+
+
+@patch("chroma.app.domain.chroma_collections.Collection")
+def test_basic_chroma_query_lexical_mode_without_matches(collection: MagicMock, mock_collections, mock_embedder_function):
+    collection.query.return_value = {'ids': [["a"]],
+                                     'documents': [["doc a"]],
+                                     'metadatas': [[{}]],
+                                     'distances': [[0.2]]}
+
+    with patch.object(LexicalIndex, 'for_collection', return_value=LexicalIndex()):
+        result = mock_collections.basic_chroma_query(collection, "control",
+                                                     "robot control", mode="lexical")
+
+    # Falls back to a dense search of the whole query
+    assert len(collection.query.call_args.kwargs['query_embeddings']) == 1
+    assert result['ids'] == ["a"]
+
+
 @patch("chroma.app.domain.chroma_collections.Collection")
 def test_add_document_embeds(collection_mock: MagicMock, mock_collections, mock_embedder_function):
     collection_mock.add.return_value = None
     response = mock_collections.add_document_embeds(collection_mock, "Some document", {"sample": "sample"})
-    assert response == True
+    assert response["PAGES"] == 0
+    assert response["CHUNKS"] == 1
+
+
+@patch("chroma.app.domain.chroma_collections.Collection")
+def test_add_document_embeds_counts_pages(collection_mock: MagicMock, mock_collections, mock_embedder_function):
+    pages = ["First page.\x0cSecond page.\x0c", "Third page.\x0c"]
+    response = mock_collections.add_document_embeds(collection_mock, iter(pages), {}, document_id="doc")
+    assert (response["PAGES"], response["CHUNKS"]) == (3, 1)
 
 
 def test_validate_loaded_response(mock_collections):
@@ -251,93 +473,142 @@ def test_validate_loaded_response_no_data(mock_collections):
 
 
 def test_validate_existing_collection(mock_collections, mock_embedder_function):
+    ChromaClientRegistry.invalidate('some')
+    mock_collections._chroma_client.get_collection.reset_mock()
     mock_collections._chroma_client.get_collection.return_value = "some_collection"
     response = mock_collections._validate_existing_collection('some')
     
     assert "some_collection" == response
+    # The handle is reused by later calls in the same process
+    assert mock_collections._validate_existing_collection('some') == "some_collection"
+    mock_collections._chroma_client.get_collection.assert_called_once()
     
     
 def test_validate_existing_collection_not_created(mock_collections, mock_embedder_function):
+    ChromaClientRegistry.invalidate('some')
     # Mock EmbedderFunction to return a MagicMock
     with patch('chroma.app.domain.chroma_collections.ChromaCollections.EmbedderFunction',
                return_value=mock_embedder_function[0].return_value):
         # Set side effect to raise an InvalidCollectionException when get_collection is called
-        with patch('chroma.app.domain.chroma_collections.chromadb.errors.InvalidCollectionException', Exception):
-            mock_collections._chroma_client.get_collection.side_effect = InvalidCollectionException("Test exception")
-            
-            # Mock create_collection to return a mock collection
-            mock_collections._chroma_client.create_collection.return_value = "some_collection"
-            
-            # Call the function
-            response = mock_collections._validate_existing_collection('some')
-            
-            # Assert that the response is correct
-            assert response == "some_collection"
-            mock_collections._chroma_client.create_collection.assert_called_once_with(
-                name='some',
-                embedding_function=mock_embedder_function[0].return_value,
-                metadata={"hnsw:space": "cosine"}
-            )
-
-@patch("chroma.app.domain.chroma_collections.loaded_collections", new={})
+        mock_collections._chroma_client.get_collection.side_effect = InvalidCollectionException("Test exception")
+        
+        # Mock create_collection to return a mock collection
+        mock_collections._chroma_client.create_collection.return_value = "some_collection"
+        
+        # Call the function
+        response = mock_collections._validate_existing_collection('some')
+        mock_collections._chroma_client.get_collection.side_effect = None
+        
+        # Assert that the response is correct
+        assert response == "some_collection"
+        mock_collections._chroma_client.create_collection.assert_called_once_with(
+            name='some',
+            embedding_function=mock_embedder_function[0].return_value,
+            metadata={"hnsw:space": "cosine"}
+        )
+    ChromaClientRegistry.invalidate('some')
+
+
+def test_missing_collection_handle_is_refreshed(mock_collections, mock_embedder_function):
+    ChromaClientRegistry.invalidate('refreshed')
+    stale, fresh = MagicMock(), MagicMock()
+    stale.get.side_effect = InvalidCollectionException("Collection does not exist")
+    fresh.get.return_value = {'ids': ["abc-0"], 'metadatas': [{"control": 1}]}
+    mock_collections._chroma_client.get_collection.side_effect = [stale, fresh]
+    refreshes = ChromaClientRegistry.stats().get('collection_refreshes', 0)
+
+    with patch("chroma.app.domain.chroma_collections.document_fingerprint", return_value="abc"):
+        response = mock_collections.process_pdf_file("/", ["control"], "refreshed")
+    mock_collections._chroma_client.get_collection.side_effect = None
+
+    assert response["INGESTION_STATUS"] == "unchanged"
+    assert ChromaClientRegistry.stats()['collection_refreshes'] == refreshes + 1
+    ChromaClientRegistry.invalidate('refreshed')
+
+@patch("chroma.app.domain.chroma_collections.loaded_collections",
+       new=CategoryCache(max_bytes=1024 * 1024, ttl=600))
 @patch("chroma.app.domain.chroma_collections.Collection")
 def test_load_category_data(mock_collection, mock_collections):
-    # Mock update_loaded_data to return a dict with data and expiration_time
-    mock_collections.update_loaded_data = MagicMock()
-    mock_collections.update_loaded_data.return_value = {
-        'data': 'response',
-        'expiration_time': time.time() + 600  # Set expiration to a future time
-    }
-    
-    # Call load_category_data for the first time to trigger update_loaded_data
-    response = mock_collections.load_category_data('control', mock_collection)
-    
-    # Verify that update_loaded_data was called once
-    mock_collections.update_loaded_data.assert_called_once_with(mock_collection, 'control')
+    mock_collection.get.return_value = {'ids': ["a-0"],
+                                        'embeddings': [[1.0, 0.0]],
+                                        'documents': ["text"],
+                                        'metadatas': [{"control": 1}]}
 
-    # Check that the returned response matches the expected structure
-    assert response == {
-        'data': 'response',
-        'expiration_time': mock_collections.update_loaded_data.return_value['expiration_time']
-    }
-    
+    first = mock_collections.load_category_data('control', mock_collection)
+    second = mock_collections.load_category_data('control', mock_collection)
+
+    # The second call is served from the cache
+    mock_collection.get.assert_called_once()
+    assert second is first
+    assert first['ids'] == ["a-0"]
+
+
+@patch("chroma.app.domain.chroma_collections.category_versions")
 @patch("chroma.app.domain.chroma_collections.loaded_collections",
-       new={'control': {'expiration_time': time.time()}})
+       new=CategoryCache(max_bytes=1024 * 1024, ttl=0))
 @patch("chroma.app.domain.chroma_collections.Collection")
-def test_load_category_data_future_expiration(mock_collection, mock_collections):
-    # Mock update_loaded_data to return a dict with data and expiration_time
-    mock_collections.update_loaded_data = MagicMock()
-    mock_collections.update_loaded_data.return_value = {
-        'data': 'response',
-        'expiration_time': time.time() + 100000  # Set expiration to a future time
-    }
-    
-    # Call load_category_data for the first time to trigger update_loaded_data
-    response = mock_collections.load_category_data('control', mock_collection)
-    
-    # Verify that update_loaded_data was called once
-    mock_collections.update_loaded_data.assert_called_once_with(mock_collection, 'control')
+def test_load_category_data_reloads_on_version_change(mock_collection, versions_mock, mock_collections):
+    mock_collection.get.return_value = {'ids': ["a-0"],
+                                        'embeddings': [[1.0, 0.0]],
+                                        'documents': ["text"],
+                                        'metadatas': [{"control": 1}]}
+    versions_mock.get.return_value = 1
+
+    mock_collections.load_category_data('control', mock_collection)
+    # Still valid past the TTL while the version is unchanged
+    mock_collections.load_category_data('control', mock_collection)
+    assert mock_collection.get.call_count == 1
+
+    versions_mock.get.return_value = 2
+    mock_collections.load_category_data('control', mock_collection)
+    assert mock_collection.get.call_count == 2
+
+
+@patch("chroma.app.domain.chroma_collections.category_versions")
+@patch("chroma.app.domain.chroma_collections.loaded_collections",
+       new=CategoryCache(max_bytes=1024 * 1024, ttl=0))
+@patch("chroma.app.domain.chroma_collections.Collection")
+def test_load_category_data_expired(mock_collection, versions_mock, mock_collections):
+    # Redis unreachable, entries expire by TTL
+    versions_mock.get.return_value = None
+    mock_collection.get.return_value = {'ids': ["a-0"],
+                                        'embeddings': [[1.0, 0.0]],
+                                        'documents': ["text"],
+                                        'metadatas': [{"control": 1}]}
+
+    mock_collections.load_category_data('control', mock_collection)
+    mock_collections.load_category_data('control', mock_collection)
+
+    assert mock_collection.get.call_count == 2
 
-    # Check that the returned response matches the expected structure
-    assert response == {
-        'data': 'response',
-        'expiration_time': mock_collections.update_loaded_data.return_value['expiration_time']
-    }
-    
 
 @patch('utils.outputs.print_console_message')
-@patch("chroma.app.domain.chroma_collections.pdf_to_bytes")
-def test_process_pdf_file(pdf_to_bytes_mock: MagicMock, console_print_mock, mock_collections, mock_embedder_function):
+@patch("chroma.app.domain.chroma_collections.document_fingerprint", return_value="abc")
+@patch("chroma.app.domain.chroma_collections.iter_pdf_pages")
+@patch("chroma.app.domain.chroma_collections.category_versions")
+def test_process_pdf_file(versions_mock: MagicMock, iter_pdf_pages_mock: MagicMock, fingerprint_mock, console_print_mock, mock_collections, mock_embedder_function):
+    collection = MagicMock()
+    collection.get.return_value = {'ids': [], 'metadatas': []}
     mock_collections._validate_existing_collection = MagicMock()
-    mock_collections._validate_existing_collection.return_value = MagicMock()
+    mock_collections._validate_existing_collection.return_value = collection
     
-    mock_collections.add_document_embeds.return_value = "created_embed"
-    pdf_to_bytes_mock.return_value = b'Some bytes'
+    iter_pdf_pages_mock.return_value = iter(['Some bytes'])
     
-    expected_response = {"STATE": "OK", "DESCRIPTION": "Successfully processed file"}
+    expected_response = {"STATE": "OK",
+                         "DESCRIPTION": "Successfully processed file",
+                         "INGESTION_STATUS": "new",
+                         "PAGES": 0,
+                         "CHUNKS": 1,
+                         "SECONDS": ANY,
+                         "TIMINGS": ANY}
     response = mock_collections.process_pdf_file("/", ["control"], "collection")
     
     assert response == expected_response
+    collection.add.assert_called_once()
+    assert collection.add.call_args.kwargs['ids'] == ["abc-0"]
+    assert collection.add.call_args.kwargs['metadatas'] == [{"control": 1, "fingerprint": "abc"}]
+    versions_mock.bump.assert_called_once_with("collection", ANY)
+    assert list(versions_mock.bump.call_args.args[1]) == ["control"]
     console_print_mock.assert_any_call(
         message=ANY,
         message_color=OutputColors.BOLD.value,
@@ -349,63 +620,334 @@ def test_process_pdf_file(pdf_to_bytes_mock: MagicMock, console_print_mock, mock
         app=Configuration.CHROMA_QUEUE
     )
 
-@patch("chroma.app.domain.chroma_collections.ChromaCollections.update_loaded_data")
+
+@patch("chroma.app.domain.chroma_collections.document_fingerprint", return_value="abc")
+@patch("chroma.app.domain.chroma_collections.iter_pdf_pages")
+@patch("chroma.app.domain.chroma_collections.category_versions")
+def test_process_pdf_file_without_text(versions_mock, iter_pdf_pages_mock, fingerprint_mock,
+                                       mock_collections, mock_embedder_function):
+    collection = MagicMock()
+    collection.get.return_value = {'ids': [], 'metadatas': []}
+    mock_collections._validate_existing_collection = MagicMock(return_value=collection)
+    # A scanned PDF, pages without any text
+    iter_pdf_pages_mock.return_value = iter(["\x0c\x0c"])
+
+    response = mock_collections.process_pdf_file("/", ["control"], "collection")
+
+    assert response["STATE"] == "ERROR"
+    assert response["INGESTION_STATUS"] == "empty"
+    collection.add.assert_not_called()
+    versions_mock.bump.assert_not_called()
+
+
+@patch("chroma.app.domain.chroma_collections.document_fingerprint", return_value="abc")
+@patch("chroma.app.domain.chroma_collections.iter_pdf_pages")
+def test_process_pdf_file_unchanged(iter_pdf_pages_mock: MagicMock, fingerprint_mock, mock_collections):
+    collection = MagicMock()
+    collection.get.return_value = {'ids': ["abc-0", "abc-1"],
+                                   'metadatas': [{"control": 1, "fingerprint": "abc"}] * 2}
+    mock_collections._validate_existing_collection = MagicMock(return_value=collection)
+
+    response = mock_collections.process_pdf_file("/", ["control"], "collection")
+
+    assert response["INGESTION_STATUS"] == "unchanged"
+    iter_pdf_pages_mock.assert_not_called()
+    collection.add.assert_not_called()
+    collection.update.assert_not_called()
+
+
+@patch("chroma.app.domain.chroma_collections.document_fingerprint", return_value="abc")
+@patch("chroma.app.domain.chroma_collections.iter_pdf_pages")
+def test_process_pdf_file_updates_categories(iter_pdf_pages_mock: MagicMock, fingerprint_mock, mock_collections):
+    collection = MagicMock()
+    collection.get.return_value = {'ids': ["abc-0", "abc-1"],
+                                   'metadatas': [{"control": 1, "fingerprint": "abc"}] * 2}
+    mock_collections._validate_existing_collection = MagicMock(return_value=collection)
+
+    response = mock_collections.process_pdf_file("/", ["quimica"], "collection")
+
+    assert response["INGESTION_STATUS"] == "updated"
+    iter_pdf_pages_mock.assert_not_called()
+    collection.update.assert_called_once_with(
+        ids=["abc-0", "abc-1"],
+        metadatas=[{"control": 1, "quimica": 1, "fingerprint": "abc"}] * 2)
+
+
+def test_chunk_text_by_tokens_respects_budget_and_covers_text():
+    tokenizer = MagicMock(side_effect=_fake_tokenize)
+    text = " ".join(f"w{i}" for i in range(25))
+
+    chunks, ids = chunk_text_by_tokens(text, tokenizer, max_tokens=10, overlap=2, document_id="doc")
+
+    assert ids == [f"doc-{i}" for i in range(len(chunks))]
+    assert all(len(chunk.split()) <= 10 for chunk in chunks)
+    assert chunks[0].split()[-2:] == chunks[1].split()[:2]
+    assert chunks[-1].endswith("w24")
+    assert {word for chunk in chunks for word in chunk.split()} == set(text.split())
+
+
+def test_chunk_text_by_tokens_prefers_sentence_and_paragraph_ends():
+    tokenizer = MagicMock(side_effect=_fake_tokenize)
+    text = "one two three. four five six seven\n\neight nine ten eleven twelve"
+
+    chunks, _ = chunk_text_by_tokens(text, tokenizer, max_tokens=8, overlap=0, document_id="doc")
+
+    assert chunks[0] == "one two three. four five six seven"
+    assert chunks[1] == "eight nine ten eleven twelve"
+
+    chunks, _ = chunk_text_by_tokens("a b c. d e f g h i", tokenizer, max_tokens=5, overlap=0)
+    assert chunks[0] == "a b c."
+
+
+def test_iter_token_chunks_matches_whole_document_chunking():
+    tokenizer = MagicMock(side_effect=_fake_tokenize)
+    pages = [" ".join(f"p{page}w{i}" for i in range(7)) + ".\x0c" for page in range(5)]
+
+    streamed = list(iter_token_chunks(pages, tokenizer, "doc", max_tokens=6, overlap=2))
+    chunks, ids = chunk_text_by_tokens("".join(pages), tokenizer, max_tokens=6, overlap=2, document_id="doc")
+
+    assert [chunk for chunk, _ in streamed] == chunks
+    assert [chunk_id for _, chunk_id in streamed] == ids
+
+
+@patch("chroma.app.domain.batch_uploader.Configuration.UPLOAD_RETRY_BACKOFF", 0)
+@patch("chroma.app.domain.chroma_collections.Configuration.EMBED_BATCH_CHUNKS", 2)
+@patch("chroma.app.domain.chroma_collections.category_versions")
+def test_add_document_embeds_removes_partial_document(versions_mock, mock_collections, mock_embedder_function):
+    collection = MagicMock()
+    collection.name = "test"
+    collection.add.side_effect = [None, Exception("Chroma is down")]
+    collection.upsert.side_effect = Exception("Chroma is down")
+    document = "one two three. four five six. seven eight nine."
+
+    with patch("chroma.app.domain.chroma_collections.Configuration.CHUNK_MAX_TOKENS", 3), \
+         patch("chroma.app.domain.chroma_collections.Configuration.CHUNK_OVERLAP_TOKENS", 0):
+        response = mock_collections.add_document_embeds(collection, document,
+                                                        {"control": 1, "fingerprint": "doc"},
+                                                        document_id="doc")
+
+    assert response is False
+    assert collection.add.call_count == 2
+    assert collection.upsert.call_count == 3
+    collection.delete.assert_called_once_with(ids=["doc-0", "doc-1", "doc-2"])
+    # Cached category data must not keep serving the removed chunks
+    versions_mock.bump.assert_called_once_with("test", ["control"])
+
+
+@patch("chroma.app.domain.batch_uploader.Configuration.UPLOAD_RETRY_BACKOFF", 0)
+@patch("chroma.app.domain.batch_uploader.Configuration.UPLOAD_BATCH_CHUNKS", 1)
+def test_add_document_embeds_retries_failed_upload_batch(mock_collections, mock_embedder_function):
+    collection = MagicMock()
+    collection.add.side_effect = [None, Exception("Timeout"), None]
+    document = "one two three. four five six. seven eight nine."
+
+    with patch("chroma.app.domain.chroma_collections.Configuration.CHUNK_MAX_TOKENS", 3), \
+         patch("chroma.app.domain.chroma_collections.Configuration.CHUNK_OVERLAP_TOKENS", 0):
+        response = mock_collections.add_document_embeds(collection, document, {}, document_id="doc")
+
+    assert response["CHUNKS"] == 3
+    assert response["TIMINGS"]["upload_retries"] == 1
+    assert set(response["TIMINGS"]) >= {"chunking_s", "embedding_s", "upload_s", "total_s"}
+    assert [call.kwargs['ids'] for call in collection.add.call_args_list] == [
+        ["doc-0"], ["doc-1"], ["doc-2"]]
+    # The timed out request may have been applied, the retry must not fail on its ids
+    collection.upsert.assert_called_once()
+    assert collection.upsert.call_args.kwargs['ids'] == ["doc-1"]
+    collection.delete.assert_not_called()
+
+
+@patch("chroma.app.domain.chroma_collections.ParallelPdfExtractor")
+@patch("chroma.app.domain.chroma_collections.document_fingerprint",
+       side_effect=lambda file_path: {"a.pdf": "fa", "b.pdf": "fb", "c.pdf": "fc",
+                                      "d.pdf": "fa", "e.pdf": "fc", "f.pdf": "ff"}[file_path])
+def test_process_pdf_files(fingerprint_mock, extractor_mock, mock_collections, mock_embedder_function):
+    collection = MagicMock()
+
+    def stored(where, include, limit=None):
+        if where == {"fingerprint": "fb"} or (where == {"fingerprint": "fa"} and collection.add.called):
+            return {'ids': [f"{where['fingerprint']}-0"],
+                    'metadatas': [{"control": 1, "fingerprint": where['fingerprint']}]}
+        return {'ids': [], 'metadatas': []}
+
+    collection.get.side_effect = stored
+    mock_collections._validate_existing_collection = MagicMock(return_value=collection)
+
+    def extract(paths):
+        # Every path is queued before the first one finishes, so d.pdf and
+        # e.pdf are seen while the copies they duplicate are still parsed
+        pages = {"a.pdf": ["Some text."], "f.pdf": ["\x0c"]}
+        return [(path, pages[path], None) if path in pages
+                else (path, None, Exception("Broken PDF"))
+                for path in list(paths)]
+
+    extractor_mock.return_value.extract.side_effect = extract
+
+    response = mock_collections.process_pdf_files(
+        [("a.pdf", ["control"]), ("b.pdf", ["control"]), ("c.pdf", ["control"]),
+         ("d.pdf", ["control"]), ("e.pdf", ["control"]), ("f.pdf", ["control"])],
+        "collection")
+
+    assert response["INGESTION_STATUS"] == {"a.pdf": "new", "b.pdf": "unchanged",
+                                            "c.pdf": "error", "d.pdf": "unchanged",
+                                            "e.pdf": "error", "f.pdf": "empty"}
+    assert response["SUMMARY"] == {"new": 1, "updated": 0, "unchanged": 2, "empty": 1, "error": 2}
+    assert response["STATE"] == "ERROR"
+    collection.add.assert_called_once()
+
+
+@pytest.mark.parametrize("upload_fails", [False, True])
+@patch("chroma.app.domain.batch_uploader.Configuration.UPLOAD_RETRY_BACKOFF", 0)
+@patch("chroma.app.domain.chroma_collections.category_versions")
+@patch("chroma.app.domain.chroma_collections.ParallelPdfExtractor")
+@patch("chroma.app.domain.chroma_collections.document_fingerprint", return_value="F")
+def test_process_pdf_files_waits_for_first_copy(fingerprint_mock, extractor_mock, versions_mock,
+                                                upload_fails, mock_collections, mock_embedder_function):
+    collection = MagicMock()
+    collection.name = "collection"
+    upload_started = threading.Event()
+    duplicate_read = threading.Event()
+    uploads = []
+
+    def add(ids, **kwargs):
+        # The first copy is partly stored while the producer reads b.pdf
+        uploads.append(ids)
+        upload_started.set()
+        assert duplicate_read.wait(5)
+        if upload_fails:
+            raise Exception("Chroma is down")
+
+    collection.add.side_effect = add
+    collection.upsert.side_effect = Exception("Chroma is down")
+    collection.get.side_effect = lambda where, include, limit=None: (
+        {'ids': ["F-0"], 'metadatas': [{"control": 1, "fingerprint": "F"}]}
+        if uploads else {'ids': [], 'metadatas': []})
+    mock_collections._validate_existing_collection = MagicMock(return_value=collection)
+
+    def extract(paths):
+        # Paths are read on a producer thread, like ParallelPdfExtractor does
+        extracted = queue.Queue()
+
+        def produce():
+            for path in paths:
+                extracted.put(path)
+                assert upload_started.wait(5)
+            duplicate_read.set()
+            extracted.put(None)
+
+        threading.Thread(target=produce, daemon=True).start()
+        while (path := extracted.get()) is not None:
+            yield path, ["Some text."], None
+
+    extractor_mock.return_value.extract.side_effect = extract
+
+    response = mock_collections.process_pdf_files(
+        [("a.pdf", ["control"]), ("b.pdf", ["quimica"])], "collection")
+
+    if upload_fails:
+        assert response["INGESTION_STATUS"] == {"a.pdf": "error", "b.pdf": "error"}
+        collection.update.assert_not_called()
+    else:
+        assert response["INGESTION_STATUS"] == {"a.pdf": "new", "b.pdf": "updated"}
+        # Categories of the copy are merged once every chunk is stored
+        collection.update.assert_called_once()
+    assert uploads == [["F-0"]]
+
+
+def test_chunk_text_by_tokens_ids_are_deterministic():
+    tokenizer = MagicMock(side_effect=_fake_tokenize)
+    text = "Some filler text to be chunked"
+
+    _, ids = chunk_text_by_tokens(text, tokenizer, max_tokens=2, overlap=0, document_id="doc")
+    _, same_ids = chunk_text_by_tokens(text, tokenizer, max_tokens=2, overlap=0)
+    _, repeated_ids = chunk_text_by_tokens(text, tokenizer, max_tokens=2, overlap=0)
+
+    assert ids == ["doc-0", "doc-1", "doc-2"]
+    assert same_ids == repeated_ids
+    assert len(set(same_ids)) == 3
+
+
+@patch("chroma.app.domain.chroma_collections.ChromaCollections.category_has_documents", return_value=True)
 @patch("chroma.app.domain.chroma_collections.ChromaCollections.basic_chroma_query")
 @patch("chroma.app.domain.chroma_collections.Collection")
 @patch('utils.outputs.print_console_message')
 def test_execute_search_query(console_print_mock: MagicMock,
                               collection_mock: MagicMock,
                               basic_chroma_query_mock: MagicMock,
-                              update_loaded_data_mock: MagicMock,
+                              category_has_documents_mock: MagicMock,
                               mock_collections,
                               mock_embedder_function):
     
     expected_result = {'DESCRIPTION': 'Your search yielded no results.', 'STATE': 'ERROR'}
     
-    # Mock collection.query to return expected keys
-    collection_mock.query.return_value = {
-        'documents': [['doc1', 'doc2']],
-        'metadatas': [['meta1', 'meta2']],
-        'ids': [['id1', 'id2']]
-    }
-    
-    update_loaded_data_mock.return_value = None
-    
     # Mock basic_chroma_query to use the mocked collection
     basic_chroma_query_mock.return_value = False
     
-    # Mock _invoke_llm to return a response
-    mock_collections._invoke_llm = MagicMock(return_value="llm response")
-    
-    # Mock _validate_existing_collection
-    mock_collections._validate_existing_collection = MagicMock(return_value=collection_mock)
-    
-    # Mock load_category_data to return a non-empty dictionary
-    mock_collections.load_category_data = MagicMock(return_value={'data': {}})
-    
-    # Mock _validate_loaded_response to return found data
-    mock_collections._validate_loaded_response = MagicMock(return_value=(True, {}, ""))
-    
-    # Call execute_search_query
-    response = mock_collections.execute_search_query(
-        "collection",
-        "control",
-        "what is an action",
-        12345,
-        max_tries=5
-    )
+    with patch.object(mock_collections, '_invoke_llm', return_value="llm response"), \
+         patch.object(mock_collections, '_validate_existing_collection', return_value=collection_mock), \
+         patch.object(mock_collections, 'cached_category_data', return_value=None):
+        response = mock_collections.execute_search_query(
+            "collection",
+            "control",
+            "what is an action",
+            12345,
+            max_tries=5
+        )
+
+        mock_collections._validate_existing_collection.assert_called_once_with("collection")
     
     # Assertions
     assert response == expected_result
-    # Adjusted assertion for basic_chroma_query
-    mock_collections._validate_existing_collection.assert_called_once_with("collection")
-    mock_collections.load_category_data.assert_called_with(category='control', collection=collection_mock)
-    mock_collections._validate_loaded_response.assert_called_with({'data': {}})
-    basic_chroma_query_mock.assert_called_with(collection_mock, 'control', 'what is an action')
-    update_loaded_data_mock.assert_called()
+    basic_chroma_query_mock.assert_called_with(collection_mock, 'control', 'what is an action',
+                                               category_data=ANY, mode='terms')
+    assert basic_chroma_query_mock.call_count == 6
+    category_has_documents_mock.assert_any_call(collection_mock, 'control')
+    category_has_documents_mock.assert_called_with(collection_mock, 'control', refresh=True)
+    # The category itself is never downloaded
+    collection_mock.get.assert_not_called()
     
     # Ensure print_console_message is called correctly
     console_print_mock.assert_called_with(message='Your search yielded no results.',
                                           message_color=OutputColors.FAIL.value,
                                           app=Configuration.CHROMA_QUEUE)
-    
\ No newline at end of file
+
+
+@patch("chroma.app.domain.chroma_collections.category_presence",
+       new=CategoryPresenceCache(ttl=600))
+def test_category_has_documents_fetches_one_id_and_caches_it(mock_collections):
+    collection = MagicMock()
+    collection.get.return_value = {'ids': ["a-0"]}
+
+    assert mock_collections.category_has_documents(collection, "control")
+    assert mock_collections.category_has_documents(collection, "control")
+
+    collection.get.assert_called_once_with(where={"control": 1}, limit=1, include=[])
+
+    collection.get.return_value = {'ids': []}
+    assert not mock_collections.category_has_documents(collection, "control", refresh=True)
+    assert not mock_collections.category_has_documents(collection, "control")
+    assert collection.get.call_count == 3
+    
+
+def test_invoke_llm_hands_query_to_langchain_queue(mock_collections):
+    query_result = {"metadatas": [{"control": 1}], "documents": ["doc a"], "ids": ["a"]}
+
+    with patch('chroma.app.domain.chroma_collections.celery') as celery_mock:
+        response = mock_collections._invoke_llm(query_result, "what is an action", "task-id",
+                                                {"RETRIEVAL_MODE": "terms"})
+
+    celery_mock.send_task.assert_called_once_with(
+        "user_langchain.app.task_executor.langchain_agent_invocation_task",
+        args=[[{"control": 1}], ["doc a"], "what is an action"],
+        kwargs={"reply_to": {"namespace": Configuration.CHROMA_QUEUE,
+                             "fields": {"RETRIEVAL_MODE": "terms"}}},
+        task_id="task-id",
+        queue=Configuration.LANGCHAIN_QUEUE)
+    assert response == {"STATE": "HANDED_OFF", "LLM_TASK_ID": "task-id", "RETRIEVAL_MODE": "terms"}
+
+
+def test_invoke_llm_reports_broker_errors(mock_collections):
+    with patch('chroma.app.domain.chroma_collections.celery') as celery_mock:
+        celery_mock.send_task.side_effect = ConnectionError("broker is down")
+        response = mock_collections._invoke_llm({}, "what is an action", "task-id")
+
+    assert response == {"STATE": "ERROR", "DESCRIPTION": "broker is down"}
@@ -0,0 +1,47 @@
+import numpy as np
+
+from chroma.app.domain.embedding_cache import EmbeddingCache, normalize_text
+
+
+def test_normalize_text():
+    assert normalize_text("  Some\n\ntext   here ") == "Some text here"
+
+
+def test_cache_key_depends_on_model_and_normalized_text():
+    cache = EmbeddingCache("model:fp32", max_entries=10)
+    other_model = EmbeddingCache("model:int8", max_entries=10)
+
+    assert cache.key("some  text") == cache.key("some text\n")
+    assert cache.key("some text") != other_model.key("some text")
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = EmbeddingCache("model:fp32", max_entries=2)
+    cache.put_many(["a", "b"], [[1.0, 0.0], [0.0, 1.0]])
+    cache.get_many(["a"])
+    cache.put_many(["c"], [[1.0, 1.0]])
+
+    a, b, c = cache.get_many(["a", "b", "c"])
+
+    assert a.tolist() == [1.0, 0.0]
+    assert b is None
+    assert c.tolist() == [1.0, 1.0]
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 3
+    assert stats['misses'] == 1
+
+
+def test_disk_tier_survives_new_cache_instance(tmp_path):
+    directory = str(tmp_path / "cache")
+    cache = EmbeddingCache("model:fp32", max_entries=1, directory=directory)
+    cache.put_many(["a", "b"], [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+
+    reopened = EmbeddingCache("model:fp32", max_entries=10, directory=directory)
+    a, b, missing = reopened.get_many(["a", "b", "c"])
+
+    np.testing.assert_array_equal(a, [1.0, 2.0, 3.0])
+    np.testing.assert_array_equal(b, [4.0, 5.0, 6.0])
+    assert missing is None
+    assert reopened.stats()['disk_hits'] == 2
+    assert reopened.stats()['disk_entries'] == 2
@@ -0,0 +1,99 @@
+import time
+
+from chroma.app.domain.ingestion_jobs import (FILES_KEY,
+                                              JOB_KEY,
+                                              IngestionJobs,
+                                              merge_documents,
+                                              parse_manifest,
+                                              split_into_lanes,
+                                              summarize_job)
+
+
+def test_split_into_lanes_bounds_concurrency():
+    lanes = split_into_lanes(list(range(7)), 3)
+
+    assert lanes == [[0, 3, 6], [1, 4], [2, 5]]
+    assert split_into_lanes([1, 2], 8) == [[1], [2]]
+    assert split_into_lanes([], 4) == []
+
+
+def test_parse_manifest(tmp_path):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("a.pdf\tcontrol, robotica\n\nb.pdf\na.pdf\tquimica, control\n")
+
+    assert parse_manifest(str(manifest), ["quimica"]) == [
+        ("a.pdf", ["control", "robotica", "quimica"]),
+        ("b.pdf", ["quimica"])]
+
+
+def test_summarize_job_reports_throughput():
+    job = {'job_id': 'job', 'collection_name': 'test', 'total': '3',
+           'created_at': '100'}
+    files = {
+        'a.pdf': {'status': 'new', 'pages': 10, 'chunks': 40,
+                  'finished_at': 104},
+        'b.pdf': {'status': 'unchanged', 'finished_at': 102},
+        'c.pdf': {'status': 'running'},
+    }
+
+    summary = summarize_job(job, files, now=105)
+
+    assert summary['STATE'] == 'RUNNING'
+    assert summary['COMPLETED'] == 2
+    assert summary['FAILED'] == 0
+    assert summary['ELAPSED_S'] == 5
+    assert summary['PAGES_PER_S'] == 2
+    assert summary['CHUNKS_PER_S'] == 8
+
+    files['c.pdf'] = {'status': 'failed', 'finished_at': 104}
+    summary = summarize_job(job, files, now=200)
+
+    assert summary['STATE'] == 'FINISHED'
+    assert summary['ELAPSED_S'] == 4
+
+
+def test_ingestion_jobs_track_and_requeue_failed_files(fake_redis):
+    jobs = IngestionJobs(fake_redis)
+    job_id = jobs.create('test', [('a.pdf', ['control']),
+                                  ('b.pdf', ['quimica'])], 2)
+
+    jobs.start_file(job_id, 'a.pdf')
+    jobs.update_file(job_id, 'a.pdf', status='failed', error='broken')
+    jobs.start_file(job_id, 'b.pdf')
+    jobs.update_file(job_id, 'b.pdf', status='new', pages=2, chunks=5)
+
+    progress = jobs.progress(job_id)
+    assert progress['STATUS_COUNTS'] == {'failed': 1, 'new': 1}
+    assert progress['FILES']['a.pdf']['attempts'] == 1
+
+    assert jobs.requeue_failed(job_id) == [('a.pdf', ['control'])]
+    assert jobs.files(job_id)['a.pdf']['status'] == 'queued'
+    assert jobs.progress('missing') == {}
+
+
+def test_ingestion_jobs_expire(fake_redis):
+    jobs = IngestionJobs(fake_redis, ttl=60)
+    job_id = jobs.create('test', [('a.pdf', ['control'])], 1)
+
+    assert fake_redis.expirations[JOB_KEY.format(job_id=job_id)] == 60
+    assert fake_redis.expirations[FILES_KEY.format(job_id=job_id)] == 60
+
+    fake_redis.expirations.clear()
+    jobs.update_file(job_id, 'a.pdf', status='new')
+    assert fake_redis.expirations[JOB_KEY.format(job_id=job_id)] == 60
+
+
+def test_repeated_paths_are_one_file_of_the_job(fake_redis):
+    documents = [('a.pdf', ['control']), ('b.pdf', ['quimica']), ('a.pdf', ['robotica'])]
+    jobs = IngestionJobs(fake_redis)
+
+    job_id = jobs.create('test', documents, 2)
+    for file_path in ('a.pdf', 'b.pdf'):
+        jobs.update_file(job_id, file_path, status='new', finished_at=time.time())
+
+    assert merge_documents(documents) == [('a.pdf', ['control', 'robotica']),
+                                          ('b.pdf', ['quimica'])]
+    assert jobs.files(job_id)['a.pdf']['categories'] == ['control', 'robotica']
+    progress = jobs.progress(job_id)
+    assert progress['TOTAL'] == 2
+    assert progress['STATE'] == 'FINISHED'
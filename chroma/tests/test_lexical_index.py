@@ -0,0 +1,64 @@
+from chroma.app.domain.lexical_index import LexicalIndex, chunk_categories, tokenize
+
+
+def _index(path=None):
+    index = LexicalIndex(path)
+    index.add_many([LexicalIndex.chunk_entry("a", "Robot arm control with a PID loop"),
+                    LexicalIndex.chunk_entry("b", "Robot vision for the arm"),
+                    LexicalIndex.chunk_entry("c", "Weather report")], ["control"])
+    index.add_many([LexicalIndex.chunk_entry("d", "Robot arm control theory")], ["theory"])
+    return index
+
+
+def test_tokenize_drops_stopwords_and_single_characters():
+    assert tokenize("The robot's arm, a PID loop") == ["robot", "arm", "pid", "loop"]
+
+
+def test_chunk_categories():
+    assert chunk_categories({"control": 1, "theory": 1, "fingerprint": "abc"}) == ["control", "theory"]
+
+
+def test_search_ranks_by_bm25_within_category():
+    index = _index()
+
+    results = index.search("robot arm control", "control", 5)
+
+    assert [chunk_id for chunk_id, _ in results] == ["a", "b"]
+    assert results[0][1] > results[1][1]
+    assert [chunk_id for chunk_id, _ in index.search("robot", "theory", 5)] == ["d"]
+    assert index.search("unknown words", "control", 5) == []
+
+
+def test_search_limits_results():
+    assert len(_index().search("robot", "control", 1)) == 1
+
+
+def test_set_categories_moves_chunks():
+    index = _index()
+
+    index.set_categories(["d"], ["theory", "control"])
+
+    assert "d" in [chunk_id for chunk_id, _ in index.search("control theory", "control", 5)]
+
+
+def test_index_is_replayed_from_disk(tmp_path):
+    path = str(tmp_path / "index" / "collection.jsonl")
+    writer = _index(path)
+    reader = LexicalIndex(path)
+
+    assert len(reader) == len(writer) == 4
+    assert reader.search("robot arm", "control", 5) == writer.search("robot arm", "control", 5)
+
+    # Lines appended by another process are picked up before searching
+    writer.add_many([LexicalIndex.chunk_entry("e", "Robot gripper")], ["control"])
+    assert "e" in [chunk_id for chunk_id, _ in reader.search("gripper", "control", 5)]
+
+
+def test_chunks_are_indexed_once(tmp_path):
+    index = LexicalIndex(str(tmp_path / "collection.jsonl"))
+    entry = LexicalIndex.chunk_entry("a", "robot arm")
+
+    index.add_many([entry], ["control"])
+    index.add_many([entry], ["control"])
+
+    assert len(index) == 1
@@ -0,0 +1,44 @@
+from unittest.mock import MagicMock, patch
+
+from chroma.app import task_executor
+
+
+@patch("chroma.app.task_executor.Configuration.ASYNC_SEARCH", True)
+def test_handed_off_search_leaves_its_result_to_langchain():
+    task_results = MagicMock()
+    handed_off = {"STATE": "HANDED_OFF", "LLM_TASK_ID": "task-id", "RETRIEVAL_MODE": "terms"}
+
+    with patch.object(task_executor, 'run_search_query', return_value=handed_off), \
+         patch.object(task_executor, 'task_results', task_results):
+        result = task_executor.chroma_search_query_task.apply(
+            args=["collection", "control", "what is an action"], task_id="task-id").get()
+
+    assert result == handed_off
+    task_results.store.assert_not_called()
+
+
+@patch("chroma.app.task_executor.Configuration.ASYNC_SEARCH", True)
+def test_failed_search_stores_its_result():
+    task_results = MagicMock()
+    failed = {"STATE": "ERROR", "DESCRIPTION": "Your search yielded no results."}
+
+    with patch.object(task_executor, 'run_search_query', return_value=failed), \
+         patch.object(task_executor, 'task_results', task_results):
+        task_executor.chroma_search_query_task.apply(
+            args=["collection", "control", "what is an action"], task_id="task-id")
+
+    task_results.store.assert_called_once_with("task-id", 'SUCCESS', failed)
+
+
+def test_bulk_file_task_records_redis_failures_without_raising():
+    jobs = MagicMock()
+    jobs.start_file.side_effect = ConnectionError("Redis is down")
+
+    with patch.object(task_executor, 'IngestionJobs', return_value=jobs), \
+         patch.object(task_executor, 'ChromaCollections') as collections_mock:
+        result = task_executor.chroma_bulk_file_task.apply(
+            args=["job", "collection", "a.pdf", ["control"]]).get()
+
+    assert result == {"STATE": "ERROR", "DESCRIPTION": "Redis is down"}
+    collections_mock.return_value.process_pdf_file.assert_not_called()
+    assert jobs.update_file.call_args.kwargs['status'] == 'failed'
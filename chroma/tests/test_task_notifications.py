@@ -0,0 +1,55 @@
+import json
+import threading
+import time
+
+from unittest.mock import patch
+
+from chroma.app import task_executor
+from utils.task_results import TaskResultStore
+from utils.task_notifications import (DONE_KEY,
+                                      RESULT_KEY,
+                                      publish_task_result,
+                                      sse_data,
+                                      wait_for_task_result)
+
+
+def test_published_result_is_found_by_late_waiter(fake_redis):
+    publish_task_result(fake_redis, "task", "result", notify_ttl=30)
+
+    assert wait_for_task_result(fake_redis, "task", timeout=1) == b"result"
+    assert fake_redis.expirations[DONE_KEY.format(namespace="tasks", task_id="task")] == 30
+    assert RESULT_KEY.format(namespace="tasks", task_id="task") not in fake_redis.expirations
+
+
+def test_waiter_wakes_on_publish(fake_redis):
+    threading.Timer(0.05, publish_task_result, args=(fake_redis, "task", "result")).start()
+
+    start_time = time.monotonic()
+    result = wait_for_task_result(fake_redis, "task", timeout=5)
+
+    assert result == b"result"
+    assert time.monotonic() - start_time < 1
+    # One read before blocking and one after waking, no polling
+    assert fake_redis.gets == 2
+
+
+def test_waiter_times_out_without_result(fake_redis):
+    assert wait_for_task_result(fake_redis, "task", timeout=0.05) is None
+
+
+def test_sse_stream_sends_keep_alive_until_result(fake_redis):
+    store = TaskResultStore(fake_redis, "test")
+    threading.Timer(0.15, store.store, args=("task", "SUCCESS", {"STATE": "OK"})).start()
+
+    with patch.object(task_executor, 'task_results', store), \
+         patch.object(task_executor.Configuration, 'SSE_HEARTBEAT_SECONDS', 0.1), \
+         patch.object(task_executor.Configuration, 'TOKEN_STREAMING', False):
+        events = list(task_executor.sse_stream("task"))
+
+    assert events[0] == ": waiting\n\n"
+    assert json.loads(sse_data(events[-1])) == {'state': 'SUCCESS', 'result': {"STATE": "OK"}}
+
+
+def test_sse_data_skips_keep_alive_comments():
+    assert sse_data(': waiting\n\n: waiting\n\ndata: {"STATE": "SUCCESS"}\n\n') == '{"STATE": "SUCCESS"}'
+    assert sse_data('{"STATE": "SUCCESS"}') == '{"STATE": "SUCCESS"}'
@@ -0,0 +1,109 @@
+import json
+import threading
+
+import pytest
+
+from unittest.mock import patch
+
+from utils import task_results as task_results_module
+from utils.task_notifications import RESULT_KEY
+from utils.task_results import TaskResultStore
+from utils.token_streams import sse_token_event
+
+
+def test_result_is_stored_once_with_ttl(fake_redis):
+    store = TaskResultStore(fake_redis, "test", ttl=120)
+
+    size = store.store("task", "SUCCESS", {"STATE": "OK", "DOCUMENTS": ["a"]})
+
+    key = RESULT_KEY.format(namespace="test", task_id="task")
+    assert fake_redis.expirations[key] == 120
+    assert len(fake_redis.values[key]) == size
+    assert store.wait("task", timeout=1) == {'state': 'SUCCESS',
+                                             'result': {"STATE": "OK", "DOCUMENTS": ["a"]}}
+    assert store.stats()['stored'] == 1
+
+
+def test_result_is_serialized_in_a_single_layer(fake_redis):
+    store = TaskResultStore(fake_redis, "test", compress_min_bytes=0)
+
+    value, raw_size = store.encode({'state': 'SUCCESS', 'result': {"STATE": "OK"}})
+
+    assert json.loads(value[2:]) == {'state': 'SUCCESS', 'result': {"STATE": "OK"}}
+    assert raw_size == len(value) - 2
+
+
+def test_large_results_are_compressed(fake_redis):
+    store = TaskResultStore(fake_redis, "test", compress_min_bytes=1024)
+    payload = {'state': 'SUCCESS', 'result': {"DOCUMENTS": ["same chunk text"] * 500}}
+
+    value, raw_size = store.encode(payload)
+
+    assert len(value) < raw_size
+    assert TaskResultStore.decode(value) == payload
+    small_value, _ = store.encode({'state': 'ERROR', 'result': "failed"})
+    assert TaskResultStore.decode(small_value) == {'state': 'ERROR', 'result': "failed"}
+
+
+def test_msgpack_round_trip(fake_redis):
+    pytest.importorskip("msgpack")
+    store = TaskResultStore(fake_redis, "test", serializer="msgpack", compress_min_bytes=1024)
+    small = {'state': 'SUCCESS', 'result': {"STATE": "OK", "SCORES": [0.5, 1.0]}}
+    large = {'state': 'SUCCESS', 'result': {"DOCUMENTS": ["same chunk text"] * 500}}
+
+    small_value, _ = store.encode(small)
+    large_value, raw_size = store.encode(large)
+
+    assert store.serializer == "msgpack"
+    assert small_value[:2] == b"m-"
+    assert large_value[:2] == b"mz" and len(large_value) < raw_size
+    assert TaskResultStore.decode(small_value) == small
+    assert TaskResultStore.decode(large_value) == large
+    store.store("task", "SUCCESS", small['result'])
+    assert store.wait("task", timeout=1) == small
+
+
+def test_msgpack_falls_back_to_json_when_missing(fake_redis):
+    with patch.object(task_results_module, 'msgpack', None):
+        store = TaskResultStore(fake_redis, "test", serializer="msgpack")
+
+    assert store.serializer == "json"
+    with pytest.raises(ValueError):
+        TaskResultStore(fake_redis, "test", serializer="pickle")
+
+
+def test_follow_forwards_tokens_before_the_result(fake_redis):
+    store = TaskResultStore(fake_redis, "test", token_streams=True)
+    tokens = store.token_stream("task")
+    tokens.append("An action")
+    tokens.reset()
+    tokens.append("An action is")
+    threading.Timer(0.05, store.store, args=("task", "SUCCESS", {"STATE": "OK"})).start()
+
+    events = list(store.follow("task", heartbeat_seconds=1, stream_tokens=True))
+
+    assert events == [{'event': 'token', 'text': "An action"},
+                      {'event': 'reset'},
+                      {'event': 'token', 'text': "An action is"},
+                      {'event': 'result', 'result': {'state': 'SUCCESS',
+                                                     'result': {"STATE": "OK"}}}]
+    assert sse_token_event(events[2]) == 'event: token\ndata: {"text": "An action is"}\n\n'
+
+
+def test_follow_returns_results_of_tasks_that_do_not_stream(fake_redis):
+    store = TaskResultStore(fake_redis, "test", token_streams=False)
+    store.store("task", "ERROR", "failed")
+
+    events = list(store.follow("task", heartbeat_seconds=0.05, stream_tokens=True))
+
+    assert events[-1] == {'event': 'result', 'result': {'state': 'ERROR', 'result': "failed"}}
+
+
+def test_services_keep_separate_results_for_a_shared_task_id(fake_redis):
+    chroma_results = TaskResultStore(fake_redis, "chroma")
+    langchain_results = TaskResultStore(fake_redis, "langchain")
+
+    langchain_results.store("task", "SUCCESS", "answer")
+
+    assert chroma_results.wait("task", timeout=0.05) is None
+    assert langchain_results.read("task") == {'state': 'SUCCESS', 'result': "answer"}
@@ -0,0 +1,32 @@
+import numpy as np
+
+from chroma.app.domain.vector_search import normalize_rows, top_k_cosine
+
+
+def test_normalize_rows_handles_zero_rows():
+    matrix = normalize_rows([[3.0, 4.0], [0.0, 0.0]])
+
+    assert matrix.dtype == np.float32
+    assert np.allclose(matrix, [[0.6, 0.8], [0.0, 0.0]])
+
+
+def test_top_k_cosine_matches_full_sort():
+    rng = np.random.default_rng(0)
+    matrix = normalize_rows(rng.random((200, 16)))
+    queries = rng.random((3, 16))
+
+    indices, similarities = top_k_cosine(matrix, queries, 5)
+
+    expected = np.argsort(-(normalize_rows(queries) @ matrix.T), axis=1)[:, :5]
+    assert (indices == expected).all()
+    assert (np.diff(similarities, axis=1) <= 0).all()
+
+
+def test_top_k_cosine_with_fewer_rows_than_k():
+    matrix = normalize_rows([[1.0, 0.0], [0.0, 1.0]])
+
+    indices, similarities = top_k_cosine(matrix, [[0.0, 1.0]], 5)
+
+    assert indices.tolist() == [[1, 0]]
+    assert np.allclose(similarities, [[1.0, 0.0]])
+    assert top_k_cosine(normalize_rows(np.empty((0, 2))), [[1.0, 0.0]], 3)[0].shape == (1, 0)
@@ -14,5 +14,75 @@ class Configuration:
     REDIS_HOST = os.getenv('REDIS_HOST', 'redis')
     LANGCHAIN_QUEUE = os.getenv('LANGCHAIN_QUEUE', 'langchain_queue')
     CHROMA_QUEUE = os.getenv('CHROMA_QUEUE', 'chroma_queue')
+    # PDF ingestion runs on its own prefork worker, which enforces task
+    # time limits and keeps one document per process
+    CHROMA_INGESTION_QUEUE = os.getenv('CHROMA_INGESTION_QUEUE',
+                                       'chroma_ingestion_queue')
     CHROMA_URL = os.getenv('CHROMA_URL', 'chroma')
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024
+    EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL',
+                                'bert-base-multilingual-cased')
+    EMBEDDING_MAX_TOKENS = int(os.getenv('EMBEDDING_MAX_TOKENS', 512))
+    EMBEDDING_TOKEN_BUDGET = int(os.getenv('EMBEDDING_TOKEN_BUDGET', 16384))
+    # One of fp32, int8 (dynamic quantization) or bf16
+    EMBEDDING_INFERENCE_MODE = os.getenv('EMBEDDING_INFERENCE_MODE', 'fp32')
+    # Seconds Celery waits for a new worker process, which loads the
+    # embedding model before it reports itself alive
+    WORKER_PROC_ALIVE_TIMEOUT = float(os.getenv('WORKER_PROC_ALIVE_TIMEOUT', 120))
+    EMBEDDING_CACHE_ENTRIES = int(os.getenv('EMBEDDING_CACHE_ENTRIES', 20000))
+    # Directory of the persistent embedding cache, empty to disable it
+    EMBEDDING_CACHE_DIR = os.getenv('EMBEDDING_CACHE_DIR',
+                                    os.path.join(basedir, 'embedding_cache'))
+    # Chunks leave room for the [CLS] and [SEP] tokens
+    CHUNK_MAX_TOKENS = int(os.getenv('CHUNK_MAX_TOKENS',
+                                     EMBEDDING_MAX_TOKENS - 2))
+    CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', 32))
+    PDF_PAGES_PER_BATCH = int(os.getenv('PDF_PAGES_PER_BATCH', 4))
+    EMBED_BATCH_CHUNKS = int(os.getenv('EMBED_BATCH_CHUNKS', 64))
+    # Chunks per upload request, uploaded while the next batch is embedded
+    UPLOAD_BATCH_CHUNKS = int(os.getenv('UPLOAD_BATCH_CHUNKS', 64))
+    UPLOAD_MAX_RETRIES = int(os.getenv('UPLOAD_MAX_RETRIES', 3))
+    UPLOAD_RETRY_BACKOFF = float(os.getenv('UPLOAD_RETRY_BACKOFF', 0.5))
+    # Processes parsing PDFs during bulk ingestion, 0 for one less than the cores
+    PDF_EXTRACTION_WORKERS = int(os.getenv('PDF_EXTRACTION_WORKERS', 0))
+    BULK_INGESTION_CONCURRENCY = int(os.getenv('BULK_INGESTION_CONCURRENCY', 4))
+    # Seconds the progress of an ingestion job is kept after its last change
+    INGESTION_JOB_TTL = int(os.getenv('INGESTION_JOB_TTL', 7 * 24 * 3600))
+    # Per-process cache of the chunks loaded for each searched category
+    CATEGORY_CACHE_MAX_MB = int(os.getenv('CATEGORY_CACHE_MAX_MB', 512))
+    # Only used when the category versions in Redis cannot be read
+    CATEGORY_CACHE_TTL = int(os.getenv('CATEGORY_CACHE_TTL', 60 * 10))
+    # Seconds a category is assumed populated after a successful check
+    CATEGORY_PRESENCE_TTL = int(os.getenv('CATEGORY_PRESENCE_TTL', 30))
+    # Answer searches from the cached category matrix instead of Chroma
+    LOCAL_SEARCH = os.getenv('LOCAL_SEARCH', 'true').lower() == 'true'
+    # Serve searches through the asyncio path on a per-worker event loop,
+    # shared by the tasks of a threads pool worker
+    ASYNC_SEARCH = os.getenv('ASYNC_SEARCH', 'true').lower() == 'true'
+    CHROMA_CALL_TIMEOUT = float(os.getenv('CHROMA_CALL_TIMEOUT', 10))
+    CHROMA_MAX_CONCURRENT_CALLS = int(os.getenv('CHROMA_MAX_CONCURRENT_CALLS', 8))
+    # One of terms (one vector per query term, ranked by term hits), query
+    # (the whole query as a single vector, ranked by distance), fusion
+    # (whole query and terms combined with reciprocal rank fusion), hybrid
+    # (BM25 candidates rescored by the query vector) or lexical (BM25 only)
+    RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'terms')
+    RRF_K = int(os.getenv('RRF_K', 60))
+    # Directory of the BM25 indexes, empty to disable lexical retrieval
+    LEXICAL_INDEX_DIR = os.getenv('LEXICAL_INDEX_DIR',
+                                  os.path.join(basedir, 'lexical_index'))
+    # BM25 candidates rescored densely in hybrid mode
+    LEXICAL_CANDIDATES = int(os.getenv('LEXICAL_CANDIDATES', 100))
+    # Seconds an open result stream blocks on Redis before sending a keep-alive
+    SSE_HEARTBEAT_SECONDS = int(os.getenv('SSE_HEARTBEAT_SECONDS', 15))
+    # Seconds a completion notice waits for a stream that has not started yet
+    TASK_NOTIFY_TTL = int(os.getenv('TASK_NOTIFY_TTL', 600))
+    # Seconds a task result is kept in Redis
+    RESULT_TTL = int(os.getenv('RESULT_TTL', 60 * 60))
+    # json or msgpack (needs the msgpack package) for stored task results
+    RESULT_SERIALIZER = os.getenv('RESULT_SERIALIZER', 'json')
+    # Task results of at least this many bytes are compressed, 0 to disable
+    RESULT_COMPRESS_MIN_BYTES = int(os.getenv('RESULT_COMPRESS_MIN_BYTES', 16384))
+    # Stream generated text to the result streams as it is produced
+    TOKEN_STREAMING = os.getenv('TOKEN_STREAMING', 'true').lower() == 'true'
+    # Seconds the generated text of a task is kept in Redis
+    TOKEN_STREAM_TTL = int(os.getenv('TOKEN_STREAM_TTL', 600))
@@ -0,0 +1,146 @@
+import threading
+import time
+
+import pytest
+
+
+def _bytes(value) -> bytes:
+    return value if isinstance(value, bytes) else str(value).encode('utf-8')
+
+
+class FakeRedis:
+    """
+    In-memory stand-in for the parts of the Redis client the services use.
+    Values come back as bytes like they do from Redis, and blocking BLPOP
+    and XREAD calls wake when a command writes.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.hashes = {}
+        self.lists = {}
+        self.streams = {}
+        self.expirations = {}
+        self.gets = 0
+        self._changed = threading.Condition()
+
+    def _write(self, command):
+        with self._changed:
+            result = command()
+            self._changed.notify_all()
+            return result
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def get(self, key):
+        self.gets += 1
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self._write(lambda: self.values.__setitem__(key, _bytes(value)))
+        if ex is not None:
+            self.expire(key, ex)
+        return True
+
+    def incr(self, key):
+        def incr():
+            self.values[key] = _bytes(int(self.values.get(key, 0)) + 1)
+            return int(self.values[key])
+        return self._write(incr)
+
+    def expire(self, key, seconds):
+        self._write(lambda: self.expirations.__setitem__(key, seconds))
+        return True
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        def hset():
+            values = self.hashes.setdefault(key, {})
+            for name, item in (mapping or {field: value}).items():
+                values[_bytes(name)] = _bytes(item)
+        self._write(hset)
+
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(_bytes(field))
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def hincrby(self, key, field, amount=1):
+        def hincrby():
+            values = self.hashes.setdefault(key, {})
+            values[_bytes(field)] = _bytes(int(values.get(_bytes(field), 0)) + amount)
+        self._write(hincrby)
+
+    def hincrbyfloat(self, key, field, amount=1.0):
+        def hincrbyfloat():
+            values = self.hashes.setdefault(key, {})
+            values[_bytes(field)] = _bytes(float(values.get(_bytes(field), 0)) + amount)
+        self._write(hincrbyfloat)
+
+    def rpush(self, key, value):
+        self._write(lambda: self.lists.setdefault(key, []).append(value))
+
+    def xadd(self, key, fields, maxlen=None, approximate=True):
+        def xadd():
+            entries = self.streams.setdefault(key, [])
+            entries.append((str(len(entries) + 1), dict(fields)))
+        self._write(xadd)
+
+    def blpop(self, keys, timeout=0):
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                for key in keys:
+                    if self.lists.get(key):
+                        return key, self.lists[key].pop(0)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._changed.wait(remaining)
+
+    def xread(self, streams, block=None):
+        deadline = time.monotonic() + (block or 0) / 1000
+        with self._changed:
+            while True:
+                response = []
+                for key, last_id in streams.items():
+                    entries = [(entry_id, fields)
+                               for entry_id, fields in self.streams.get(key, [])
+                               if int(entry_id) > int(last_id)]
+                    if entries:
+                        response.append((key, entries))
+                remaining = deadline - time.monotonic()
+                if response or remaining <= 0:
+                    return response
+                self._changed.wait(remaining)
+
+
+class FakePipeline:
+    """
+    Queues the write commands of FakeRedis and runs them together, so
+    waiters see all of them at once.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append(lambda: command(*args, **kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self.redis._changed:
+            results = [command() for command in self.commands]
+        self.commands = []
+        return results
+
+
+@pytest.fixture
+def fake_redis():
+    return FakeRedis()
@@ -1,4 +1,17 @@
+import hashlib
+import multiprocessing
+import os
+import queue
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+
+from pdfminer.converter import TextConverter
 from pdfminer.high_level import extract_text
+from pdfminer.layout import LAParams
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
 
 
 def pdf_to_bytes(pdf_path):
@@ -6,3 +19,128 @@ def pdf_to_bytes(pdf_path):
     text_bytes = all_text.encode('utf-8')
 
     return text_bytes
+
+
+def iter_pdf_pages(pdf_path, pages_per_batch: int = 1):
+    """
+    Yield the text of a PDF a few pages at a time instead of extracting the
+    whole document at once, so memory stays bounded by the batch size.
+    Every page ends with a form feed, as in pdfminer's extract_text.
+    """
+    with open(pdf_path, 'rb') as pdf_file, StringIO() as output_string:
+        resource_manager = PDFResourceManager(caching=True)
+        device = TextConverter(resource_manager,
+                               output_string,
+                               codec='utf-8',
+                               laparams=LAParams())
+        interpreter = PDFPageInterpreter(resource_manager, device)
+
+        pages_in_batch = 0
+        for page in PDFPage.get_pages(pdf_file, caching=True):
+            interpreter.process_page(page)
+            pages_in_batch += 1
+            if pages_in_batch == pages_per_batch:
+                yield output_string.getvalue()
+                output_string.seek(0)
+                output_string.truncate()
+                pages_in_batch = 0
+
+        if pages_in_batch:
+            yield output_string.getvalue()
+        device.close()
+
+
+def extract_pdf_pages(pdf_path, pages_per_batch: int = 1) -> list[str]:
+    return list(iter_pdf_pages(pdf_path, pages_per_batch))
+
+
+class ParallelPdfExtractor:
+    """
+    Extract many PDFs on a pool of processes. pdfminer is pure Python and
+    CPU bound, so parsing runs outside the process that holds the embedding
+    model. At most max_pending documents are being parsed or waiting to be
+    consumed at any time, which bounds the memory used by extracted text.
+    """
+
+    def __init__(self,
+                 max_workers: int = None,
+                 max_pending: int = None,
+                 pages_per_batch: int = 1):
+        # Leave one core for the embedding stage
+        self.max_workers = max_workers or max((os.cpu_count() or 2) - 1, 1)
+        self.max_pending = max_pending or self.max_workers * 2
+        self.pages_per_batch = pages_per_batch
+
+    def extract(self, pdf_paths):
+        """
+        Yield (pdf_path, page_batches, error) tuples in completion order.
+        pdf_paths may be a lazy iterable, it is consumed as slots free up.
+        """
+        if multiprocessing.current_process().daemon:
+            # Daemonic processes, like Celery prefork children, cannot start
+            # a process pool, so the pages are streamed inline instead
+            for pdf_path in pdf_paths:
+                yield pdf_path, iter_pdf_pages(pdf_path, self.pages_per_batch), None
+            return
+
+        completed = queue.Queue()
+        slots = threading.Semaphore(self.max_pending)
+        stopped = threading.Event()
+        finished = object()
+
+        def submit_all(executor):
+            submitted = 0
+            try:
+                for pdf_path in pdf_paths:
+                    slots.acquire()
+                    if stopped.is_set():
+                        break
+                    future = executor.submit(extract_pdf_pages,
+                                             pdf_path,
+                                             self.pages_per_batch)
+                    future.add_done_callback(
+                        lambda done, path=pdf_path: completed.put((path, done)))
+                    submitted += 1
+            finally:
+                completed.put((finished, submitted))
+
+        # Workers are forked from a clean server process, never from a parent
+        # that may already be running torch threads
+        with ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('forkserver')) as executor:
+            producer = threading.Thread(target=submit_all,
+                                        args=(executor,),
+                                        daemon=True)
+            producer.start()
+            consumed = 0
+            total = None
+            try:
+                while total is None or consumed < total:
+                    pdf_path, result = completed.get()
+                    if pdf_path is finished:
+                        total = result
+                        continue
+                    consumed += 1
+                    slots.release()
+                    error = result.exception()
+                    yield (pdf_path,
+                           None if error else result.result(),
+                           error)
+            finally:
+                # Unblock the producer if the consumer stopped early
+                stopped.set()
+                slots.release()
+                producer.join()
+
+
+def document_fingerprint(file_path, block_size=1024 * 1024) -> str:
+    """
+    Content hash of a file, used to recognise documents that were already
+    ingested regardless of their path or name.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as document:
+        while block := document.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
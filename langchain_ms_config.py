@@ -15,3 +15,31 @@ class Configuration:
     LANGCHAIN_QUEUE = os.getenv('LANGCHAIN_QUEUE', 'langchain_queue')
     CHROMA_QUEUE = os.getenv('CHROMA_QUEUE', 'chroma_queue')
     CHROMA_URL = os.getenv('CHROMA_URL', 'chroma')
+    # Seconds an open result stream blocks on Redis before sending a keep-alive
+    SSE_HEARTBEAT_SECONDS = int(os.getenv('SSE_HEARTBEAT_SECONDS', 15))
+    # Seconds a completion notice waits for a stream that has not started yet
+    TASK_NOTIFY_TTL = int(os.getenv('TASK_NOTIFY_TTL', 600))
+    # Seconds a task result is kept in Redis
+    RESULT_TTL = int(os.getenv('RESULT_TTL', 60 * 60))
+    # json or msgpack (needs the msgpack package) for stored task results
+    RESULT_SERIALIZER = os.getenv('RESULT_SERIALIZER', 'json')
+    # Task results of at least this many bytes are compressed, 0 to disable
+    RESULT_COMPRESS_MIN_BYTES = int(os.getenv('RESULT_COMPRESS_MIN_BYTES', 16384))
+    # Stream generated text to the result streams as it is produced
+    TOKEN_STREAMING = os.getenv('TOKEN_STREAMING', 'true').lower() == 'true'
+    # Seconds the generated text of a task is kept in Redis
+    TOKEN_STREAM_TTL = int(os.getenv('TOKEN_STREAM_TTL', 600))
+    OLLAMA_URL = os.getenv('OLLAMA_URL', 'http://localhost:11434')
+    OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'llama3:70b')
+    # How long Ollama keeps the model loaded after a request, as a duration
+    # such as 30m or seconds, -1 keeps it loaded
+    OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+    OLLAMA_TIMEOUT = int(os.getenv('OLLAMA_TIMEOUT', 600))
+    # Connections to Ollama kept open per worker process
+    OLLAMA_POOL_SIZE = int(os.getenv('OLLAMA_POOL_SIZE', 4))
+    # Load the model into Ollama when a worker process starts
+    OLLAMA_WARM_UP = os.getenv('OLLAMA_WARM_UP', 'true').lower() == 'true'
+    # Seconds Celery waits for a new worker process to start up
+    WORKER_PROC_ALIVE_TIMEOUT = float(os.getenv('WORKER_PROC_ALIVE_TIMEOUT', 60))
+    # Model loads at least this long, in seconds, count as cold starts
+    OLLAMA_COLD_START_SECONDS = float(os.getenv('OLLAMA_COLD_START_SECONDS', 1))
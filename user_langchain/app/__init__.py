@@ -1,8 +1,14 @@
 import redis
 from langchain_ms_config import Configuration
+from user_langchain.app.domain.llm_metrics import LLMMetrics
+from utils.task_results import TaskResultStore
 
 redis_client = redis.StrictRedis.from_url(Configuration.CELERY_RESULT_BACKEND)
+task_results = TaskResultStore.from_configuration(redis_client,
+                                                  Configuration,
+                                                  Configuration.LANGCHAIN_QUEUE)
 loaded_collections = {}
+llm_metrics = LLMMetrics(redis_client, Configuration.OLLAMA_COLD_START_SECONDS)
 
 
 def test_redis_connection():
@@ -3,6 +3,7 @@ from flask import Blueprint, request, jsonify, Response
 from utils.request_validator import (validate_params, get_request_data)
 from user_langchain.app.task_executor import (langchain_agent_invocation_task,
                                               sse_stream)
+from user_langchain.app import llm_metrics
 from langchain_ms_config import Configuration
 
 langchain_router = Blueprint('langchain',
@@ -34,3 +35,8 @@ def search_query():
         "STATE": "ERROR",
         "DESCRIPTION": "Please provide the required information to query."
     })
+
+
+@langchain_router.get("/metrics")
+def model_metrics():
+    return jsonify(llm_metrics.get(Configuration.OLLAMA_MODEL))
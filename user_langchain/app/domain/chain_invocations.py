@@ -1,5 +1,5 @@
 from user_langchain.prompt import prompt, parser
-from langchain_community.llms import Ollama
+from user_langchain.app.domain.pooled_ollama import PooledOllama
 from langchain.chains.base import Chain
 from utils.outputs import (print_error,
                            print_successful_message,
@@ -8,12 +8,20 @@ from utils.outputs import (print_error,
 from langchain_ms_config import Configuration
 from pydantic_core import ValidationError
 import gc
+import time
+
+
+def keep_alive(value: str):
+    # Ollama reads plain numbers as seconds and anything else as a duration
+    return int(value) if value.lstrip('-').isdigit() else value
 
 
 class LangchainChain:
     def __init__(self):
-        self.llm_model = Ollama(model="llama3:70b", base_url="http://localhost:11434")
-        # self.llm_model = Ollama(model="llama3.2:latest", base_url="http://localhost:11434")
+        self.llm_model = PooledOllama(model=Configuration.OLLAMA_MODEL,
+                                      base_url=Configuration.OLLAMA_URL,
+                                      keep_alive=keep_alive(Configuration.OLLAMA_KEEP_ALIVE),
+                                      timeout=Configuration.OLLAMA_TIMEOUT)
         # Set up the agent executor
         self.llm_chain: Chain = prompt | self.llm_model
 
@@ -30,15 +38,41 @@ class LangchainChain:
         return json_string
     
     @staticmethod
-    def _invoke_query(executor: Chain, query, max_attempts=5):
+    def _stream_query(executor: Chain, inputs: dict, token_stream) -> str:
+        """
+        Run the chain chunk by chunk, appending every chunk to the token
+        stream of the task as soon as the model produces it.
+        """
+        start_time = time.perf_counter()
+        chunks = []
+        for chunk in executor.stream(inputs):
+            if not chunks:
+                print_header_message(
+                    message=f"First token after {time.perf_counter() - start_time:.2f}s",
+                    app=Configuration.LANGCHAIN_QUEUE)
+            chunks.append(str(chunk))
+            token_stream.append(chunks[-1])
+        return "".join(chunks)
+
+    @staticmethod
+    def _invoke_query(executor: Chain, query, max_attempts=5, token_stream=None):
         final_result = {"STATE": False,
                         "DESCRIPTION": "Too many failed attempts"}
         for attempt in range(max_attempts):
+            inputs = {"question": query['question'],
+                      "references": query['references'],
+                      "format_instructions": parser,
+                      "max_tokens": 1000}
             try:
-                llm_result = executor.invoke({"question": query['question'],
-                                          "references": query['references'],
-                                          "format_instructions": parser,
-                                          "max_tokens": 1000})
+                if token_stream is None:
+                    llm_result = executor.invoke(inputs)
+                else:
+                    if attempt:
+                        # Clients drop the text of the failed attempt
+                        token_stream.reset()
+                    llm_result = LangchainChain._stream_query(executor,
+                                                              inputs,
+                                                              token_stream)
                 print_header_message(message=f"Response: {llm_result}",
                                      app=Configuration.LANGCHAIN_QUEUE)
                 llm_result_str = LangchainChain.preprocess_json_string(str(llm_result))
@@ -61,7 +95,8 @@ class LangchainChain:
                                   app=Configuration.LANGCHAIN_QUEUE)
         return final_result
 
-    def execute_chain_query(self, categories: list,  documents: list, user_query: str):
+    def execute_chain_query(self, categories: list,  documents: list, user_query: str,
+                            token_stream=None):
         
         query_prompt = {
             "question": user_query,
@@ -70,7 +105,9 @@ class LangchainChain:
         
         print_header_message(message=f"Query prompt is: {query_prompt}", app=Configuration.LANGCHAIN_QUEUE)
 
-        result = self._invoke_query(executor=self.llm_chain, query=query_prompt)
+        result = self._invoke_query(executor=self.llm_chain,
+                                    query=query_prompt,
+                                    token_stream=token_stream)
 
         if result['STATE']:
             return result
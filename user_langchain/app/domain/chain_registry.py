@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+
+from langchain_ms_config import Configuration
+from user_langchain.app import llm_metrics
+from user_langchain.app.domain.chain_invocations import LangchainChain
+from utils.outputs import print_bold_message, print_error
+
+
+class ChainRegistry:
+    """
+    Per-process LangchainChain, built once and reused by every task of the
+    worker together with its Ollama client and prompt pipeline.
+    """
+    _chain = None
+    _pid = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls) -> LangchainChain:
+        if cls._chain is not None and cls._pid == os.getpid():
+            return cls._chain
+
+        with cls._lock:
+            if cls._chain is None or cls._pid != os.getpid():
+                start_time = time.perf_counter()
+                cls._chain = LangchainChain()
+                cls._pid = os.getpid()
+                init_time = time.perf_counter() - start_time
+                llm_metrics.record_chain_created(Configuration.OLLAMA_MODEL, init_time)
+                print_bold_message(f"Chain for {Configuration.OLLAMA_MODEL} built in "
+                                   f"{init_time * 1000:.1f}ms",
+                                   Configuration.LANGCHAIN_QUEUE)
+            return cls._chain
+
+    @classmethod
+    def warm_up(cls):
+        """
+        Make Ollama load the model before the first task needs it. Returns
+        the warm-up timings, or None when Ollama could not be reached.
+        """
+        try:
+            return cls.get().llm_model.warm_up()
+        except Exception as e:
+            print_error(f"Could not warm up {Configuration.OLLAMA_MODEL}: {e}",
+                        Configuration.LANGCHAIN_QUEUE)
+            return None
+
+    @classmethod
+    def warm_up_in_background(cls) -> threading.Thread:
+        """
+        Warm the model up on a daemon thread, so a worker process reports
+        itself ready without waiting for Ollama to load the model.
+        """
+        thread = threading.Thread(target=cls.warm_up,
+                                  name="ollama-warm-up",
+                                  daemon=True)
+        thread.start()
+        return thread
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._chain = None
+            cls._pid = None
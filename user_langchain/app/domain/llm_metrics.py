@@ -0,0 +1,88 @@
+import redis
+
+from langchain_ms_config import Configuration
+from utils.outputs import print_warning_message
+
+METRICS_KEY = "llm_metrics:{model}"
+# Ollama reports its durations in nanoseconds
+NANOSECONDS = 1e9
+
+
+class LLMMetrics:
+    """
+    Model residency and latency counters shared by the langchain workers
+    through Redis. Every generation records the durations Ollama reports
+    for it; a generation whose model load took at least
+    cold_start_threshold seconds counts as a cold start.
+    """
+
+    def __init__(self, redis_client, cold_start_threshold: float = 1.0):
+        self._redis = redis_client
+        self.cold_start_threshold = cold_start_threshold
+
+    def _record(self, model: str, counters: dict, values: dict = None) -> None:
+        key = METRICS_KEY.format(model=model)
+        try:
+            pipeline = self._redis.pipeline(transaction=False)
+            for name, amount in counters.items():
+                if isinstance(amount, float):
+                    pipeline.hincrbyfloat(key, name, amount)
+                else:
+                    pipeline.hincrby(key, name, amount)
+            if values:
+                pipeline.hset(key, mapping=values)
+            pipeline.execute()
+        except redis.RedisError as e:
+            print_warning_message(f"Could not record LLM metrics: {e}",
+                                  Configuration.LANGCHAIN_QUEUE)
+
+    def record_generation(self, model: str, done: dict) -> None:
+        """
+        Record the final response of an Ollama generation.
+        """
+        load_s = done.get('load_duration', 0) / NANOSECONDS
+        cold_start = load_s >= self.cold_start_threshold
+        values = {'last_load_s': round(load_s, 3)}
+        if cold_start:
+            values['last_cold_start_s'] = round(load_s, 3)
+        self._record(model, {
+            'generations': 1,
+            'cold_starts': int(cold_start),
+            'load_s': load_s,
+            'prompt_eval_s': done.get('prompt_eval_duration', 0) / NANOSECONDS,
+            'eval_s': done.get('eval_duration', 0) / NANOSECONDS,
+            'eval_tokens': int(done.get('eval_count', 0)),
+            'total_s': done.get('total_duration', 0) / NANOSECONDS,
+        }, values)
+
+    def record_warm_up(self, model: str, seconds: float, load_s: float) -> None:
+        self._record(model, {'warm_ups': 1},
+                     {'last_warm_up_s': round(seconds, 3),
+                      'last_warm_up_load_s': round(load_s, 3)})
+
+    def record_chain_created(self, model: str, seconds: float) -> None:
+        self._record(model, {'chains_created': 1, 'chain_init_s': seconds})
+
+    def get(self, model: str) -> dict:
+        """
+        Counters of the model with averages per generation, empty when Redis
+        cannot be reached.
+        """
+        try:
+            raw = self._redis.hgetall(METRICS_KEY.format(model=model))
+        except redis.RedisError as e:
+            print_warning_message(f"Could not read LLM metrics: {e}",
+                                  Configuration.LANGCHAIN_QUEUE)
+            return {}
+        metrics = {name.decode('utf-8'): float(value) for name, value in raw.items()}
+        generations = metrics.get('generations', 0)
+        if generations:
+            metrics['avg_load_s'] = round(metrics.get('load_s', 0) / generations, 3)
+            # Until the first token Ollama loads the model and reads the prompt
+            metrics['avg_first_token_s'] = round(
+                (metrics.get('load_s', 0) + metrics.get('prompt_eval_s', 0)) / generations, 3)
+            metrics['avg_total_s'] = round(metrics.get('total_s', 0) / generations, 3)
+            metrics['cold_start_rate'] = round(metrics.get('cold_starts', 0) / generations, 3)
+        if metrics.get('eval_s'):
+            metrics['tokens_per_s'] = round(metrics.get('eval_tokens', 0) / metrics['eval_s'], 2)
+        return dict(metrics, model=model)
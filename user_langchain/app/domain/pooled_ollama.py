@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+import time
+
+from typing import Any, Iterator, List, Optional
+
+import requests
+
+from langchain_community.llms import Ollama
+from langchain_community.llms.ollama import OllamaEndpointNotFoundError
+from requests.adapters import HTTPAdapter
+
+from langchain_ms_config import Configuration
+from user_langchain.app import llm_metrics
+from utils.outputs import print_bold_message
+
+
+class OllamaSessions:
+    """
+    One HTTP session per worker process, keeping up to OLLAMA_POOL_SIZE
+    connections to Ollama open between generations.
+    """
+    _session = None
+    _pid = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls) -> requests.Session:
+        # A session inherited through fork would share its sockets
+        if cls._session is not None and cls._pid == os.getpid():
+            return cls._session
+
+        with cls._lock:
+            if cls._session is None or cls._pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=Configuration.OLLAMA_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                cls._session = session
+                cls._pid = os.getpid()
+            return cls._session
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._session = None
+            cls._pid = None
+
+
+class PooledOllama(Ollama):
+    """
+    Ollama LLM sending its requests through the worker's pooled session
+    and recording the durations Ollama reports for every generation.
+    """
+
+    def _create_stream(
+        self,
+        api_url: str,
+        payload: Any,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Iterator[str]:
+        # Same request as Ollama._create_stream, which always opens a new
+        # connection through requests.post
+        if self.stop is not None and stop is not None:
+            raise ValueError("`stop` found in both the input and default params.")
+        elif self.stop is not None:
+            stop = self.stop
+
+        params = self._default_params
+        for key in self._default_params:
+            if key in kwargs:
+                params[key] = kwargs[key]
+
+        if "options" in kwargs:
+            params["options"] = kwargs["options"]
+        else:
+            params["options"] = {
+                **params["options"],
+                "stop": stop,
+                **{k: v for k, v in kwargs.items() if k not in self._default_params},
+            }
+
+        if payload.get("messages"):
+            request_payload = {"messages": payload.get("messages", []), **params}
+        else:
+            request_payload = {"prompt": payload.get("prompt"),
+                               "images": payload.get("images", []),
+                               **params}
+
+        response = OllamaSessions.get().post(
+            url=api_url,
+            headers={"Content-Type": "application/json",
+                     **(self.headers if isinstance(self.headers, dict) else {})},
+            auth=self.auth,
+            json=request_payload,
+            stream=True,
+            timeout=self.timeout)
+        response.encoding = "utf-8"
+        if response.status_code != 200:
+            if response.status_code == 404:
+                raise OllamaEndpointNotFoundError(
+                    "Ollama call failed with status code 404. "
+                    "Maybe your model is not found "
+                    f"and you should pull the model with `ollama pull {self.model}`.")
+            raise ValueError(f"Ollama call failed with status code "
+                             f"{response.status_code}. Details: {response.text}")
+        return self._recorded(response.iter_lines(decode_unicode=True))
+
+    def _recorded(self, lines: Iterator[str]) -> Iterator[str]:
+        for line in lines:
+            if line:
+                stream_response = json.loads(line)
+                if stream_response.get("done"):
+                    llm_metrics.record_generation(self.model, stream_response)
+            yield line
+
+    def warm_up(self) -> dict:
+        """
+        Load the model into Ollama with an empty prompt, which generates
+        nothing, and keep it resident for keep_alive. Returns the time the
+        call took and the part of it Ollama spent loading the model.
+        """
+        start_time = time.perf_counter()
+        response = OllamaSessions.get().post(
+            url=f"{self.base_url}/api/generate",
+            json={"model": self.model,
+                  "prompt": "",
+                  "stream": False,
+                  "keep_alive": self.keep_alive},
+            timeout=self.timeout)
+        response.raise_for_status()
+        seconds = time.perf_counter() - start_time
+        load_s = response.json().get("load_duration", 0) / 1e9
+        llm_metrics.record_warm_up(self.model, seconds, load_s)
+        print_bold_message(
+            f"Model {self.model} warmed up in {seconds:.2f}s "
+            f"({load_s:.2f}s loading it), kept resident for {self.keep_alive}",
+            Configuration.LANGCHAIN_QUEUE)
+        return {"seconds": round(seconds, 3), "load_s": round(load_s, 3)}
@@ -1,9 +1,9 @@
-import time
 import json
 from user_langchain.celery_conf import celery
-from user_langchain.app import redis_client
-from user_langchain.app.domain.chain_invocations import LangchainChain
+from user_langchain.app import task_results
+from user_langchain.app.domain.chain_registry import ChainRegistry
 from utils.outputs import print_successful_message, print_error
+from utils.token_streams import sse_token_event
 from langchain_ms_config import Configuration
 from billiard.exceptions import TimeLimitExceeded
 
@@ -11,11 +11,19 @@ from billiard.exceptions import TimeLimitExceeded
 def sse_stream(task_id):
     """Stream events to the client."""
     try:
-        while True:
-            result = redis_client.get(task_id)
-
-            if result:
-                decoded_result = json.loads(result.decode('utf-8'))
+        # Flush the response headers so the client knows the stream is open
+        yield ": waiting\n\n"
+        # Blocks until the task publishes generated text or its result
+        for event in task_results.follow(task_id,
+                                         Configuration.SSE_HEARTBEAT_SECONDS,
+                                         Configuration.TOKEN_STREAMING):
+            if event['event'] == 'heartbeat':
+                # Comment line, ignored by clients, that surfaces disconnections
+                yield ": waiting\n\n"
+            elif event['event'] != 'result':
+                yield sse_token_event(event)
+            else:
+                decoded_result = event['result']
                 state = decoded_result.get('state')
 
                 if state == 'ERROR':
@@ -23,8 +31,6 @@ def sse_stream(task_id):
                 else:
                     yield f"data: {json.dumps({'STATE': 'SUCCESS', 'DESCRIPTION': decoded_result.get('result')})}\n\n"
                 break
-
-            time.sleep(2)
     
     except GeneratorExit:
         print_error(f"Client disconnected while waiting for task {task_id}",
@@ -35,37 +41,55 @@ def sse_stream(task_id):
         yield f"data: Error while processing task {task_id}\n\n"
 
 
-def error_handler(task_id, exc):
+def error_handler(task_id, exc, reply_to=None):
     print_error(message=f'{task_id} - Something went wrong: {exc}',
                 app=Configuration.LANGCHAIN_QUEUE)
-    redis_client.set(task_id,
-                     json.dumps({'state': 'ERROR', 'result': exc}))
+    _reply(task_id, reply_to, 'ERROR', exc)
+    task_results.store(task_id, 'ERROR', exc)
 
 
 @celery.task()
-def langchain_agent_invocation_task(categories, documents, user_query):
+def langchain_agent_invocation_task(categories, documents, user_query,
+                                    reply_to=None):
+    """
+    Answer a query from its documents. Searches handed over by the chroma
+    service pass reply_to, the result namespace and fields under which
+    their answer is stored for the chroma result stream.
+    """
     task_id = langchain_agent_invocation_task.request.id
     
+    token_stream = (task_results.token_stream(task_id)
+                    if Configuration.TOKEN_STREAMING else None)
     try:
-        result = LangchainChain().execute_chain_query(categories,
-                                                  documents,
-                                                  user_query)
+        result = ChainRegistry.get().execute_chain_query(categories,
+                                                         documents,
+                                                         user_query,
+                                                         token_stream=token_stream)
         print_successful_message(app=Configuration.LANGCHAIN_QUEUE,
                                  message=f"Task result: {result}")
-        _store_task_results(task_id, result)
+        _store_task_results(task_id, result, reply_to)
     except Exception as exc:
-        error_handler(task_id, str(exc))
+        error_handler(task_id, str(exc), reply_to)
         return None
     except TimeLimitExceeded as exc:
-        error_handler(task_id, str(exc))
+        error_handler(task_id, str(exc), reply_to)
         return None
 
     return result
 
 
-def _store_task_results(task_id, result) -> None:
-    print_successful_message(
-        message=f"Storing result of task: {task_id} on redis...",
-        app=Configuration.LANGCHAIN_QUEUE)
-    redis_client.set(task_id,
-                     json.dumps({'state': 'SUCCESS', 'result':json.dumps(result)}))
+def _reply(task_id, reply_to, state, description) -> None:
+    # Stored like the chroma search task stored the answers it waited for
+    if not reply_to:
+        return
+    task_results.for_namespace(reply_to['namespace']).store(
+        task_id,
+        'SUCCESS',
+        {"STATE": "SUCCESS",
+         "RESPONSE_DATA": {"STATE": state, "DESCRIPTION": description},
+         **reply_to.get('fields', {})})
+
+
+def _store_task_results(task_id, result, reply_to=None) -> None:
+    _reply(task_id, reply_to, 'SUCCESS', result)
+    task_results.store(task_id, 'SUCCESS', result)
@@ -1,9 +1,21 @@
 from celery import Celery
+from celery.signals import worker_process_init
 from langchain_ms_config import Configuration
 
 celery = Celery()
 
 
+@worker_process_init.connect
+def warm_up_llm(**kwargs):
+    # Imported here so the web process never builds the chain
+    from user_langchain.app.domain.chain_registry import ChainRegistry
+    ChainRegistry.get()
+    if Configuration.OLLAMA_WARM_UP:
+        # Loading the model takes longer than Celery waits for a new
+        # process, which would be killed and respawned
+        ChainRegistry.warm_up_in_background()
+
+
 def celery_instantiation(app):
     celery.conf.update({
         'broker_url': Configuration.CELERY_BROKER_URL,
@@ -13,6 +25,7 @@ def celery_instantiation(app):
         'accept_content': ['json'],
         'timezone': 'UTC',
         'enable_utc': True,
+        'worker_proc_alive_timeout': Configuration.WORKER_PROC_ALIVE_TIMEOUT,
         'task_queues': {
             app.config.get('LANGCHAIN_QUEUE', 'langchain_queue'): {
                 'exchange': 'langchain_exchange',
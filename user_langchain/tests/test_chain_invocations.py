@@ -133,3 +133,34 @@ def test_invoke_query_validation_error_exception(langchain_chain):
             message_color=OutputColors.WARNING.value,
             app=Configuration.LANGCHAIN_QUEUE
         )
+
+
+def test_invoke_query_streams_tokens(langchain_chain):
+    token_stream = MagicMock()
+    mock_executor = MagicMock()
+    mock_executor.stream.return_value = iter(['{"answer": ', 'None', '}'])
+
+    with patch('utils.outputs.print_console_message'):
+        result = langchain_chain._invoke_query(
+            mock_executor,
+            {"question": "What is an action?", "references": []},
+            token_stream=token_stream)
+
+    mock_executor.invoke.assert_not_called()
+    assert token_stream.append.call_args_list == [call('{"answer": '), call('None'), call('}')]
+    assert result['RESPONSE'] == '{"answer": null}'
+
+
+def test_invoke_query_resets_stream_on_retry(langchain_chain):
+    token_stream = MagicMock()
+    mock_executor = MagicMock()
+    mock_executor.stream.side_effect = [Exception("Connection lost"), iter(["answer"])]
+
+    with patch('utils.outputs.print_console_message'):
+        result = langchain_chain._invoke_query(
+            mock_executor,
+            {"question": "What is an action?", "references": []},
+            token_stream=token_stream)
+
+    token_stream.reset.assert_called_once()
+    assert result['STATE'] is True
@@ -0,0 +1,55 @@
+import pytest
+import redis
+
+from user_langchain.app.domain.llm_metrics import LLMMetrics, METRICS_KEY
+
+
+def _done(load_s, eval_count=20):
+    return {"done": True,
+            "load_duration": int(load_s * 1e9),
+            "prompt_eval_duration": int(0.5e9),
+            "eval_duration": int(2e9),
+            "eval_count": eval_count,
+            "total_duration": int((load_s + 2.5) * 1e9)}
+
+
+def test_generations_count_cold_starts(fake_redis):
+    metrics = LLMMetrics(fake_redis, cold_start_threshold=1.0)
+
+    metrics.record_generation("llama3", _done(30))
+    metrics.record_generation("llama3", _done(0.01))
+
+    result = metrics.get("llama3")
+    assert result['generations'] == 2
+    assert result['cold_starts'] == 1
+    assert result['cold_start_rate'] == 0.5
+    assert result['last_cold_start_s'] == 30
+    assert result['last_load_s'] == pytest.approx(0.01)
+    assert result['avg_first_token_s'] == pytest.approx((30.01 + 1.0) / 2, abs=1e-3)
+    assert result['tokens_per_s'] == 10
+
+
+def test_warm_ups_and_chains_are_recorded(fake_redis):
+    metrics = LLMMetrics(fake_redis)
+
+    metrics.record_chain_created("llama3", 0.2)
+    metrics.record_warm_up("llama3", 31.5, 30.0)
+
+    stored = fake_redis.hgetall(METRICS_KEY.format(model="llama3"))
+    assert stored[b'chains_created'] == b'1'
+    assert stored[b'warm_ups'] == b'1'
+    assert float(stored[b'last_warm_up_load_s']) == 30.0
+
+
+def test_unreachable_redis_is_not_fatal():
+    class BrokenRedis:
+        def pipeline(self, transaction=True):
+            raise redis.ConnectionError("down")
+
+        def hgetall(self, key):
+            raise redis.ConnectionError("down")
+
+    metrics = LLMMetrics(BrokenRedis())
+
+    metrics.record_generation("llama3", _done(1))
+    assert metrics.get("llama3") == {}
@@ -0,0 +1,100 @@
+import json
+import threading
+import time
+
+from unittest.mock import MagicMock, patch
+
+from user_langchain.app.domain.chain_invocations import keep_alive
+from user_langchain.app.domain.chain_registry import ChainRegistry
+from user_langchain.app.domain.pooled_ollama import OllamaSessions, PooledOllama
+
+
+def _llm():
+    return PooledOllama(model="llama3", base_url="http://ollama:11434", keep_alive="30m")
+
+
+def test_session_is_shared_by_the_process():
+    OllamaSessions.clear()
+
+    assert OllamaSessions.get() is OllamaSessions.get()
+    OllamaSessions.clear()
+
+
+@patch("user_langchain.app.domain.pooled_ollama.llm_metrics")
+@patch("user_langchain.app.domain.pooled_ollama.OllamaSessions")
+def test_generation_goes_through_pooled_session(sessions_mock, metrics_mock):
+    done = {"response": "", "done": True, "load_duration": 10}
+    response = MagicMock(status_code=200)
+    response.iter_lines.return_value = iter([json.dumps({"response": "An", "done": False}),
+                                             json.dumps({"response": " action", "done": False}),
+                                             json.dumps(done)])
+    sessions_mock.get.return_value.post.return_value = response
+
+    assert _llm().invoke("What is an action?") == "An action"
+
+    request = sessions_mock.get.return_value.post.call_args.kwargs
+    assert request['url'] == "http://ollama:11434/api/generate"
+    assert request['json']['keep_alive'] == "30m"
+    metrics_mock.record_generation.assert_called_once_with("llama3", done)
+
+
+@patch("user_langchain.app.domain.pooled_ollama.llm_metrics")
+@patch("user_langchain.app.domain.pooled_ollama.OllamaSessions")
+def test_warm_up_loads_the_model(sessions_mock, metrics_mock):
+    sessions_mock.get.return_value.post.return_value.json.return_value = {"load_duration": int(30e9)}
+
+    result = _llm().warm_up()
+
+    request = sessions_mock.get.return_value.post.call_args.kwargs
+    assert request['json'] == {"model": "llama3", "prompt": "", "stream": False, "keep_alive": "30m"}
+    assert result['load_s'] == 30
+    metrics_mock.record_warm_up.assert_called_once()
+
+
+@patch("user_langchain.app.domain.chain_registry.llm_metrics")
+def test_chain_is_built_once_per_process(metrics_mock):
+    ChainRegistry.clear()
+
+    assert ChainRegistry.get() is ChainRegistry.get()
+    metrics_mock.record_chain_created.assert_called_once()
+    ChainRegistry.clear()
+
+
+@patch("user_langchain.app.domain.chain_registry.llm_metrics")
+def test_failed_warm_up_does_not_stop_the_worker(metrics_mock):
+    ChainRegistry.clear()
+
+    with patch.object(PooledOllama, 'warm_up', side_effect=ConnectionError("Ollama is down")):
+        assert ChainRegistry.warm_up() is None
+    ChainRegistry.clear()
+
+
+def test_keep_alive_values():
+    assert keep_alive("30m") == "30m"
+    assert keep_alive("-1") == -1
+    assert keep_alive("300") == 300
+
+
+
+@patch("user_langchain.celery_conf.Configuration")
+def test_worker_init_does_not_wait_for_warm_up(configuration_mock):
+    from user_langchain.celery_conf import warm_up_llm
+
+    configuration_mock.OLLAMA_WARM_UP = True
+    loading = threading.Event()
+    chain = MagicMock()
+    chain.llm_model.warm_up.side_effect = lambda: loading.wait(5)
+    threads = []
+    start_background = ChainRegistry.warm_up_in_background
+
+    with patch.object(ChainRegistry, "get", return_value=chain), \
+            patch.object(ChainRegistry, "warm_up_in_background",
+                         side_effect=lambda: threads.append(start_background())):
+        start_time = time.perf_counter()
+        warm_up_llm()
+        elapsed = time.perf_counter() - start_time
+        loading.set()
+        threads[0].join(5)
+
+    assert elapsed < 1
+    chain.llm_model.warm_up.assert_called_once()
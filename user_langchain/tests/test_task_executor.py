@@ -0,0 +1,38 @@
+from unittest.mock import MagicMock, call, patch
+
+from user_langchain.app import task_executor
+
+
+def test_handed_off_answer_is_stored_for_chroma():
+    task_results = MagicMock()
+    answer = {"STATE": True, "QUERY_MADE": "What is an action?", "RESPONSE": "..."}
+
+    with patch.object(task_executor, 'ChainRegistry') as chain_mock, \
+         patch.object(task_executor, 'task_results', task_results):
+        chain_mock.get.return_value.execute_chain_query.return_value = answer
+        task_executor.langchain_agent_invocation_task.apply(
+            args=[[], ["doc a"], "What is an action?"],
+            kwargs={"reply_to": {"namespace": "chroma_queue",
+                                 "fields": {"RETRIEVAL_MODE": "terms"}}},
+            task_id="task-id")
+
+    task_results.for_namespace.assert_called_once_with("chroma_queue")
+    task_results.for_namespace.return_value.store.assert_called_once_with(
+        "task-id", 'SUCCESS',
+        {"STATE": "SUCCESS",
+         "RESPONSE_DATA": {"STATE": 'SUCCESS', "DESCRIPTION": answer},
+         "RETRIEVAL_MODE": "terms"})
+    assert task_results.store.call_args == call("task-id", 'SUCCESS', answer)
+
+
+def test_direct_requests_store_only_their_own_result():
+    task_results = MagicMock()
+
+    with patch.object(task_executor, 'ChainRegistry') as chain_mock, \
+         patch.object(task_executor, 'task_results', task_results):
+        chain_mock.get.return_value.execute_chain_query.side_effect = Exception("Ollama is down")
+        task_executor.langchain_agent_invocation_task.apply(
+            args=[[], ["doc a"], "What is an action?"], task_id="task-id")
+
+    task_results.for_namespace.assert_not_called()
+    task_results.store.assert_called_once_with("task-id", 'ERROR', "Ollama is down")
@@ -0,0 +1,55 @@
+RESULT_KEY = "{namespace}:task_result:{task_id}"
+DONE_KEY = "{namespace}:task_done:{task_id}"
+
+
+def publish_task_result(redis_client, task_id: str, value,
+                        notify_ttl: int = 600, result_ttl: int = None,
+                        namespace: str = "tasks", pipeline=None) -> None:
+    """
+    Store the result of a task and wake whoever waits for it. The result and
+    a token on the task's done list are written in one transaction, so a
+    waiter popping the token always finds the result. The token stays on the
+    list until popped or notify_ttl seconds pass, so a waiter that starts
+    late does not miss it. The result expires after result_ttl seconds.
+
+    Keys are prefixed with the namespace of the service, since the chroma
+    search task hands its own id to the langchain task. Commands queued on
+    the given pipeline are sent in the same transaction.
+    """
+    done_key = DONE_KEY.format(namespace=namespace, task_id=task_id)
+    pipeline = pipeline if pipeline is not None else redis_client.pipeline()
+    pipeline.set(RESULT_KEY.format(namespace=namespace, task_id=task_id),
+                 value, ex=result_ttl)
+    pipeline.rpush(done_key, 1)
+    pipeline.expire(done_key, notify_ttl)
+    pipeline.execute()
+
+
+def read_task_result(redis_client, task_id: str, namespace: str = "tasks"):
+    return redis_client.get(RESULT_KEY.format(namespace=namespace, task_id=task_id))
+
+
+def wait_for_task_result(redis_client, task_id: str, timeout: int,
+                         namespace: str = "tasks"):
+    """
+    Block on the task's done list for up to timeout seconds, without
+    polling, and return the stored result or None if the task has not
+    finished yet.
+    """
+    result = read_task_result(redis_client, task_id, namespace)
+    if result is not None:
+        return result
+    done_key = DONE_KEY.format(namespace=namespace, task_id=task_id)
+    if redis_client.blpop([done_key], timeout=timeout) is None:
+        return None
+    return read_task_result(redis_client, task_id, namespace)
+
+
+def sse_data(payload: str) -> str:
+    """
+    Payload of the last data line of a server sent events response, skipping
+    the keep-alive comments and token events sent before it.
+    """
+    data_lines = [line[len("data:"):].strip()
+                  for line in payload.splitlines() if line.startswith("data:")]
+    return data_lines[-1] if data_lines else payload.strip()
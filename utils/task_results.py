@@ -0,0 +1,186 @@
+import copy
+import json
+import threading
+import zlib
+
+from utils.outputs import print_bold_message, print_successful_message
+from utils.task_notifications import (publish_task_result,
+                                      read_task_result,
+                                      wait_for_task_result)
+from utils.token_streams import TokenStream
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SERIALIZERS = ("json", "msgpack")
+# First byte of a stored value names its codec, the second whether the
+# rest is zlib compressed
+_CODECS = {"json": b"j", "msgpack": b"m"}
+_COMPRESSED = b"z"
+_PLAIN = b"-"
+
+
+class TaskResultStore:
+    """
+    Results of the tasks of a service, read by its result streams. Every
+    task writes its result once, as {'state': ..., 'result': ...} encoded
+    in a single layer, and the value expires after ttl seconds. Values of
+    at least compress_min_bytes are zlib compressed, which pays off for the
+    document payloads of searches. Keys are prefixed with the service
+    namespace. With token_streams set, storing a result also closes the
+    token stream of the task.
+    """
+
+    def __init__(self,
+                 redis_client,
+                 app: str,
+                 ttl: int = 3600,
+                 notify_ttl: int = 600,
+                 serializer: str = "json",
+                 compress_min_bytes: int = 16384,
+                 namespace: str = None,
+                 token_streams: bool = False,
+                 token_stream_ttl: int = 600):
+        if serializer not in SERIALIZERS:
+            raise ValueError(f"Unknown result serializer {serializer}, "
+                             f"expected one of {', '.join(SERIALIZERS)}")
+        if serializer == "msgpack" and msgpack is None:
+            print_bold_message("msgpack is not installed, storing results as JSON",
+                               app)
+            serializer = "json"
+        self.redis_client = redis_client
+        self.app = app
+        self.ttl = ttl
+        self.notify_ttl = notify_ttl
+        self.serializer = serializer
+        self.compress_min_bytes = compress_min_bytes
+        self.namespace = namespace or app
+        self.token_streams = token_streams
+        self.token_stream_ttl = token_stream_ttl
+        self._lock = threading.Lock()
+        self._stats = {'stored': 0, 'bytes': 0, 'raw_bytes': 0,
+                       'compressed': 0, 'largest_bytes': 0}
+
+    @classmethod
+    def from_configuration(cls, redis_client, configuration, app: str) -> "TaskResultStore":
+        return cls(redis_client,
+                   app,
+                   ttl=configuration.RESULT_TTL,
+                   notify_ttl=configuration.TASK_NOTIFY_TTL,
+                   serializer=configuration.RESULT_SERIALIZER,
+                   compress_min_bytes=configuration.RESULT_COMPRESS_MIN_BYTES,
+                   token_streams=configuration.TOKEN_STREAMING,
+                   token_stream_ttl=configuration.TOKEN_STREAM_TTL)
+
+    def for_namespace(self, namespace: str) -> "TaskResultStore":
+        """
+        The same store writing under the keys of another service.
+        """
+        store = copy.copy(self)
+        store.namespace = namespace
+        return store
+
+    def encode(self, payload: dict) -> tuple[bytes, int]:
+        """
+        Stored form of a payload and its size before compression.
+        """
+        if self.serializer == "msgpack":
+            data = msgpack.packb(payload, use_bin_type=True)
+        else:
+            data = json.dumps(payload).encode('utf-8')
+        raw_size = len(data)
+        if self.compress_min_bytes and raw_size >= self.compress_min_bytes:
+            return _CODECS[self.serializer] + _COMPRESSED + zlib.compress(data), raw_size
+        return _CODECS[self.serializer] + _PLAIN + data, raw_size
+
+    @staticmethod
+    def decode(value: bytes) -> dict:
+        codec, compression, data = value[:1], value[1:2], value[2:]
+        if compression == _COMPRESSED:
+            data = zlib.decompress(data)
+        if codec == _CODECS["msgpack"]:
+            return msgpack.unpackb(data, raw=False)
+        return json.loads(data)
+
+    def store(self, task_id: str, state: str, result) -> int:
+        """
+        Write the result of a task and wake its result stream. Returns the
+        stored size in bytes.
+        """
+        value, raw_size = self.encode({'state': state, 'result': result})
+        pipeline = self.redis_client.pipeline()
+        if self.token_streams:
+            self.token_stream(task_id).end(pipeline)
+        publish_task_result(self.redis_client, task_id, value,
+                            notify_ttl=self.notify_ttl,
+                            result_ttl=self.ttl,
+                            namespace=self.namespace,
+                            pipeline=pipeline)
+        with self._lock:
+            self._stats['stored'] += 1
+            self._stats['bytes'] += len(value)
+            self._stats['raw_bytes'] += raw_size
+            self._stats['compressed'] += value[1:2] == _COMPRESSED
+            self._stats['largest_bytes'] = max(self._stats['largest_bytes'],
+                                               len(value))
+        print_successful_message(
+            message=(f"Stored result of task: {task_id} on redis, "
+                     f"{len(value)} bytes ({raw_size} before compression), "
+                     f"expires in {self.ttl}s"),
+            app=self.app)
+        return len(value)
+
+    def token_stream(self, task_id: str) -> TokenStream:
+        return TokenStream(self.redis_client, task_id, self.token_stream_ttl)
+
+    def read(self, task_id: str):
+        value = read_task_result(self.redis_client, task_id, self.namespace)
+        return None if value is None else self.decode(value)
+
+    def wait(self, task_id: str, timeout: int):
+        """
+        Block up to timeout seconds for the result of a task. Returns the
+        decoded payload, or None if the task has not finished yet.
+        """
+        value = wait_for_task_result(self.redis_client, task_id, timeout,
+                                     self.namespace)
+        return None if value is None else self.decode(value)
+
+    def follow(self, task_id: str, heartbeat_seconds: float,
+               stream_tokens: bool = False):
+        """
+        Events of a running task for its result stream: the generated text
+        as it arrives when stream_tokens is set, a heartbeat every
+        heartbeat_seconds without news, and finally
+        {'event': 'result', 'result': payload}.
+        """
+        if stream_tokens:
+            tokens = self.token_stream(task_id)
+            last_id = '0'
+            while True:
+                events, last_id, ended = tokens.read(last_id, heartbeat_seconds)
+                yield from events
+                if ended:
+                    break
+                if not events:
+                    # The task may not stream at all
+                    result = self.read(task_id)
+                    if result is not None:
+                        yield {'event': 'result', 'result': result}
+                        return
+                    yield {'event': 'heartbeat'}
+
+        while True:
+            result = self.wait(task_id, heartbeat_seconds)
+            if result is not None:
+                yield {'event': 'result', 'result': result}
+                return
+            yield {'event': 'heartbeat'}
+
+    def stats(self) -> dict:
+        with self._lock:
+            stored = self._stats['stored']
+            return dict(self._stats,
+                        average_bytes=round(self._stats['bytes'] / stored) if stored else 0)
@@ -0,0 +1,78 @@
+import json
+
+TOKENS_KEY = "task_tokens:{task_id}"
+
+
+class TokenStream:
+    """
+    Text generated for a task, as a Redis stream keyed by the task id. The
+    langchain task appends chunks as the model produces them and the result
+    streams of both services, which share the task id, read them as they
+    arrive. A reset entry drops the text of a failed attempt and an end
+    entry closes the stream.
+    """
+
+    def __init__(self, redis_client, task_id: str, ttl: int = 600,
+                 maxlen: int = 10000):
+        self.redis_client = redis_client
+        self.task_id = task_id
+        self.key = TOKENS_KEY.format(task_id=task_id)
+        self.ttl = ttl
+        self.maxlen = maxlen
+        self._expiry_set = False
+
+    def _add(self, fields: dict, pipeline=None) -> None:
+        target = pipeline if pipeline is not None else self.redis_client.pipeline()
+        target.xadd(self.key, fields, maxlen=self.maxlen, approximate=True)
+        if not self._expiry_set or pipeline is not None:
+            target.expire(self.key, self.ttl)
+        if pipeline is None:
+            target.execute()
+            self._expiry_set = True
+
+    def append(self, text: str) -> None:
+        if text:
+            self._add({'text': text})
+
+    def reset(self) -> None:
+        self._add({'reset': 1})
+
+    def end(self, pipeline=None) -> None:
+        """
+        Close the stream, on the given pipeline when it has to go out with
+        the result of the task.
+        """
+        self._add({'end': 1}, pipeline)
+
+    def read(self, last_id: str, block_seconds: float) -> tuple[list[dict], str, bool]:
+        """
+        Entries after last_id, waiting up to block_seconds for the first one.
+        Returns the events, the id to read from next and whether the stream
+        has ended.
+        """
+        response = self.redis_client.xread({self.key: last_id},
+                                           block=max(1, int(block_seconds * 1000)))
+        events = []
+        ended = False
+        for _, entries in response or []:
+            for entry_id, fields in entries:
+                last_id = entry_id
+                fields = {_text(key): _text(value) for key, value in fields.items()}
+                if 'end' in fields:
+                    ended = True
+                    break
+                if 'reset' in fields:
+                    events.append({'event': 'reset'})
+                else:
+                    events.append({'event': 'token', 'text': fields['text']})
+        return events, last_id, ended
+
+
+def _text(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def sse_token_event(event: dict) -> str:
+    name = event['event']
+    data = {'text': event['text']} if name == 'token' else {}
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"